@@ -0,0 +1,526 @@
+from googleapiclient.errors import HttpError
+import httplib2
+import threading
+import random
+import json
+import time
+import copy
+import re
+
+# Offline stand-in for the Google Sheets client built in RunAndBunUpload.py (build('sheets', 'v4', ...))
+# Every call is recorded, latency and errors can be simulated, and batchUpdate requests are applied on an in-memory grid :
+#
+#   fakeService = FakeSheetsService(latency = 0.2, errorRate = 0.05)
+#   RunAndBunUpload.sheetsService = fakeService
+#
+# Only the requests and ranges used by RunAndBunStats are supported, anything else is answered with a 400 like an invalid request
+
+SUPPORTED_REQUESTS = ["repeatCell", "updateCells", "mergeCells", "unmergeCells", "updateBorders", "updateDimensionProperties",
+                      "insertDimension", "deleteDimension", "copyPaste", "addSheet", "deleteSheet"]
+
+
+def httpError(status, message, retryAfter = None):
+    headers = {"status": status}
+
+    if retryAfter is not None:
+        headers["retry-after"] = str(retryAfter)
+
+    return HttpError(httplib2.Response(headers), json.dumps({"error": {"code": status, "message": message}}).encode())
+
+# Parse a "fields" mask into a tree : "userEnteredValue,userEnteredFormat(textFormat,backgroundColor)"
+# gives {"userEnteredValue": {}, "userEnteredFormat": {"textFormat": {}, "backgroundColor": {}}}
+def parseFieldsTree(fields):
+    fieldsTree = {}
+
+    for field, subFields in re.findall(r"([\w*]+)(?:\(([^)]*)\))?", fields):
+        fieldsTree.setdefault(field, {}).update({subField.strip(): {} for subField in subFields.split(",") if subField.strip()})
+
+    return fieldsTree
+
+# Copy the fields of the mask from source to target, fields missing from source are cleared
+def applyFields(target, source, fieldsTree):
+    if "*" in fieldsTree:
+        target.clear()
+        target.update(copy.deepcopy(source))
+        return
+
+    for field, subFields in fieldsTree.items():
+        value = source.get(field) if isinstance(source, dict) else None
+
+        if subFields:
+            if not isinstance(target.get(field), dict):
+                target[field] = {}
+
+            applyFields(target[field], value or {}, subFields)
+
+            if not target[field]:
+                del target[field]
+
+        elif value is None or value == {} or value == []:
+            target.pop(field, None)
+
+        else:
+            target[field] = copy.deepcopy(value)
+
+def columnIndex(letters):
+    index = 0
+
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord("A") + 1
+
+    return index - 1
+
+# Formulas are not evaluated, their text is returned as is
+def displayedValue(cell):
+    value = cell.get("userEnteredValue", {})
+
+    for valueType in ["stringValue", "formulaValue", "numberValue", "boolValue"]:
+        if valueType in value:
+            return str(value[valueType]) if valueType != "boolValue" else str(value[valueType]).upper()
+
+    return ""
+
+
+class FakeSheet:
+    def __init__(self, sheetId, title, hidden = False, rowCount = 1000, columnCount = 26):
+        self.properties = {"sheetId": sheetId, "title": title, "hidden": hidden,
+                           "gridProperties": {"rowCount": rowCount, "columnCount": columnCount}}
+        self.cells = {}
+        self.merges = set()
+        self.columnSizes = {}
+        self.rowSizes = {}
+        self.ownedCells = None
+
+    # Copy a batchUpdate is applied on : cells are shared with the sheet until written
+    def draft(self):
+        draft = copy.copy(self)
+        draft.properties = copy.deepcopy(self.properties)
+        draft.cells = dict(self.cells)
+        draft.merges = set(self.merges)
+        draft.columnSizes = dict(self.columnSizes)
+        draft.rowSizes = dict(self.rowSizes)
+        draft.ownedCells = set()
+        return draft
+
+    # Cell content to write to, copied first if it is still shared with the sheet the draft comes from
+    def writableCell(self, cell):
+        content = self.cells.get(cell)
+
+        if content is None or (self.ownedCells is not None and id(content) not in self.ownedCells):
+            content = self.cells[cell] = copy.deepcopy(content) if content is not None else {}
+
+            if self.ownedCells is not None:
+                self.ownedCells.add(id(content))
+
+        return content
+
+    def cellsIn(self, area):
+        return [(row, col) for row in range(area[0], area[1]) for col in range(area[2], area[3])]
+
+    def hiddenCells(self):
+        return {(row, col) for merge in self.merges for row, col in self.cellsIn(merge)[1:]}
+
+    def overlappingMerges(self, area):
+        return [merge for merge in self.merges if merge[0] < area[1] and area[0] < merge[1] and merge[2] < area[3] and area[2] < merge[3]]
+
+    def merge(self, area):
+        if self.overlappingMerges(area) and area not in self.merges:
+            raise httpError(400, f"Invalid requests[mergeCells]: merge {area} overlaps an existing merge")
+
+        self.merges.add(area)
+
+        # Merging keeps the top-left value only
+        for cell in self.cellsIn(area)[1:]:
+            if cell in self.cells:
+                self.writableCell(cell).pop("userEnteredValue", None)
+                self.writableCell(cell).pop("textFormatRuns", None)
+
+    def insert(self, dimension, startIndex, endIndex, inheritFromBefore):
+        number = endIndex - startIndex
+        axis = 0 if dimension == "ROWS" else 1
+
+        def shift(position):
+            return position + number if position >= startIndex else position
+
+        self.cells = {(shift(row), col) if axis == 0 else (row, shift(col)): cell for (row, col), cell in self.cells.items()}
+        self.merges = {(shift(merge[0]), merge[1] + number if merge[1] > startIndex else merge[1], merge[2], merge[3]) if axis == 0 else
+                       (merge[0], merge[1], shift(merge[2]), merge[3] + number if merge[3] > startIndex else merge[3]) for merge in self.merges}
+
+        # New rows/columns take the format of their neighbour
+        neighbour = startIndex - 1 if inheritFromBefore else endIndex
+        for (row, col), cell in list(self.cells.items()):
+            if (row if axis == 0 else col) == neighbour and "userEnteredFormat" in cell:
+                for position in range(startIndex, endIndex):
+                    self.cells[(position, col) if axis == 0 else (row, position)] = {"userEnteredFormat": copy.deepcopy(cell["userEnteredFormat"])}
+
+        self.properties["gridProperties"]["rowCount" if axis == 0 else "columnCount"] += number
+
+    def delete(self, dimension, startIndex, endIndex):
+        number = endIndex - startIndex
+        axis = 0 if dimension == "ROWS" else 1
+
+        def shift(position):
+            return position - number if position >= endIndex else position
+
+        self.cells = {(shift(row), col) if axis == 0 else (row, shift(col)): cell for (row, col), cell in self.cells.items()
+                      if not startIndex <= (row if axis == 0 else col) < endIndex}
+        self.merges = {(shift(merge[0]), shift(merge[1]), merge[2], merge[3]) if axis == 0 else (merge[0], merge[1], shift(merge[2]), shift(merge[3]))
+                       for merge in self.merges if not (merge[axis * 2] < endIndex and startIndex < merge[axis * 2 + 1])}
+
+        self.properties["gridProperties"]["rowCount" if axis == 0 else "columnCount"] -= number
+
+
+class FakeSpreadsheet:
+    def __init__(self, spreadsheetId):
+        self.spreadsheetId = spreadsheetId
+        self.sheets = {}
+        self.copiedSheets = None
+
+    # Copy a batchUpdate is applied on : each sheet is only drafted when a request touches it
+    def draft(self):
+        draft = FakeSpreadsheet(self.spreadsheetId)
+        draft.sheets = dict(self.sheets)
+        draft.copiedSheets = set()
+        return draft
+
+    def sheet(self, sheetId, autoCreate):
+        if sheetId not in self.sheets:
+            if not autoCreate:
+                raise httpError(400, f"Invalid requests : No grid with id: {sheetId}")
+
+            self.sheets[sheetId] = FakeSheet(sheetId, f"Sheet{len(self.sheets) + 1}", columnCount = 500)
+
+        elif self.copiedSheets is not None and sheetId not in self.copiedSheets:
+            self.sheets[sheetId] = self.sheets[sheetId].draft()
+
+        if self.copiedSheets is not None:
+            self.copiedSheets.add(sheetId)
+
+        return self.sheets[sheetId]
+
+    def sheetByTitle(self, title):
+        for sheet in self.sheets.values():
+            if sheet.properties["title"] == title:
+                return sheet
+
+        raise httpError(400, f"Unable to parse range: {title}")
+
+
+class FakeHttpRequest:
+    def __init__(self, service, method, spreadsheetId, function, payload = None):
+        self.service = service
+        self.method = method
+        self.spreadsheetId = spreadsheetId
+        self.function = function
+        self.payload = payload
+
+    def execute(self, num_retries = 0):
+        return self.service.call(self.method, self.spreadsheetId, self.function, self.payload)
+
+
+class FakeValuesResource:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return FakeHttpRequest(self.service, "values.get", spreadsheetId, lambda: self.service.readValues(spreadsheetId, range))
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return FakeHttpRequest(self.service, "values.batchGet", spreadsheetId,
+                               lambda: {"spreadsheetId": spreadsheetId, "valueRanges": [self.service.readValues(spreadsheetId, a1Range) for a1Range in ranges]})
+
+
+class FakeSpreadsheetsResource:
+    def __init__(self, service):
+        self.service = service
+
+    def values(self):
+        return FakeValuesResource(self.service)
+
+    def get(self, spreadsheetId, **kwargs):
+        return FakeHttpRequest(self.service, "get", spreadsheetId, lambda: self.service.readProperties(spreadsheetId))
+
+    def batchUpdate(self, spreadsheetId, body):
+        return FakeHttpRequest(self.service, "batchUpdate", spreadsheetId, lambda: self.service.applyRequests(spreadsheetId, body["requests"]), body)
+
+
+class FakeSheetsService:
+    def __init__(self, latency = 0, latencyJitter = 0, errorRate = 0, errorStatus = 429, errorMethods = ["batchUpdate", "get", "values.get", "values.batchGet"],
+                 retryAfter = None, autoCreateSheets = True, seed = 0):
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        self.errorRate = errorRate
+        self.errorMethods = errorMethods
+        self.errorStatus = errorStatus
+        self.retryAfter = retryAfter
+        self.autoCreateSheets = autoCreateSheets
+        self.random = random.Random(seed)
+        self.scheduledErrors = []
+        self.spreadsheetsById = {}
+        self.calls = []
+        self.lock = threading.RLock()
+
+    def spreadsheets(self):
+        return FakeSpreadsheetsResource(self)
+
+    def spreadsheet(self, spreadsheetId):
+        if spreadsheetId not in self.spreadsheetsById:
+            self.spreadsheetsById[spreadsheetId] = FakeSpreadsheet(spreadsheetId)
+
+        return self.spreadsheetsById[spreadsheetId]
+
+    # Fail the next calls with these statuses, before any random error : None lets a call through
+    # methods : only the calls of these methods take the scheduled statuses, the other ones go through
+    def scheduleErrors(self, *statuses, methods = None):
+        with self.lock:
+            self.scheduledErrors.extend((status, methods) for status in statuses)
+
+    def call(self, method, spreadsheetId, function, payload):
+        startTime = time.perf_counter()
+        record = {"method": method, "spreadsheetId": spreadsheetId, "requests": len(payload["requests"]) if payload else 0,
+                  "bytes": len(json.dumps(payload, separators = (",", ":"))) if payload else 0, "status": 200}
+
+        with self.lock:
+            self.calls.append(record)
+            scheduled = next((entry for entry in self.scheduledErrors if entry[1] is None or method in entry[1]), None)
+
+            if scheduled:
+                self.scheduledErrors.remove(scheduled)
+
+            status = scheduled[0] if scheduled else self.errorStatus if method in self.errorMethods and self.random.random() < self.errorRate else None
+            delay = self.latency + self.random.uniform(0, self.latencyJitter)
+
+        # Latency is simulated outside of the lock so concurrent calls overlap like they would with Google
+        if delay:
+            time.sleep(delay)
+
+        try:
+            if status:
+                raise httpError(status, "Simulated error", self.retryAfter)
+
+            with self.lock:
+                return function()
+
+        except HttpError as e:
+            record["status"] = e.resp.status
+            raise
+
+        finally:
+            record["seconds"] = time.perf_counter() - startTime
+
+    # Number of calls, requests and bytes per method, plus the errors returned
+    def summary(self):
+        summary = {}
+
+        for record in self.calls:
+            methodSummary = summary.setdefault(record["method"], {"calls": 0, "requests": 0, "bytes": 0, "errors": 0})
+            methodSummary["calls"] += 1
+            methodSummary["requests"] += record["requests"]
+            methodSummary["bytes"] += record["bytes"]
+            methodSummary["errors"] += record["status"] != 200
+
+        return summary
+
+    def readProperties(self, spreadsheetId):
+        return {"spreadsheetId": spreadsheetId,
+                "sheets": [{"properties": copy.deepcopy(sheet.properties)} for sheet in self.spreadsheet(spreadsheetId).sheets.values()]}
+
+    # Supports full columns ("B:B", "Sprites!A:B") and bounded ranges ("A1:C10"), with the first visible sheet as default
+    def readValues(self, spreadsheetId, a1Range):
+        spreadsheet = self.spreadsheet(spreadsheetId)
+        title, _, cellsRange = a1Range.rpartition("!")
+        sheet = spreadsheet.sheetByTitle(title.strip("'")) if title else next((sheet for sheet in spreadsheet.sheets.values() if not sheet.properties["hidden"]), None)
+
+        match = re.fullmatch(r"([A-Za-z]+)(\d*):([A-Za-z]+)(\d*)", cellsRange)
+        if not match:
+            raise httpError(400, f"Unable to parse range: {a1Range}")
+
+        if sheet is None:
+            return {"range": a1Range, "majorDimension": "ROWS"}
+
+        startCol, endCol = columnIndex(match[1]), columnIndex(match[3]) + 1
+        startRow = int(match[2]) - 1 if match[2] else 0
+        endRow = int(match[4]) if match[4] else max([row + 1 for row, col in sheet.cells if startCol <= col < endCol], default = 0)
+
+        values = []
+        for row in range(startRow, endRow):
+            rowValues = [displayedValue(sheet.cells.get((row, col), {})) for col in range(startCol, endCol)]
+
+            while rowValues and rowValues[-1] == "":
+                rowValues.pop()
+
+            values.append(rowValues)
+
+        while values and not values[-1]:
+            values.pop()
+
+        return {"range": a1Range, "majorDimension": "ROWS", "values": values} if values else {"range": a1Range, "majorDimension": "ROWS"}
+
+    # batchUpdate is atomic : requests are applied on a draft that replaces the spreadsheet only if all of them succeed
+    def applyRequests(self, spreadsheetId, requests):
+        spreadsheet = self.spreadsheet(spreadsheetId).draft()
+        replies = []
+
+        for index, request in enumerate(requests):
+            requestType, body = next(iter(request.items()))
+
+            if requestType not in SUPPORTED_REQUESTS:
+                raise httpError(400, f"Invalid requests[{index}]: unsupported request {requestType}")
+
+            replies.append(getattr(self, f"apply_{requestType}")(spreadsheet, body))
+
+        for sheetId in spreadsheet.copiedSheets:
+            if sheetId in spreadsheet.sheets:
+                spreadsheet.sheets[sheetId].ownedCells = None
+
+        spreadsheet.copiedSheets = None
+        self.spreadsheetsById[spreadsheetId] = spreadsheet
+        return {"spreadsheetId": spreadsheetId, "replies": replies}
+
+    def area(self, spreadsheet, gridRange):
+        sheet = spreadsheet.sheet(gridRange.get("sheetId", 0), self.autoCreateSheets)
+        gridProperties = sheet.properties["gridProperties"]
+
+        return sheet, (gridRange.get("startRowIndex", 0), gridRange.get("endRowIndex", gridProperties["rowCount"]),
+                       gridRange.get("startColumnIndex", 0), gridRange.get("endColumnIndex", gridProperties["columnCount"]))
+
+    def apply_repeatCell(self, spreadsheet, body):
+        sheet, area = self.area(spreadsheet, body["range"])
+        fieldsTree = parseFieldsTree(body["fields"])
+
+        for cell in sheet.cellsIn(area):
+            applyFields(sheet.writableCell(cell), body.get("cell", {}), fieldsTree)
+
+        return {}
+
+    def apply_updateCells(self, spreadsheet, body):
+        fieldsTree = parseFieldsTree(body["fields"])
+        rows = body.get("rows", [])
+
+        if "range" in body:
+            sheet, area = self.area(spreadsheet, body["range"])
+        else:
+            sheet, area = self.area(spreadsheet, {"sheetId": body["start"].get("sheetId", 0),
+                                                  "startRowIndex": body["start"].get("rowIndex", 0), "startColumnIndex": body["start"].get("columnIndex", 0)})
+            area = (area[0], area[0] + len(rows), area[2], area[2] + max([len(row.get("values", [])) for row in rows], default = 0))
+
+        for row, col in sheet.cellsIn(area):
+            rowValues = rows[row - area[0]].get("values", []) if row - area[0] < len(rows) else []
+
+            # With a start coordinate, only provided cells are written
+            if col - area[2] >= len(rowValues) and "range" not in body:
+                continue
+
+            applyFields(sheet.writableCell((row, col)), rowValues[col - area[2]] if col - area[2] < len(rowValues) else {}, fieldsTree)
+
+        return {}
+
+    def apply_mergeCells(self, spreadsheet, body):
+        sheet, area = self.area(spreadsheet, body["range"])
+        mergeType = body.get("mergeType", "MERGE_ALL")
+
+        if mergeType == "MERGE_ALL":
+            sheet.merge(area)
+        elif mergeType == "MERGE_ROWS":
+            for row in range(area[0], area[1]):
+                sheet.merge((row, row + 1, area[2], area[3]))
+        else:
+            for col in range(area[2], area[3]):
+                sheet.merge((area[0], area[1], col, col + 1))
+
+        return {}
+
+    def apply_unmergeCells(self, spreadsheet, body):
+        sheet, area = self.area(spreadsheet, body["range"])
+        sheet.merges -= set(sheet.overlappingMerges(area))
+        return {}
+
+    def apply_updateBorders(self, spreadsheet, body):
+        sheet, area = self.area(spreadsheet, body["range"])
+
+        for row, col in sheet.cellsIn(area):
+            borders = sheet.writableCell((row, col)).setdefault("userEnteredFormat", {}).setdefault("borders", {})
+
+            for side, isEdge in [("top", row == area[0]), ("bottom", row == area[1] - 1), ("left", col == area[2]), ("right", col == area[3] - 1)]:
+                if isEdge and side in body:
+                    borders[side] = copy.deepcopy(body[side])
+
+        return {}
+
+    def apply_updateDimensionProperties(self, spreadsheet, body):
+        dimensionRange = body["range"]
+        sheet = spreadsheet.sheet(dimensionRange.get("sheetId", 0), self.autoCreateSheets)
+        sizes = sheet.columnSizes if dimensionRange["dimension"] == "COLUMNS" else sheet.rowSizes
+
+        for index in range(dimensionRange["startIndex"], dimensionRange["endIndex"]):
+            sizes[index] = body["properties"].get("pixelSize")
+
+        return {}
+
+    def apply_insertDimension(self, spreadsheet, body):
+        dimensionRange = body["range"]
+        sheet = spreadsheet.sheet(dimensionRange.get("sheetId", 0), self.autoCreateSheets)
+        sheet.insert(dimensionRange["dimension"], dimensionRange["startIndex"], dimensionRange["endIndex"], body.get("inheritFromBefore", False))
+        return {}
+
+    def apply_deleteDimension(self, spreadsheet, body):
+        dimensionRange = body["range"]
+        sheet = spreadsheet.sheet(dimensionRange.get("sheetId", 0), self.autoCreateSheets)
+        sheet.delete(dimensionRange["dimension"], dimensionRange["startIndex"], dimensionRange["endIndex"])
+        return {}
+
+    # A destination spanning a multiple of the source height or width gets the source repeated to fill it
+    def apply_copyPaste(self, spreadsheet, body):
+        sourceSheet, source = self.area(spreadsheet, body["source"])
+        destinationSheet, destination = self.area(spreadsheet, body["destination"])
+        height, width = source[1] - source[0], source[3] - source[2]
+        rowCopies = (destination[1] - destination[0]) // height if (destination[1] - destination[0]) % height == 0 and destination[1] > destination[0] else 1
+        colCopies = (destination[3] - destination[2]) // width if (destination[3] - destination[2]) % width == 0 and destination[3] > destination[2] else 1
+
+        sourceCells = {(row, col): copy.deepcopy(sourceSheet.cells.get((row, col), {})) for row, col in sourceSheet.cellsIn(source)}
+        sourceMerges = [merge for merge in sourceSheet.merges if source[0] <= merge[0] and merge[1] <= source[1] and source[2] <= merge[2] and merge[3] <= source[3]]
+
+        for rowOffset in range(destination[0] - source[0], destination[0] - source[0] + rowCopies * height, height):
+            for colOffset in range(destination[2] - source[2], destination[2] - source[2] + colCopies * width, width):
+                pastedArea = (source[0] + rowOffset, source[1] + rowOffset, source[2] + colOffset, source[3] + colOffset)
+                destinationSheet.merges -= set(destinationSheet.overlappingMerges(pastedArea))
+                destinationSheet.cells.update({(row + rowOffset, col + colOffset): copy.deepcopy(cell) for (row, col), cell in sourceCells.items()})
+
+                for merge in sourceMerges:
+                    destinationSheet.merge((merge[0] + rowOffset, merge[1] + rowOffset, merge[2] + colOffset, merge[3] + colOffset))
+
+        return {}
+
+    def apply_addSheet(self, spreadsheet, body):
+        properties = body.get("properties", {})
+        sheetId = properties.get("sheetId", max(spreadsheet.sheets, default = 0) + 1)
+
+        if sheetId in spreadsheet.sheets or any(sheet.properties["title"] == properties.get("title") for sheet in spreadsheet.sheets.values()):
+            raise httpError(400, f"Invalid requests[addSheet]: A sheet with the name or id {properties.get("title")} / {sheetId} already exists")
+
+        gridProperties = properties.get("gridProperties", {})
+        sheet = FakeSheet(sheetId, properties.get("title", f"Sheet{len(spreadsheet.sheets) + 1}"), properties.get("hidden", False),
+                          gridProperties.get("rowCount", 1000), gridProperties.get("columnCount", 26))
+        spreadsheet.sheets[sheetId] = sheet
+
+        if spreadsheet.copiedSheets is not None:
+            spreadsheet.copiedSheets.add(sheetId)
+
+        return {"addSheet": {"properties": copy.deepcopy(sheet.properties)}}
+
+    def apply_deleteSheet(self, spreadsheet, body):
+        spreadsheet.sheets.pop(body["sheetId"], None)
+        return {}
+
+    # Displayed value of a cell, hidden merged cells excepted
+    def cellValue(self, spreadsheetId, sheetId, row, col):
+        sheet = self.spreadsheet(spreadsheetId).sheet(sheetId, True)
+        return "" if (row, col) in sheet.hiddenCells() else displayedValue(sheet.cells.get((row, col), {}))
+
+    # Write hidden runIds of existing run cards (column B, 8th row of each card) to simulate a long history without building every card
+    def seedRunIds(self, spreadsheetId, sheetId, runIds):
+        with self.lock:
+            sheet = self.spreadsheet(spreadsheetId).sheet(sheetId, True)
+
+            for runCardId, runId in enumerate(runIds):
+                sheet.cells[(18 * runCardId + 7, 1)] = {"userEnteredValue": {"stringValue": f"RundId : {runId}"}}
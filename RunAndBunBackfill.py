@@ -0,0 +1,343 @@
+import argparse
+import copy
+import json
+import re
+import time
+import sys
+import os
+
+# Bulk import of a run history into a spreadsheet, without going through /updateRun :
+#
+#   python RunAndBunBackfill.py runs.jsonl --spreadsheet-id <id> --sheet-id <id> --lang EN
+#
+# Runs are added in file order (oldest first), as if they had been sent one by one : the last one ends on top.
+# Each run is compiled once, then each batch inserts the rows of all its runs with one insertDimension, moves every card
+# to its final place and is uploaded in a single batchUpdate call, so a batch is either fully displayed or not at all.
+# Runs already in the sheet are skipped and the position reached is saved after each batch : an interrupted
+# backfill is resumed by running the same command again.
+#
+# Input files :
+#   .jsonl  one run per line, {"runId": ..., "runData": ..., "pokemonData": ...} or {"<runId>": {...}}, streamed line by line
+#   .json   /updateRun payload (fullData.runs), {"runs": {...}} or {"<runId>": {...}}, streamed and decoded one run at a time
+#
+# The server run index is updated in RUN_INDEX_DIRECTORY : restart a server already running on this spreadsheet.
+
+import RunAndBunStats
+from RunAndBunStats import COMPACT_REQUESTS, SPRITE_MODE, getRunIndex, getRunSnapshots, resolveSprites, relocateRequests, spriteCache, runStore
+from RunAndBunLayout import ZONES, RUN_CARD_HEIGHT, insertRows, generateRunCard, generatePokemonCards, updateCardColumnSizes
+from RunAndBunCompaction import compactRequests
+from RunAndBunPayload import skipWhitespace, jsonDecoder
+from RunAndBunUpload import SheetsUploader, UploadError, requestSize
+
+
+# (runId, run, position) in file order, position being where to resume after this run
+# JSONL : byte offset of the next line
+def readJsonlRuns(path, position):
+    with open(path, "rb") as inputFile:
+        inputFile.seek(position)
+
+        while line := inputFile.readline():
+            position += len(line)
+
+            if not line.strip():
+                continue
+
+            content = json.loads(line)
+
+            if "runId" in content:
+                yield str(content["runId"]), {"runData": content["runData"], "pokemonData": content["pokemonData"]}, position
+            else:
+                for runId, run in content.items():
+                    yield runId, run, position
+
+# Incremental reader of a JSON file : objects are walked member by member and only the values asked for are decoded
+# The file is read by blocks and what was read is dropped, so memory holds about one run at a time
+class JsonStream:
+    STRING_END = re.compile(r'["\\]')
+    NESTING = re.compile(r'["{}\[\]]')
+
+    def __init__(self, inputFile, blockSize = 1 << 20):
+        self.inputFile = inputFile
+        self.blockSize = blockSize
+        self.text = ""
+        self.index = 0
+
+    # Read one more block, False at the end of the file
+    def fill(self):
+        block = self.inputFile.read(self.blockSize)
+
+        if not block:
+            return False
+
+        self.text = self.text[self.index:] + block
+        self.index = 0
+        return True
+
+    # Next non-whitespace character, "" at the end of the file
+    def peek(self):
+        while True:
+            self.index = skipWhitespace(self.text, self.index)
+
+            if self.index < len(self.text) or not self.fill():
+                return self.text[self.index : self.index + 1]
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise json.JSONDecodeError(f"Expecting '{character}'", self.text, self.index)
+
+        self.index += 1
+
+    # Decode the next value, reading the file until it is complete
+    def value(self):
+        self.peek()
+
+        while True:
+            try:
+                value, end = jsonDecoder.raw_decode(self.text, self.index)
+
+                # A number may go on in the next block
+                if end < len(self.text) or not self.fill():
+                    self.index = end
+                    return value
+
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    # Go past the next value without decoding it
+    def skip(self):
+        if self.peek() not in ["{", "["]:
+            self.value()
+            return
+
+        depth, inString = 0, False
+
+        while True:
+            match = (self.STRING_END if inString else self.NESTING).search(self.text, self.index)
+
+            # Escaped character cut by the end of the block : read again once the next block is there
+            if match is None or (match[0] == "\\" and match.end() >= len(self.text)):
+                self.index = len(self.text) if match is None else match.start()
+
+                if not self.fill():
+                    raise json.JSONDecodeError("Unterminated value", self.text, self.index)
+
+                continue
+
+            self.index = match.end()
+
+            if match[0] == "\\":
+                self.index += 1
+            elif match[0] == '"':
+                inString = not inString
+            elif match[0] in "{[":
+                depth += 1
+            else:
+                depth -= 1
+
+                if not depth:
+                    return
+
+    # Keys of the next object, the caller reads or skips the value of each key before asking for the next one
+    def members(self):
+        self.expect("{")
+
+        if self.peek() == "}":
+            self.index += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+
+            separator = self.peek()
+            self.index += 1
+
+            if separator == "}":
+                return
+
+            if separator != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.text, self.index - 1)
+
+# Move the stream to fullData.runs of a /updateRun payload or to top-level runs, False if there are none
+def findRuns(stream):
+    for key in stream.members():
+        if key == "runs":
+            return True
+
+        if key == "fullData" and stream.peek() == "{":
+            for fullDataKey in stream.members():
+                if fullDataKey == "runs":
+                    return True
+
+                stream.skip()
+        else:
+            stream.skip()
+
+    return False
+
+# JSON : number of runs already read, streamed from the file (the whole object maps runIds to runs when there is no runs object)
+# Runs before the position are skipped without being decoded
+def readJsonRuns(path, position):
+    with open(path, encoding = "utf-8") as inputFile:
+        stream = JsonStream(inputFile)
+
+        if not findRuns(stream):
+            inputFile.seek(0)
+            stream = JsonStream(inputFile)
+
+        for runPosition, runId in enumerate(stream.members(), start = 1):
+            if runPosition > position:
+                yield runId, stream.value(), runPosition
+            else:
+                stream.skip()
+
+def readRuns(path, position):
+    return readJsonlRuns(path, position) if path.endswith(".jsonl") else readJsonRuns(path, position)
+
+
+# Requests of a run card and its Pokémon cards, compiled once at the top of the sheet
+def compileRun(sheetId, runId, run, runNumber, lang, sprites):
+    requests = []
+    generateRunCard(requests, sheetId, runId, run["runData"], lang, runNumber, 0)
+    generatePokemonCards(requests, sheetId, run["pokemonData"], 0, lang)
+
+    if sprites is not None:
+        resolveSprites(requests, sprites)
+
+    return compactRequests(requests) if COMPACT_REQUESTS else requests
+
+# Requests of a batch : rows of every run inserted at once, then each compiled run moved to its final place (newest run on top)
+# Column sizes come with the first batch sent to the sheet
+def compileBatch(spreadsheetId, sheetId, compiledRuns):
+    requests = []
+    insertRows(requests, sheetId, RUN_CARD_HEIGHT * len(compiledRuns))
+    RunAndBunStats.sizedSheets.size(requests, spreadsheetId, sheetId)
+
+    for i, runRequests in enumerate(compiledRuns):
+        requests += relocateRequests(runRequests, sheetId, RUN_CARD_HEIGHT * (len(compiledRuns) - 1 - i))
+
+    return requests
+
+# Upper bound of the bytes a run adds to a batch of at most maxRuns runs : its row indices only get longer as the batch grows
+def runBatchBytes(sheetId, runRequests, maxRuns):
+    return sum(map(requestSize, relocateRequests(runRequests, sheetId, RUN_CARD_HEIGHT * (maxRuns - 1))))
+
+# Bytes of the row insertion and column sizes of a batch of at most maxRuns runs
+def insertBatchBytes(sheetId, maxRuns):
+    requests = []
+    updateCardColumnSizes(requests, sheetId)
+    insertRows(requests, sheetId, RUN_CARD_HEIGHT * maxRuns)
+    return sum(map(requestSize, requests))
+
+
+def loadCheckpoint(path, options):
+    if options.restart or not os.path.exists(path):
+        return 0
+
+    with open(path, encoding = "utf-8") as checkpointFile:
+        checkpoint = json.load(checkpointFile)
+
+    if [checkpoint["input"], checkpoint["spreadsheetId"], checkpoint["sheetId"]] != [os.path.abspath(options.input), options.spreadsheet_id, options.sheet_id]:
+        print(f"❌ Checkpoint {path} belongs to another backfill, starting from the beginning")
+        return 0
+
+    return checkpoint["position"]
+
+def saveCheckpoint(path, options, position):
+    with open(path + ".tmp", "w", encoding = "utf-8") as checkpointFile:
+        json.dump({"input": os.path.abspath(options.input), "spreadsheetId": options.spreadsheet_id, "sheetId": options.sheet_id,
+                   "position": position, "savedAt": time.time()}, checkpointFile)
+
+    os.replace(path + ".tmp", path)
+
+
+def backfill(options):
+    checkpointPath = options.checkpoint or options.input + ".checkpoint"
+    spreadsheetId, sheetId, lang = options.spreadsheet_id, options.sheet_id, options.lang
+
+    # Whole batches in one call : never split, retried as a whole, refused if they do not fit
+    uploader = SheetsUploader(chunkSize = sys.maxsize, chunkBytes = options.max_bytes, splitChunks = False)
+    runIndex = getRunIndex(spreadsheetId)
+    snapshots = getRunSnapshots(spreadsheetId)
+    sprites = spriteCache.get(spreadsheetId) if SPRITE_MODE == "resolved" else None
+    totals = {"runs": 0, "skipped": 0, "calls": 0, "bytes": 0}
+    startTime = time.time()
+
+    # Runs already displayed (previous attempt or /updateRun) are skipped
+    runIndex.rebuild()
+
+    def flush(batch, compiledRuns, position):
+        if batch:
+            requests = compileBatch(spreadsheetId, sheetId, compiledRuns)
+
+            # Protocol version 2 clients only send changes : the store must know the whole runs
+            if runStore is not None:
+                runStore.merge(spreadsheetId, dict(batch))
+
+            try:
+                uploadStats = uploader.upload(spreadsheetId, requests)
+
+            except UploadError:
+                RunAndBunStats.sizedSheets.forget(spreadsheetId)
+                raise
+
+            for runId, run in batch:
+                runIndex.insertRun(runId)
+                snapshots.put(runId, {"lang": lang, "runData": copy.deepcopy(run["runData"]),
+                                      "pokemonData": {zone: copy.deepcopy(run["pokemonData"].get(zone)) for zone in ZONES}})
+
+            runIndex.save()
+            totals["runs"] += len(batch)
+            totals["calls"] += uploadStats["calls"]
+            totals["bytes"] += uploadStats["bytes"]
+
+        saveCheckpoint(checkpointPath, options, position)
+        print(f"✅ {totals["runs"]} runs added, {totals["skipped"]} skipped, {totals["calls"]} calls, {totals["bytes"]} bytes, {time.time() - startTime:.1f}s")
+
+    emptyBatchBytes = insertBatchBytes(sheetId, options.max_runs)
+    batch, compiledRuns, batchIds, batchBytes, position = [], [], set(), emptyBatchBytes, loadCheckpoint(checkpointPath, options)
+
+    for runId, run, runPosition in readRuns(options.input, position):
+        if runIndex.get(runId) != -1 or runId in batchIds:
+            totals["skipped"] += 1
+            position = runPosition
+            continue
+
+        # Compiled with its run number (the same whether this batch is sent first or not), its size once moved fills each call up to the byte limit
+        runRequests = compileRun(sheetId, runId, run, runIndex.sequence + len(batch) + 1, lang, sprites)
+        runBytes = runBatchBytes(sheetId, runRequests, options.max_runs)
+
+        if batch and (batchBytes + runBytes > options.max_bytes or len(batch) >= options.max_runs):
+            flush(batch, compiledRuns, position)
+            batch, compiledRuns, batchIds, batchBytes = [], [], set(), emptyBatchBytes
+
+        batch.append((runId, run))
+        compiledRuns.append(runRequests)
+        batchIds.add(runId)
+        batchBytes += runBytes
+        position = runPosition
+
+    flush(batch, compiledRuns, position)
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Bulk import of a run history into a RunAndBunStats spreadsheet")
+    parser.add_argument("input", help = "Runs to import, .json or .jsonl")
+    parser.add_argument("--spreadsheet-id", required = True, help = "Target spreadsheet")
+    parser.add_argument("--sheet-id", type = int, required = True, help = "Target sheet (run cards sheet)")
+    parser.add_argument("--lang", default = "EN", choices = ["EN", "FR"], help = "Card labels language")
+    parser.add_argument("--max-bytes", type = int, default = 8_000_000, help = "Max batchUpdate body size, one call per batch")
+    parser.add_argument("--max-runs", type = int, default = 200, help = "Max runs per batch")
+    parser.add_argument("--checkpoint", help = "Checkpoint file (default : <input>.checkpoint)")
+    parser.add_argument("--restart", action = "store_true", help = "Ignore the checkpoint, runs already in the sheet are still skipped")
+    options = parser.parse_args()
+
+    try:
+        backfill(options)
+
+    except UploadError as e:
+        print(f"❌ {e} : raise --max-bytes" if e.status == 413 else f"❌ {e} : run the same command again to resume")
+        sys.exit(1)
@@ -0,0 +1,282 @@
+import argparse
+import statistics
+import random
+import json
+import time
+import sys
+import os
+
+# Offline benchmark of the request compiler and the uploader, against FakeSheetsService
+# Reports request count, payload bytes, API calls and wall time per scenario :
+#
+#   python RunAndBunBenchmark.py                              # table
+#   python RunAndBunBenchmark.py --json > baseline.json       # save a baseline
+#   python RunAndBunBenchmark.py --baseline baseline.json     # exit 1 if requests, bytes or calls grew more than --tolerance
+
+# Settings read by the RunAndBun modules at import : no write quota, no inbound rate limit, no persisted state, known password
+os.environ.setdefault("PROJECT_WRITES_PER_MINUTE", "1000000")
+os.environ.setdefault("SPREADSHEET_WRITES_PER_MINUTE", "1000000")
+os.environ.setdefault("UPLOAD_BASE_BACKOFF", "0.01")
+os.environ.setdefault("API_PASSWORD", "benchmark")
+os.environ.setdefault("CLIENT_UPDATES_PER_MINUTE", "0")
+os.environ.setdefault("SPREADSHEET_UPDATES_PER_MINUTE", "0")
+os.environ["RUN_INDEX_DIRECTORY"] = ""
+os.environ["SNAPSHOT_DIRECTORY"] = ""
+
+from FakeSheetsService import FakeSheetsService
+import RunAndBunStats
+import RunAndBunLayout
+import RunAndBunCompaction
+import RunAndBunUpload
+
+SPREADSHEET_ID = "benchmark"
+SHEET_ID = 1
+TRAINERS = ["Roxanne", "Brawly", "Wattson", "Flannery", "Norman", "Winona", "Tate&Liza", "Juan"]
+NATURES = list(RunAndBunLayout.NATURE_DICO.keys())
+
+
+# Reproducible fixtures : the same seed always gives the same payloads
+def generatePokemon(rng, alive = None):
+    return {
+        "pokedexId": rng.randint(1, 386),
+        "alive": rng.choice([0, 1, 1, 1]) if alive is None else alive,
+        "nickname": "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(rng.randint(3, 10))),
+        "pokemonName": f"Pokemon{rng.randint(1, 386)}",
+        "ability": f"Ability{rng.randint(1, 76)}",
+        "level": rng.randint(2, 60),
+        "pid": rng.randint(0, 2 ** 32 - 1),
+        "moves": [f"Move{rng.randint(1, 354)}" for _ in range(4)],
+        "nature": rng.choice(NATURES),
+        "IVs": [rng.randint(0, 31) for _ in range(6)]
+    }
+
+def generateRunData(rng):
+    return {
+        "runStart": f"2024-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+        "runEnd": "",
+        "wonBattles": str(rng.randint(0, 80)),
+        "deadPokemon": str(rng.randint(0, 10)),
+        "gymBadges": rng.randint(0, 8),
+        "personalBest": {"trainerName": rng.choice(TRAINERS), "trainerSprite": rng.choice(TRAINERS), "trainerTeam": [rng.randint(1, 386) for _ in range(rng.randint(1, 6))]}
+    }
+
+def generateRun(rng, numberOfZones):
+    return {"runData": generateRunData(rng), "pokemonData": {zone: generatePokemon(rng) for zone in rng.sample(RunAndBunLayout.ZONES, numberOfZones)}}
+
+def generatePayload(updatedRuns, fullRuns, lang = "EN"):
+    return {"keys": {"spreadsheetId": SPREADSHEET_ID, "sheetId": SHEET_ID}, "lang": lang,
+            "updatedData": {"runs": updatedRuns}, "fullData": {"runs": fullRuns}}
+
+# New level, moves and IVs for one zone of a run already displayed
+def evolvePokemon(rng, pokemon):
+    evolvedPokemon = dict(pokemon, level = min(100, pokemon["level"] + rng.randint(1, 5)), IVs = list(pokemon["IVs"]))
+    evolvedPokemon["moves"] = pokemon["moves"][:3] + [f"Move{rng.randint(1, 354)}"]
+    evolvedPokemon["IVs"][rng.randrange(6)] = rng.randint(0, 31)
+    return evolvedPokemon
+
+
+def countBytes(requests):
+    return len(json.dumps({"requests": requests}, separators = (",", ":")))
+
+def resetState(fakeService):
+    RunAndBunUpload.sheetsService = fakeService
+    RunAndBunStats.runIndexes.clear()
+    RunAndBunStats.runSnapshots.clear()
+    RunAndBunStats.runStats.clear()
+    RunAndBunStats.updateJournals.clear()
+    RunAndBunStats.runTemplates = RunAndBunStats.RunTemplates()
+    RunAndBunStats.sizedSheets = RunAndBunStats.SizedSheets()
+    RunAndBunStats.uploader = RunAndBunUpload.SheetsUploader()
+    RunAndBunStats.jobs.clear()
+    RunAndBunStats.deduplicator = RunAndBunStats.UpdateDeduplicator(RunAndBunStats.IDEMPOTENCY_CACHE_SIZE, RunAndBunStats.IDEMPOTENCY_TTL)
+
+
+# Compiler scenarios : requests built by a single card function, no API call
+def benchmarkCompiler(name, function):
+    requests = []
+    startTime = time.perf_counter()
+    function(requests)
+    wallSeconds = time.perf_counter() - startTime
+
+    compactedRequests = RunAndBunCompaction.compactRequests(requests)
+
+    return {"scenario": name, "requests": len(requests), "bytes": countBytes(requests), "calls": 0,
+            "compactedRequests": len(compactedRequests), "compactedBytes": countBytes(compactedRequests), "wallSeconds": wallSeconds}
+
+# End to end scenarios : setup() fills the fake spreadsheet and returns the measured payload, sent to /updateRun
+def benchmarkUpdateRun(name, setup, options):
+    # Simulated errors only hit the uploads of the measured update, reads are not retried by RunAndBunStats
+    fakeService = FakeSheetsService(latency = options.latency, latencyJitter = options.latency_jitter, errorMethods = ["batchUpdate"], seed = options.seed)
+    resetState(fakeService)
+
+    client = RunAndBunStats.flaskApp.test_client()
+    headers = {"Authorization": f"Bearer {RunAndBunStats.API_PASSWORD}"}
+
+    def post(payload):
+        response = client.post("/updateRun", json = payload, headers = headers)
+
+        if response.status_code != 200:
+            raise RuntimeError(f"{name} : /updateRun answered {response.status_code} {response.get_json()}")
+
+    payload = setup(fakeService, post)
+    fakeService.calls.clear()
+    fakeService.errorRate = options.error_rate
+
+    startTime = time.perf_counter()
+    post(payload)
+    wallSeconds = time.perf_counter() - startTime
+
+    summary = fakeService.summary()
+    batchUpdates = summary.get("batchUpdate", {})
+
+    return {"scenario": name, "requests": batchUpdates.get("requests", 0), "bytes": batchUpdates.get("bytes", 0),
+            "calls": sum(methodSummary["calls"] for methodSummary in summary.values()), "errors": sum(methodSummary["errors"] for methodSummary in summary.values()),
+            "apiSeconds": sum(record["seconds"] for record in fakeService.calls), "wallSeconds": wallSeconds}
+
+
+def compilerScenarios(seed):
+    rng = random.Random(seed)
+    run = generateRun(rng, 20)
+    previousRunData, runData = run["runData"], generateRunData(rng)
+    zone, pokemon = next(iter(run["pokemonData"].items()))
+
+    return {
+        "generateRunCard": lambda requests: RunAndBunLayout.generateRunCard(requests, SHEET_ID, "benchmarkRun", run["runData"], "EN"),
+        "generatePokemonCard": lambda requests: RunAndBunLayout.generatePokemonCard(requests, SHEET_ID, pokemon, zone, 0, RunAndBunLayout.ZONE_INDEX[zone], "EN"),
+        "generatePokemonCard (empty)": lambda requests: RunAndBunLayout.generatePokemonCard(requests, SHEET_ID, None, zone, 0, RunAndBunLayout.ZONE_INDEX[zone], "EN"),
+        "generatePokemonCards": lambda requests: RunAndBunLayout.generatePokemonCards(requests, SHEET_ID, run["pokemonData"], 0, "EN"),
+        "updateRunCard": lambda requests: RunAndBunLayout.updateRunCard(requests, SHEET_ID, 0, runData),
+        "updateRunCard (diff)": lambda requests: RunAndBunLayout.updateRunCard(requests, SHEET_ID, 0, runData, previousRunData)
+    }
+
+def updateRunScenarios(seed):
+    # First run of a fresh sheet : the columns are sized with it
+    def firstRun(fakeService, post):
+        rng = random.Random(seed)
+        runs = {"newRun": generateRun(rng, 12)}
+        return generatePayload(runs, runs)
+
+    # Next run of a sheet already holding one
+    def newRun(fakeService, post):
+        rng = random.Random(seed)
+        runs = {"previousRun": generateRun(rng, 12), "newRun": generateRun(rng, 12)}
+        post(generatePayload({"previousRun": runs["previousRun"]}, runs))
+        return generatePayload({"newRun": runs["newRun"]}, runs)
+
+    def singleZoneUpdate(fakeService, post):
+        rng = random.Random(seed)
+        runs = {"run": generateRun(rng, 12)}
+        post(generatePayload(runs, runs))
+
+        zone, pokemon = next(iter(runs["run"]["pokemonData"].items()))
+        updatedRuns = {"run": {"runData": {}, "pokemonData": {zone: evolvePokemon(rng, pokemon)}}}
+        runs["run"]["pokemonData"].update(updatedRuns["run"]["pokemonData"])
+        return generatePayload(updatedRuns, runs)
+
+    def multiRunUpdate(fakeService, post):
+        rng = random.Random(seed)
+        runs = {f"run{i}": generateRun(rng, 12) for i in range(5)}
+
+        for runId in runs:
+            post(generatePayload({runId: runs[runId]}, runs))
+
+        updatedRuns = {}
+        for runId, run in runs.items():
+            zone = rng.choice(RunAndBunLayout.ZONES)
+            updatedRuns[runId] = {"runData": {"wonBattles": str(int(run["runData"]["wonBattles"]) + 1)}, "pokemonData": {zone: generatePokemon(rng)}}
+            run["runData"].update(updatedRuns[runId]["runData"])
+            run["pokemonData"].update(updatedRuns[runId]["pokemonData"])
+
+        return generatePayload(updatedRuns, runs)
+
+    # 500 runs already in the sheet (only their hidden runIds) : update the oldest one and start a new one
+    def history500(fakeService, post):
+        rng = random.Random(seed)
+        runIds = [f"history{i}" for i in range(500)]
+        fakeService.seedRunIds(SPREADSHEET_ID, SHEET_ID, runIds)
+
+        runs = {"newRun": generateRun(rng, 12), runIds[-1]: generateRun(rng, 12)}
+        updatedRuns = {"newRun": runs["newRun"], runIds[-1]: {"runData": {"deadPokemon": "1"}, "pokemonData": dict(list(runs[runIds[-1]]["pokemonData"].items())[:1])}}
+        return generatePayload(updatedRuns, runs)
+
+    return {
+        "updateRun firstRun": firstRun,
+        "updateRun newRun": newRun,
+        "updateRun singleZoneUpdate": singleZoneUpdate,
+        "updateRun multiRunUpdate": multiRunUpdate,
+        "updateRun history500": history500
+    }
+
+
+# Counts are deterministic, times are the median of every repetition
+def runBenchmarks(options):
+    results = []
+
+    for name, function in compilerScenarios(options.seed).items():
+        repetitions = [benchmarkCompiler(name, function) for _ in range(options.repeat)]
+        results.append(dict(repetitions[0], wallSeconds = statistics.median(result["wallSeconds"] for result in repetitions)))
+
+    for name, setup in updateRunScenarios(options.seed).items():
+        repetitions = [benchmarkUpdateRun(name, setup, options) for _ in range(options.repeat)]
+        results.append(dict(repetitions[0], apiSeconds = statistics.median(result["apiSeconds"] for result in repetitions),
+                            wallSeconds = statistics.median(result["wallSeconds"] for result in repetitions)))
+
+    return results
+
+# Regressions on requests, bytes and calls (and wall time if a time tolerance is given) compared to a saved run
+def compareBaseline(results, baseline, tolerance, timeTolerance):
+    regressions = []
+    baselineResults = {result["scenario"]: result for result in baseline}
+
+    for result in results:
+        baselineResult = baselineResults.get(result["scenario"])
+
+        if not baselineResult:
+            continue
+
+        metrics = [("requests", tolerance), ("bytes", tolerance), ("calls", tolerance)] + ([("wallSeconds", timeTolerance)] if timeTolerance is not None else [])
+
+        for metric, metricTolerance in metrics:
+            if result[metric] > baselineResult[metric] * (1 + metricTolerance) and result[metric] > baselineResult[metric]:
+                regressions.append(f"{result["scenario"]} : {metric} {baselineResult[metric]} -> {result[metric]}")
+
+    return regressions
+
+# API time is spent in FakeSheetsService (simulated latency and in-memory grid), the rest in RunAndBunStats
+def printTable(results):
+    print(f"{"Scenario":<32}{"Requests":>10}{"Bytes":>12}{"Calls":>8}{"Compacted":>11}{"Time (ms)":>11}{"API (ms)":>10}")
+
+    for result in results:
+        compacted = result.get("compactedRequests", "")
+        apiTime = f"{result["apiSeconds"] * 1000:.2f}" if "apiSeconds" in result else ""
+        print(f"{result["scenario"]:<32}{result["requests"]:>10}{result["bytes"]:>12}{result["calls"]:>8}{compacted:>11}{result["wallSeconds"] * 1000:>11.2f}{apiTime:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Offline benchmark of RunAndBunStats requests and uploads")
+    parser.add_argument("--json", action = "store_true", help = "Print results as JSON")
+    parser.add_argument("--baseline", help = "JSON results to compare with, exit 1 on regression")
+    parser.add_argument("--tolerance", type = float, default = 0.05, help = "Allowed growth of requests, bytes and calls (0.05 = 5%%)")
+    parser.add_argument("--time-tolerance", type = float, default = None, help = "Allowed growth of wall time, not checked by default")
+    parser.add_argument("--repeat", type = int, default = 3, help = "Repetitions per scenario")
+    parser.add_argument("--seed", type = int, default = 0, help = "Fixtures and simulated errors seed")
+    parser.add_argument("--latency", type = float, default = 0, help = "Simulated seconds per API call")
+    parser.add_argument("--latency-jitter", type = float, default = 0, help = "Random extra seconds per API call")
+    parser.add_argument("--error-rate", type = float, default = 0, help = "Share of API calls answered with a 429")
+    options = parser.parse_args()
+
+    results = runBenchmarks(options)
+
+    if options.json:
+        print(json.dumps(results, indent = 2))
+    else:
+        printTable(results)
+
+    if options.baseline:
+        with open(options.baseline, encoding = "utf-8") as baselineFile:
+            regressions = compareBaseline(results, json.load(baselineFile), options.tolerance, options.time_tolerance)
+
+        for regression in regressions:
+            print(f"❌ Regression {regression}", file = sys.stderr)
+
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,529 @@
+import json
+import re
+
+# Request compaction of RunAndBunStats : small cell writes folded into grid-shaped requests before uploading
+
+# Writes of up to COMPACT_MAX_CELLS cells are folded, larger ones are kept as they are
+COMPACT_MAX_CELLS = 16
+
+# Columns of the largest sheet, rows inserted at the top are blank across all of them
+MAX_COLUMNS = 18278
+
+# Cell fields the compactor knows how to fold, with "userEnteredFormat" sub-fields flattened
+VALUE_FIELDS = ["userEnteredValue", "textFormatRuns"]
+FORMAT_FIELDS = ["userEnteredFormat.textFormat", "userEnteredFormat.horizontalAlignment", "userEnteredFormat.backgroundColor"]
+FOLDABLE_FIELDS = set(VALUE_FIELDS + FORMAT_FIELDS)
+
+def parseFields(fields):
+    parsedFields = set()
+
+    for field, subFields in re.findall(r"([\w*]+)(?:\(([^)]*)\))?", fields):
+        if subFields:
+            parsedFields.update(f"{field}.{subField.strip()}" for subField in subFields.split(","))
+        else:
+            parsedFields.add(field)
+
+    return parsedFields
+
+def fieldsMask(fields):
+    formatFields = [field.split(".")[1] for field in FORMAT_FIELDS if field in fields]
+    return ",".join([field for field in VALUE_FIELDS if field in fields] + ([f"userEnteredFormat({",".join(formatFields)})"] if formatFields else []))
+
+# Check if a parsed "fields" mask overwrites a foldable field
+def coversField(fields, field):
+    return field in fields or "*" in fields or (field.startswith("userEnteredFormat.") and "userEnteredFormat" in fields)
+
+def getFieldValue(cell, field):
+    if field.startswith("userEnteredFormat."):
+        return (cell.get("userEnteredFormat") or {}).get(field.split(".")[1])
+
+    return cell.get(field)
+
+def isDefaultValue(value):
+    return value is None or value == {} or value == []
+
+def buildCellData(cellState, fields):
+    cellData = {}
+
+    for field in fields:
+        value = (cellState or {}).get(field)
+
+        if value is None:
+            continue
+
+        if field.startswith("userEnteredFormat."):
+            cellData.setdefault("userEnteredFormat", {})[field.split(".")[1]] = value
+        else:
+            cellData[field] = value
+
+    return cellData
+
+# (sheetId, startRow, endRow, startColumn, endColumn), None if the range is not fully bounded
+def gridRange(range):
+    try:
+        return (range["sheetId"], range["startRowIndex"], range["endRowIndex"], range["startColumnIndex"], range["endColumnIndex"])
+    except (KeyError, TypeError):
+        return None
+
+def rangesOverlap(a, b):
+    return a[0] == b[0] and a[1] < b[2] and b[1] < a[2] and a[3] < b[4] and b[3] < a[4]
+
+def rangeContains(a, sheetId, row, col):
+    return a[0] == sheetId and a[1] <= row < a[2] and a[3] <= col < a[4]
+
+def rangeCells(area):
+    return [(area[0], row, col) for row in range(area[1], area[2]) for col in range(area[3], area[4])]
+
+def rangeArea(area):
+    return (area[2] - area[1]) * (area[4] - area[3])
+
+# (rowShift, colShift) of each copy of source pasted over destination : repeated when destination is a multiple of source, else pasted once at its top-left
+def pasteOffsets(source, destination):
+    height, width = source[2] - source[1], source[4] - source[3]
+    destinationHeight, destinationWidth = destination[2] - destination[1], destination[4] - destination[3]
+    rowCopies = destinationHeight // height if destinationHeight and destinationHeight % height == 0 else 1
+    colCopies = destinationWidth // width if destinationWidth and destinationWidth % width == 0 else 1
+
+    return [(destination[1] - source[1] + height * rowCopy, destination[3] - source[3] + width * colCopy)
+            for rowCopy in range(rowCopies) for colCopy in range(colCopies)]
+
+
+# Rewrite a request list into an equivalent shorter one before uploading it :
+# - small repeatCell/updateCells writes are replayed on a per-cell state and folded into grid-shaped updateCells
+# - a write to a range merged earlier in the batch only targets the merge top-left cell, hidden cells are discarded by the merge
+# - cells known to be blank (rows inserted and cleared in the batch) fill the gaps so a whole card becomes one grid
+# - column sizes are deduplicated and adjacent columns sharing a size are updated together
+# - duplicate merges and unmerges of freshly inserted rows are dropped, stacked one-row merges become a single MERGE_ROWS
+class RequestCompactor:
+    def __init__(self):
+        self.output = []
+        self.pending = {}
+        self.columns = {}
+        self.merges = {}
+        self.knownRanges = []
+        self.freshRanges = []
+        self.dirtyCells = set()
+
+    def compact(self, requests):
+        for sheetRequest in requests:
+            requestType, body = next(iter(sheetRequest.items()))
+
+            if requestType in ["repeatCell", "updateCells"]:
+                self.addWrite(sheetRequest, requestType, body)
+
+            elif requestType == "mergeCells":
+                self.addMerge(sheetRequest, body)
+
+            elif requestType == "unmergeCells":
+                self.addUnmerge(sheetRequest, body)
+
+            elif requestType == "updateDimensionProperties" and body["range"].get("dimension") == "COLUMNS" and "endIndex" in body["range"]:
+                self.addColumnProperties(body)
+
+            # Borders are not part of the folded fields
+            elif requestType == "updateBorders":
+                self.output.append(sheetRequest)
+
+            elif requestType == "insertDimension":
+                self.addInsert(sheetRequest, body)
+
+            elif requestType == "copyPaste" and body.get("pasteType") == "PASTE_NORMAL":
+                self.addPaste(sheetRequest, body)
+
+            # Unknown request : keep it in place and forget everything known about the sheet
+            else:
+                self.flush()
+                self.flushColumns()
+                self.reset()
+                self.output.append(sheetRequest)
+
+        self.flush()
+        self.flushColumns()
+
+        return foldMerges(self.output)
+
+    def reset(self):
+        self.merges = {}
+        self.knownRanges = []
+        self.freshRanges = []
+        self.dirtyCells = set()
+
+    def addWrite(self, request, requestType, body):
+        fields = parseFields(body.get("fields", "*"))
+        area = gridRange(body.get("range"))
+
+        # Unbounded write : nothing can be assumed
+        if area is None:
+            self.flush()
+            self.reset()
+            self.output.append(request)
+            return
+
+        cells = self.writtenCells(requestType, body, area)
+
+        # Small write on known fields : replay it on the pending cells
+        if cells is not None and fields <= FOLDABLE_FIELDS:
+            for cell, cellData in cells.items():
+                cellState = self.pending.setdefault(cell, {})
+
+                for field in fields:
+                    cellState[field] = getFieldValue(cellData, field)
+
+            return
+
+        # Large write : pending cells can't move after it unless it only overwrites fields they don't need anymore
+        if not fields <= FOLDABLE_FIELDS | {"userEnteredFormat", "*"}:
+            self.flush()
+
+        for cell in [cell for cell in self.pending if rangeContains(area, *cell)]:
+            for field in [field for field in self.pending[cell] if coversField(fields, field)]:
+                del self.pending[cell][field]
+
+            if not self.pending[cell]:
+                del self.pending[cell]
+
+        # Track ranges reset to blank, forget about ranges written with anything else
+        written = body.get("cell", {}) if requestType == "repeatCell" else None
+        clearedFields = {field for field in FOLDABLE_FIELDS if coversField(fields, field)}
+
+        if written is not None and all(isDefaultValue(getFieldValue(written, field)) for field in clearedFields):
+            self.knownRanges.append((area, clearedFields))
+        else:
+            self.knownRanges = [(knownRange, knownFields) for knownRange, knownFields in self.knownRanges if not rangesOverlap(knownRange, area)]
+
+        self.output.append(request)
+
+    # Cells actually written by a small repeatCell/updateCells, None if the write is too large to fold
+    def writtenCells(self, requestType, body, area):
+        rows = body.get("rows", [])
+
+        def updatedCell(row, col):
+            values = rows[row - area[1]].get("values", []) if row - area[1] < len(rows) else []
+            return values[col - area[3]] if col - area[3] < len(values) else {}
+
+        # Merged range : only the top-left cell is displayed
+        if area in self.merges:
+            anchor = (area[0], area[1], area[3])
+            return {anchor: body.get("cell", {}) if requestType == "repeatCell" else updatedCell(area[1], area[3])}
+
+        if rangeArea(area) > COMPACT_MAX_CELLS:
+            return None
+
+        return {cell: body.get("cell", {}) if requestType == "repeatCell" else updatedCell(cell[1], cell[2]) for cell in rangeCells(area)}
+
+    def addMerge(self, request, body):
+        area = gridRange(body["range"])
+
+        if area is None:
+            self.flush()
+            self.reset()
+
+        elif body.get("mergeType", "MERGE_ALL") == "MERGE_ALL":
+
+            # Same merge already sent in this batch
+            if area in self.merges:
+                return
+
+            self.merges[area] = True
+
+        elif body["mergeType"] == "MERGE_ROWS":
+            self.merges.update({(area[0], row, row + 1, area[3], area[4]): True for row in range(area[1], area[2])})
+
+        else:
+            self.merges.update({(area[0], area[1], area[2], col, col + 1): True for col in range(area[3], area[4])})
+
+        self.output.append(request)
+
+    def addUnmerge(self, request, body):
+        area = gridRange(body["range"])
+
+        if area is None:
+            self.flush()
+            self.reset()
+            self.output.append(request)
+            return
+
+        overlappingMerges = [merge for merge in self.merges if rangesOverlap(merge, area)]
+
+        # Rows inserted in this batch have no merge except the ones we sent
+        if not overlappingMerges and any(rangeContains(freshRange, area[0], area[1], area[3]) and area[2] <= freshRange[2] for freshRange in self.freshRanges):
+            return
+
+        # Hidden cells are revealed : their content is not known anymore
+        if any(cell in self.pending for cell in rangeCells(area)):
+            self.flush()
+
+        for merge in overlappingMerges:
+            del self.merges[merge]
+            self.dirtyCells.update(rangeCells(merge))
+
+        self.output.append(request)
+
+    # Pasted cards : merges of the source are moved over each copy, copied cells keep what was known about the source cells
+    def addPaste(self, request, body):
+        source, destination = gridRange(body["source"]), gridRange(body["destination"])
+
+        if source is None or destination is None:
+            self.flush()
+            self.flushColumns()
+            self.reset()
+            self.output.append(request)
+            return
+
+        pastedAreas = [(destination[0], source[1] + rowShift, source[2] + rowShift, source[3] + colShift, source[4] + colShift)
+                       for rowShift, colShift in pasteOffsets(source, destination)]
+
+        # Merges crossing the edge of a copied range can't be followed
+        if any(rangesOverlap(merge, area) and not (area[1] <= merge[1] and merge[2] <= area[2] and area[3] <= merge[3] and merge[4] <= area[4])
+               for merge in self.merges for area in [source, *pastedAreas]):
+            self.flush()
+            self.flushColumns()
+            self.reset()
+            self.output.append(request)
+            return
+
+        # Pending cells are sent first : the run card, with its runId, lands before the Pokémon cards
+        self.flush()
+
+        sourceMerges = [merge for merge in self.merges if rangesOverlap(merge, source)]
+        sourceFields = {cell: self.knownFields(cell) for cell in rangeCells(source)}
+
+        # Source outside the inserted rows (template sheet) : it may hold merges we did not send
+        if not any(rangeContains(freshRange, *source[:2], source[3]) and source[2] <= freshRange[2] and source[4] <= freshRange[4] for freshRange in self.freshRanges):
+            self.freshRanges = [freshRange for freshRange in self.freshRanges if not any(rangesOverlap(freshRange, area) for area in pastedAreas)]
+
+        for area in pastedAreas:
+            rowShift, colShift = area[1] - source[1], area[3] - source[3]
+
+            for merge in [merge for merge in self.merges if rangesOverlap(merge, area)]:
+                del self.merges[merge]
+
+            for merge in sourceMerges:
+                self.merges[(area[0], merge[1] + rowShift, merge[2] + rowShift, merge[3] + colShift, merge[4] + colShift)] = True
+
+            for cell, fields in sourceFields.items():
+                pastedCell = (area[0], cell[1] + rowShift, cell[2] + colShift)
+
+                if self.knownFields(pastedCell) != fields:
+                    self.dirtyCells.add(pastedCell)
+
+        self.output.append(request)
+
+    def addColumnProperties(self, body):
+        columnRange = body["range"]
+        key = json.dumps(body["properties"], sort_keys = True)
+
+        for col in range(columnRange["startIndex"], columnRange["endIndex"]):
+            self.columns[(columnRange["sheetId"], body["fields"], col)] = (key, body["properties"])
+
+    def addInsert(self, request, body):
+        dimensionRange = body["range"]
+        sheetId = dimensionRange["sheetId"]
+        self.flush()
+
+        # Rows inserted at the top of a sheet are blank : shift everything we know below them
+        if dimensionRange["dimension"] == "ROWS" and dimensionRange["startIndex"] == 0 and "endIndex" in dimensionRange:
+            rowNumber = dimensionRange["endIndex"]
+
+            def shift(area):
+                return (area[0], area[1] + rowNumber, area[2] + rowNumber, area[3], area[4]) if area[0] == sheetId else area
+
+            self.merges = {shift(merge): True for merge in self.merges}
+            self.knownRanges = [(shift(knownRange), knownFields) for knownRange, knownFields in self.knownRanges]
+            self.freshRanges = [shift(freshRange) for freshRange in self.freshRanges]
+            self.dirtyCells = {(cell[0], cell[1] + rowNumber, cell[2]) if cell[0] == sheetId else cell for cell in self.dirtyCells}
+
+            freshRange = (sheetId, 0, rowNumber, 0, MAX_COLUMNS)
+            self.freshRanges.append(freshRange)
+            self.knownRanges.append((freshRange, set(VALUE_FIELDS)))
+
+        else:
+            self.flushColumns()
+            self.reset()
+
+        self.output.append(request)
+
+    def knownFields(self, cell):
+        if cell in self.dirtyCells:
+            return set()
+
+        return set().union(*[knownFields for knownRange, knownFields in self.knownRanges if rangeContains(knownRange, *cell)])
+
+    # Emit every pending cell as grid-shaped writes, grouped by identical "fields" masks
+    def flush(self):
+        if not self.pending:
+            return
+
+        hiddenCells = set()
+        for merge in self.merges:
+            hiddenCells.update(rangeCells(merge)[1:])
+
+        knownFields = {}
+        def getKnownFields(cell):
+            if cell not in knownFields:
+                knownFields[cell] = self.knownFields(cell) & FOLDABLE_FIELDS
+
+            return knownFields[cell]
+
+        groups = {}
+        for cell, cellState in self.pending.items():
+            fields = frozenset(cellState) | frozenset(getKnownFields(cell))
+            groups.setdefault((cell[0], fields), {})[cell] = cellState
+
+        for (sheetId, fields), cells in groups.items():
+
+            # Gaps can be filled with hidden cells or blank cells that would be written with the same content
+            def fillable(cell):
+                return cell in cells or (cell not in self.pending and (cell in hiddenCells or fields <= getKnownFields(cell)))
+
+            for area in gridRectangles(sheetId, cells, fillable):
+                self.output.append(gridRequest(area, fields, cells))
+
+        self.dirtyCells.update(self.pending)
+        self.pending = {}
+
+    def flushColumns(self):
+        lastRange = None
+
+        for (sheetId, fields, col), (key, properties) in sorted(self.columns.items()):
+            if lastRange and lastRange[0] == (sheetId, fields, key) and lastRange[1]["range"]["endIndex"] == col:
+                lastRange[1]["range"]["endIndex"] = col + 1
+                continue
+
+            lastRange = ((sheetId, fields, key), {
+                "range": {"sheetId": sheetId, "dimension": "COLUMNS", "startIndex": col, "endIndex": col + 1},
+                "properties": properties,
+                "fields": fields
+            })
+            self.output.append({"updateDimensionProperties": lastRange[1]})
+
+        self.columns = {}
+
+
+# Cover cells with as few rectangles as possible : whole bounding box rows first, then runs of each remaining row
+def gridRectangles(sheetId, cells, fillable):
+    rowsCols = {}
+    for _, row, col in cells:
+        rowsCols.setdefault(row, []).append(col)
+
+    startCol = min(col for _, _, col in cells)
+    endCol = max(col for _, _, col in cells) + 1
+    rectangles = []
+    band = None
+
+    for row in range(min(rowsCols), max(rowsCols) + 1):
+        rowCells = sorted(rowsCols.get(row, []))
+
+        if all(fillable((sheetId, row, col)) for col in range(startCol, endCol)):
+            if rowCells:
+                band = [band[0] if band else row, row]
+            continue
+
+        if band:
+            rectangles.append((sheetId, band[0], band[1] + 1, startCol, endCol))
+            band = None
+
+        # Split the row into runs of consecutive cells, bridging fillable gaps
+        if rowCells:
+            runStart = runEnd = rowCells[0]
+
+            for col in rowCells[1:]:
+                if not all(fillable((sheetId, row, gapCol)) for gapCol in range(runEnd + 1, col)):
+                    rectangles.append((sheetId, row, row + 1, runStart, runEnd + 1))
+                    runStart = col
+
+                runEnd = col
+
+            rectangles.append((sheetId, row, row + 1, runStart, runEnd + 1))
+
+    if band:
+        rectangles.append((sheetId, band[0], band[1] + 1, startCol, endCol))
+
+    # Stack identical runs of consecutive rows
+    stacked = []
+    for area in sorted(rectangles, key = lambda area: (area[3], area[4], area[1])):
+        if stacked and stacked[-1][3:] == area[3:] and stacked[-1][2] == area[1]:
+            stacked[-1] = stacked[-1][:2] + (area[2],) + area[3:]
+        else:
+            stacked.append(area)
+
+    return stacked
+
+def gridRequest(area, fields, cells):
+    rows = [[buildCellData(cells.get((area[0], row, col)), fields) for col in range(area[3], area[4])] for row in range(area[1], area[2])]
+    cellRange = {"sheetId": area[0], "startRowIndex": area[1], "endRowIndex": area[2], "startColumnIndex": area[3], "endColumnIndex": area[4]}
+
+    # Same content everywhere : a single repeated cell is enough
+    if all(cellData == rows[0][0] for row in rows for cellData in row):
+        return {"repeatCell": {"range": cellRange, "cell": rows[0][0], "fields": fieldsMask(fields)}}
+
+    return {"updateCells": {"range": cellRange, "rows": [{"values": row} for row in rows], "fields": fieldsMask(fields)}}
+
+# Replace stacked one-row merges with the same columns by a single MERGE_ROWS, and side by side one-column merges
+# with the same rows by a single MERGE_COLUMNS, inside each sequence of consecutive merges
+def foldMerges(requests):
+    foldedRequests = []
+    index = 0
+
+    while index < len(requests):
+        if "mergeCells" not in requests[index]:
+            foldedRequests.append(requests[index])
+            index += 1
+            continue
+
+        sequenceEnd = index
+        while sequenceEnd < len(requests) and "mergeCells" in requests[sequenceEnd]:
+            sequenceEnd += 1
+
+        # Rows of the one-row merges by columns, columns of the one-column merges by rows
+        stacks = {}
+        for sheetRequest in requests[index : sequenceEnd]:
+            area = gridRange(sheetRequest["mergeCells"]["range"])
+
+            if area and sheetRequest["mergeCells"].get("mergeType") == "MERGE_ALL":
+                if area[2] - area[1] == 1 and area[4] - area[3] > 1:
+                    stacks.setdefault(("MERGE_ROWS", area[0], area[3], area[4]), []).append(area[1])
+
+                elif area[4] - area[3] == 1 and area[2] - area[1] > 1:
+                    stacks.setdefault(("MERGE_COLUMNS", area[0], area[1], area[2]), []).append(area[3])
+
+        foldedMerges = {}
+        for (mergeType, sheetId, start, end), positions in stacks.items():
+            positions.sort()
+            stackStart = 0
+
+            for i in range(1, len(positions) + 1):
+                if i == len(positions) or positions[i] != positions[i - 1] + 1:
+                    if i - stackStart > 1:
+                        first, last = positions[stackStart], positions[i - 1] + 1
+
+                        if mergeType == "MERGE_ROWS":
+                            foldedRange = {"sheetId": sheetId, "startRowIndex": first, "endRowIndex": last, "startColumnIndex": start, "endColumnIndex": end}
+                            foldedAreas = [(sheetId, row, row + 1, start, end) for row in positions[stackStart : i]]
+                        else:
+                            foldedRange = {"sheetId": sheetId, "startRowIndex": start, "endRowIndex": end, "startColumnIndex": first, "endColumnIndex": last}
+                            foldedAreas = [(sheetId, start, end, col, col + 1) for col in positions[stackStart : i]]
+
+                        merge = {"mergeCells": {"range": foldedRange, "mergeType": mergeType}}
+                        foldedMerges.update({area: merge for area in foldedAreas})
+
+                    stackStart = i
+
+        emitted = set()
+        for sheetRequest in requests[index : sequenceEnd]:
+            area = gridRange(sheetRequest["mergeCells"]["range"])
+            merge = foldedMerges.get(area) if area and sheetRequest["mergeCells"].get("mergeType") == "MERGE_ALL" else None
+
+            if merge is None:
+                foldedRequests.append(sheetRequest)
+
+            elif id(merge) not in emitted:
+                emitted.add(id(merge))
+                foldedRequests.append(merge)
+
+        index = sequenceEnd
+
+    return foldedRequests
+
+def compactRequests(requests):
+    return RequestCompactor().compact(requests)
@@ -0,0 +1,806 @@
+# Card layouts of RunAndBunStats : game tables, Google Sheets request builders and the run and Pokémon cards built from them
+# Every function appends requests to the list it is given, nothing here calls Google
+
+ZONES = ["Starter", "Littleroot Town", "Route 101", "Oldale Town", "Route 103", "Route 102", "Petalburg City", "Route 104", "Dewford Town", "Route 107", "Route 106", "Granite Cave", "Route 109", "Slateport City", "Route 110", "Petalburg Woods", "Rustboro City", "Route 115", "Route 116", "Rusturf Tunnel", "Verdanturf Town", "Route 117", "Mauville City", "Route 111", "Route 118", "Altering Cave", "Mirage Tower", "Route 113", "Fallarbor Town", "Desert Underpass", "Route 114", "Meteor Falls", "Route 112", "Fiery Path", "Mt. Chimney", "Jagged Pass", "Lavaridge Town", "Route 134", "New Mauville", "Route 105", "Route 108", "Abandoned Ship", "Route 119", "Fortree City", "Route 120", "Scorched Slab", "Route 121", "Safari Zone", "Lilycove City", "Route 122", "Route 123", "Mt. Pyre", "Magma Hideout", "Aqua Hideout", "Route 124", "Mossdeep City", "Route 125", "Shoal Cave", "Route 127", "Route 124 Underwater", "Route 126", "Route 126 Underwater", "Sootopolis City", "Route 128", "Route 129", "Ever Grande City", "Seafloor Cavern", "Cave of Origin", "Route 130", "Route 131", "Pacifidlog Town", "Route 132", "Route 133", "Sky Pillar", "Victory Road"]
+
+# Pokémon card index of each zone (0 : first card)
+ZONE_INDEX = {zone: i for i, zone in enumerate(ZONES)}
+
+BADGES = ["Knuckle Badge", "Stone Badge", "Dynamo Badge", "Balance Badge", "Heat Badge", "Feather Badge", "Mind Badge", "Rain Badge"]
+STATS_NAMES = {
+    "EN": ["HP", "Attack", "Defense", "Sp. Atk", "Sp. Def", "Speed"],
+    "FR": ["PV", "Attaque", "Défense", "Atq. Spé", "Def. Spé", "Vitesse"]
+}
+
+NATURE_DICO_FR = {
+    "Adamant": "Rigide",
+    "Bashful": "Pudique",
+    "Bold": "Assuré",
+    "Brave": "Brave",
+    "Calm": "Calme",
+    "Careful": "Prudent",
+    "Docile": "Docile",
+    "Gentle": "Gentil",
+    "Hardy": "Hardi",
+    "Hasty": "Pressé",
+    "Impish": "Malin",
+    "Jolly": "Jovial",
+    "Lax": "Lâche",
+    "Lonely": "Solo",
+    "Mild": "Doux",
+    "Modest": "Modeste",
+    "Naive": "Naïf",
+    "Naughty": "Mauvais",
+    "Quiet": "Discret",
+    "Quirky": "Bizarre",
+    "Rash": "Foufou",
+    "Relaxed": "Relax",
+    "Sassy": "Malpoli",
+    "Serious": "Sérieux",
+    "Timid": "Timide"
+}
+
+NATURE_DICO = {
+    "Hardy": [None, None],
+    "Lonely": [1, 2],
+    "Brave": [1, 5],
+    "Adamant": [1, 3],
+    "Naughty": [1, 4],
+	"Bold": [2, 1],
+    "Docile": [None, None],
+    "Relaxed": [2, 5],
+    "Impish": [2, 3],
+    "Lax": [2, 4],
+	"Timid": [5, 1],
+    "Hasty": [5, 2],
+    "Serious": [None, None],
+    "Jolly": [5, 3],
+    "Naive": [5, 4],
+	"Modest": [3, 1],
+    "Mild": [3, 2],
+    "Quiet": [3, 5],
+    "Bashful": [None, None],
+    "Rash": [3, 4],
+	"Calm": [4, 1],
+    "Gentle": [4, 2],
+    "Sassy": [4, 5],
+    "Careful": [4, 3],
+    "Quirky": [None, None]
+}
+
+# Setup NATURE_DICO with french Nature values
+for english, french in NATURE_DICO_FR.items():
+    NATURE_DICO[french] = NATURE_DICO[english]
+
+# English name of each french Nature, natures are counted in one language whatever the language of the sheet
+NATURE_NAMES_EN = {french: english for english, french in NATURE_DICO_FR.items()}
+
+# Rows of a run card, and columns of a run card with its Pokémon cards
+RUN_CARD_HEIGHT = 18
+RUN_CARD_WIDTH = 10 + 5 * len(ZONES)
+
+# Colors in API are 0..1 floats
+COLOR_WHITE = {"red": 1, "green": 1, "blue": 1}
+COLOR_BLACK = {"red": 0, "green": 0, "blue": 0}
+COLOR_GREY = {"red": 0.4, "green": 0.4, "blue": 0.4}
+COLOR_LIGHTGREY = {"red": 0.95, "green": 0.95, "blue": 0.95}
+COLOR_CYAN = {"red": 0, "green": 1, "blue": 1}
+COLOR_RED = {"red": 1, "green": 0, "blue": 0}
+COLOR_LIGHTRED = {"red": 1, "green": 0.5, "blue": 0.5}
+
+MERGE = 1
+BOLD = 2
+CENTER = 3
+FONT_CYAN = 4
+FONT_RED = 5
+FONT_LIGHTRED = 6
+FONT_WHITE = 7
+BACKGROUND_GREY = 8
+BACKGROUND_LIGHTGREY = 9
+BACKGROUND_BLACK = 10
+FORMULA = 11
+
+
+def mergeCells(requests, range):
+    requests.append({"mergeCells": {"range": range, "mergeType": "MERGE_ALL"}})
+
+def unmergeCells(requests, range):
+    requests.append({"unmergeCells": {"range": range}})
+
+def setCellContent(requests, range, cellContent, options = []):
+    userEnteredFormat = {"textFormat": {}}
+    fields = "userEnteredValue,userEnteredFormat(textFormat"
+    userEnteredValue = {}
+
+    if MERGE in options:
+        mergeCells(requests, range)
+
+    if BOLD in options:
+        userEnteredFormat["textFormat"]["bold"] = True
+
+    if FONT_CYAN in options:
+        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_CYAN
+
+    elif FONT_RED in options:
+        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_RED
+
+    elif FONT_LIGHTRED in options:
+        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_LIGHTRED
+
+    elif FONT_WHITE in options:
+        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_WHITE
+
+    if CENTER in options:
+        userEnteredFormat["horizontalAlignment"] = "CENTER"
+        fields += ",horizontalAlignment"
+
+    if BACKGROUND_GREY in options:
+        userEnteredFormat["backgroundColor"] = COLOR_GREY
+        fields += ",backgroundColor"
+
+    elif BACKGROUND_BLACK in options:
+        userEnteredFormat["backgroundColor"] = COLOR_BLACK
+        fields += ",backgroundColor"
+
+    elif BACKGROUND_LIGHTGREY in options:
+        userEnteredFormat["backgroundColor"] = COLOR_LIGHTGREY
+        fields += ",backgroundColor"
+
+    if FORMULA in options:
+        userEnteredValue["formulaValue"] = cellContent
+    else:
+        userEnteredValue["stringValue"] = cellContent
+
+    requests.append({
+        "repeatCell": {
+            "range": range,
+            "cell": {
+                "userEnteredValue": userEnteredValue,
+                "userEnteredFormat": userEnteredFormat
+            },
+            "fields": fields + ")"
+        }
+    })
+
+def setCellBoldSplitContent(requests, range, boldString, regularString):
+    requests.append({
+        "updateCells": {
+            "range": range,
+            "rows": [
+                {
+                    "values": [
+                        {
+                            "userEnteredValue": {"stringValue": f"{boldString} {regularString}"},
+                            "textFormatRuns": [
+                                {"startIndex": 0, "format": {"bold": True}},
+                                {"startIndex": len(boldString), "format": {"bold": False}}
+                            ]
+                        }
+                    ]
+                }
+            ],
+            "fields": "userEnteredValue,textFormatRuns"
+        }
+    })
+
+def setCellValue(requests, range, cellContent, options = []):
+    requests.append({
+        "repeatCell": {
+            "range": range,
+            "cell": {"userEnteredValue": {"formulaValue" if FORMULA in options else "stringValue": cellContent}},
+            "fields": "userEnteredValue"
+        }
+    })
+
+def emptyCell(requests, range):
+    requests.append({
+        "repeatCell": {
+            "range": range,
+            "cell": { "userEnteredValue": None },
+            "fields": "userEnteredValue"
+        }
+    })
+
+def clearFormatting(requests, range):
+    requests.append({
+        "repeatCell": {
+            "range": range,
+            "cell": {"userEnteredFormat": {}},
+            "fields": "userEnteredFormat"
+        }
+    })
+
+def updateColumnSize(requests, sheetId, columnSize, columnId, columnNumbers = 1):
+    requests.append({
+        "updateDimensionProperties": {
+            "range": {"sheetId": sheetId, "dimension": "COLUMNS", "startIndex": columnId, "endIndex": columnId + columnNumbers},
+            "properties": {"pixelSize": columnSize},
+            "fields": "pixelSize"
+        }
+    })
+
+def addBorders(requests, range):
+    requests.append({
+        "updateBorders": {
+            "range": range,
+            "top": {"style": "SOLID", "width": 1, "color": COLOR_BLACK},
+            "bottom": {"style": "SOLID", "width": 1, "color": COLOR_BLACK},
+            "left": {"style": "SOLID", "width": 1, "color": COLOR_BLACK},
+            "right": {"style": "SOLID", "width": 1,"color": COLOR_BLACK},
+        }
+    })
+
+def insertRows(requests, sheetId, numberOfRows):
+    requests.append({
+        "insertDimension": {
+            "range": {
+                "sheetId": sheetId,
+                "dimension": "ROWS",
+                "startIndex": 0,
+                "endIndex": numberOfRows
+            }
+        }
+    })
+
+def copyRange(requests, source, destination):
+    requests.append({
+        "copyPaste": {
+            "source": source,
+            "destination": destination,
+            "pasteType": "PASTE_NORMAL"
+        }
+    })
+
+def addSheet(requests, sheetId, title, rowCount, columnCount, hidden = False):
+    requests.append({
+        "addSheet": {
+            "properties": {
+                "sheetId": sheetId,
+                "title": title,
+                "hidden": hidden,
+                "gridProperties": {"rowCount": rowCount, "columnCount": columnCount}
+            }
+        }
+    })
+
+def deleteRows(requests, sheetId, startRow, endRow):
+    requests.append({
+        "deleteDimension": {
+            "range": {
+                "sheetId": sheetId,
+                "dimension": "ROWS",
+                "startIndex": startRow,
+                "endIndex": endRow
+            }
+        }
+    })
+
+
+# Card layouts : every cell of a run card and of a Pokémon card, relative to the top left corner of the card
+# Each entry is ((rowStart, rowEnd, colStart, colEnd), options) or a list of them, with the label of the cell if it has one
+# Compiled once into LayoutCell tables so cards only add their offsets and values, new and updated cards share the same cells
+RUN_DATA_FIELDS = ["runStart", "runEnd", "wonBattles", "deadPokemon"]
+
+# Fields a new run card and a Pokémon card are built from
+NEW_RUN_FIELDS = RUN_DATA_FIELDS + ["gymBadges", "personalBest"]
+PERSONAL_BEST_FIELDS = ["trainerName", "trainerSprite", "trainerTeam"]
+POKEMON_FIELDS = ["pokedexId", "alive", "nickname", "pokemonName", "ability", "level", "pid", "moves", "nature", "IVs"]
+
+RUN_CARD_SPEC = {
+    "clear": ((1, 18, 0, 500), []),
+    "template": ((0, 19, 0, 500), []),
+    "leftSeparator": ((2, 17, 0, 1), [MERGE, BACKGROUND_LIGHTGREY]),
+    "rightSeparator": ((2, 17, 9, 10), [MERGE, BACKGROUND_LIGHTGREY]),
+    "topGreyLine": ((0, 1, 0, 500), [MERGE, BACKGROUND_GREY]),
+    "topWhiteLine": ((1, 2, 0, 500), [MERGE, BACKGROUND_LIGHTGREY]),
+    "title": ((2, 3, 1, 9), [MERGE, BOLD, CENTER, FONT_CYAN, BACKGROUND_GREY]),
+    "runStartLabel": ((3, 4, 1, 5), [MERGE, BOLD, CENTER], {"EN": "Run start", "FR": "Début de la run"}),
+    "runStart": ((3, 4, 5, 9), [MERGE, CENTER]),
+    "runEndLabel": ((4, 5, 1, 5), [MERGE, BOLD, CENTER], {"EN": "Run end", "FR": "Fin de la run"}),
+    "runEnd": ((4, 5, 5, 9), [MERGE, CENTER]),
+    "wonBattlesLabel": ((5, 6, 1, 5), [MERGE, BOLD, CENTER], {"EN": "Won battles", "FR": "Combats gagnés"}),
+    "wonBattles": ((5, 6, 5, 9), [MERGE, CENTER]),
+    "deadPokemonLabel": ((6, 7, 1, 5), [MERGE, BOLD, CENTER], {"EN": "Dead Pokémon", "FR": "Pokémons morts"}),
+    "deadPokemon": ((6, 7, 5, 9), [MERGE, CENTER]),
+    "runId": ((7, 8, 1, 9), [MERGE, CENTER, FONT_WHITE]),
+    "gymBadgesLabel": ((8, 9, 1, 9), [MERGE, BOLD, CENTER], {"EN": "Gym Badges", "FR": "Badges"}),
+    "gymBadges": [((9, 11, i + 1, i + 2), [MERGE, CENTER, FORMULA]) for i in range(8)],
+    "badgesSeparator": ((11, 12, 1, 9), [MERGE]),
+    "personalBest": ((12, 13, 1, 9), [MERGE, CENTER]),
+    "teamSeparators": [((13, 17, col, col + 1), [MERGE]) for col in [1, 4, 8]],
+    "trainerSprite": ((13, 17, 2, 4), [MERGE, CENTER, FORMULA]),
+    "trainerTeam": [((13 + 2 * (i // 3), 15 + 2 * (i // 3), 5 + i % 3, 6 + i % 3), [MERGE, CENTER, FORMULA]) for i in range(6)],
+    "bottomWhiteLine": ((17, 18, 0, 500), [MERGE, BACKGROUND_LIGHTGREY]),
+    "bottomGreyLine": ((18, 19, 0, 500), [MERGE, BACKGROUND_GREY]),
+    "borders": ((2, 17, 1, 9), [])
+}
+
+POKEMON_CARD_SPEC = {
+    "card": ((0, 15, 0, 5), []),
+    "borders": ((0, 15, 0, 4), []),
+    "rightSeparator": ((0, 15, 4, 5), [MERGE, BACKGROUND_LIGHTGREY]),
+    "zone": ((0, 1, 0, 4), [MERGE, BOLD, CENTER, FONT_CYAN, BACKGROUND_GREY]),
+    "body": ((1, 15, 0, 4), []),
+    "emptyBody": ((1, 2, 0, 1), []),
+    "sprite": ((1, 5, 0, 4), [MERGE, CENTER, FORMULA]),
+    "nameRow": ((5, 6, 0, 4), []),
+    "name": [((5, 6, 0, 3 + alive), [MERGE, CENTER]) for alive in range(2)],
+    "dead": ((5, 6, 3, 4), [CENTER, BACKGROUND_BLACK]),
+    "ability": ((6, 7, 0, 2), [MERGE, CENTER]),
+    "level": ((6, 7, 2, 4), [MERGE, CENTER], {"EN": "Level", "FR": "Niveau"}),
+    "pid": ((7, 8, 0, 4), [MERGE, CENTER, FONT_WHITE]),
+    "moves": [((8 + i // 2, 9 + i // 2, 2 * (i % 2), 2 + 2 * (i % 2)), [MERGE, CENTER]) for i in range(4)],
+    "movesSeparator": ((10, 11, 0, 4), [MERGE]),
+    "nature": ((11, 12, 0, 4), [BOLD, MERGE, CENTER]),
+    "statNames": [((12 + i % 3, 13 + i % 3, 2 * (i // 3), 1 + 2 * (i // 3)), [CENTER]) for i in range(6)],
+    "IVs": [((12 + i % 3, 13 + i % 3, 1 + 2 * (i // 3), 2 + 2 * (i // 3)), [CENTER]) for i in range(6)],
+    "buffedIVs": [((12 + i % 3, 13 + i % 3, 1 + 2 * (i // 3), 2 + 2 * (i // 3)), [CENTER, FONT_RED, BOLD]) for i in range(6)],
+    "debuffedIVs": [((12 + i % 3, 13 + i % 3, 1 + 2 * (i // 3), 2 + 2 * (i // 3)), [CENTER, FONT_LIGHTRED]) for i in range(6)]
+}
+
+# Column sizes : (pixel size, first column relative to the card, number of columns)
+RUN_CARD_COLUMNS = [(21, 0, 1), (55, 1, 8), (21, 9, 1)]
+POKEMON_CARD_COLUMNS = [(75, 0, 1), (21, 1, 1), (75, 2, 1), (21, 3, 2)]
+
+# A cell of a card layout, with the cell format and "fields" mask setCellContent would build for its options
+# Formats are shared by every request written from the cell : they must never be modified
+class LayoutCell:
+    __slots__ = ("rowStart", "rowEnd", "colStart", "colEnd", "merge", "formula", "format", "fields", "labels")
+
+    def __init__(self, area, options, labels = None):
+        self.rowStart, self.rowEnd, self.colStart, self.colEnd = area
+        self.merge = MERGE in options
+        self.formula = FORMULA in options
+        self.labels = labels
+
+        formatRequests = []
+        setCellContent(formatRequests, None, "", options = [option for option in options if option != MERGE])
+        self.format = formatRequests[0]["repeatCell"]["cell"]["userEnteredFormat"]
+        self.fields = formatRequests[0]["repeatCell"]["fields"]
+
+    def label(self, lang):
+        return self.labels["FR"] if lang == "FR" else self.labels["EN"]
+
+def compileLayout(spec):
+    return {name: [LayoutCell(*entry) for entry in entries] if isinstance(entries, list) else LayoutCell(*entries) for name, entries in spec.items()}
+
+RUN_CARD = compileLayout(RUN_CARD_SPEC)
+POKEMON_CARD = compileLayout(POKEMON_CARD_SPEC)
+
+# Requests writing the layout cells of one card, placed at startRow/startColumn of the sheet
+class CardWriter:
+    __slots__ = ("requests", "sheetId", "startRow", "startColumn")
+
+    def __init__(self, requests, sheetId, startRow, startColumn = 0):
+        self.requests = requests
+        self.sheetId = sheetId
+        self.startRow = startRow
+        self.startColumn = startColumn
+
+    def range(self, cell):
+        return {
+            "sheetId": self.sheetId,
+            "startRowIndex": self.startRow + cell.rowStart,
+            "endRowIndex": self.startRow + cell.rowEnd,
+            "startColumnIndex": self.startColumn + cell.colStart,
+            "endColumnIndex": self.startColumn + cell.colEnd
+        }
+
+    # Value and format of the cell, merged first unless merge is False (card already rendered)
+    def content(self, cell, cellContent, merge = True, formula = None):
+        range = self.range(cell)
+
+        if merge and cell.merge:
+            mergeCells(self.requests, range)
+
+        self.requests.append({
+            "repeatCell": {
+                "range": range,
+                "cell": {
+                    "userEnteredValue": {"formulaValue" if (cell.formula if formula is None else formula) else "stringValue": cellContent},
+                    "userEnteredFormat": cell.format
+                },
+                "fields": cell.fields
+            }
+        })
+
+    # Value only, the format already being in place
+    def value(self, cell, cellContent, formula = False):
+        setCellValue(self.requests, self.range(cell), cellContent, options = [FORMULA] if formula else [])
+
+    def boldSplit(self, cell, boldString, regularString):
+        setCellBoldSplitContent(self.requests, self.range(cell), boldString, regularString)
+
+    def merge(self, cell):
+        mergeCells(self.requests, self.range(cell))
+
+    def unmerge(self, cell):
+        unmergeCells(self.requests, self.range(cell))
+
+    def borders(self, cell):
+        addBorders(self.requests, self.range(cell))
+
+    def columns(self, columnSizes):
+        for columnSize, columnId, columnNumbers in columnSizes:
+            updateColumnSize(self.requests, self.sheetId, columnSize, self.startColumn + columnId, columnNumbers)
+
+def runCardWriter(requests, sheetId, runCardId):
+    return CardWriter(requests, sheetId, RUN_CARD_HEIGHT * runCardId)
+
+def pokemonCardWriter(requests, sheetId, runCardId, pokemonCardId):
+    return CardWriter(requests, sheetId, RUN_CARD_HEIGHT * runCardId + 2, 10 + 5 * pokemonCardId)
+
+# Column sizes set by a run card and its Pokémon cards, for sheets getting run cards without rendering one
+def updateCardColumnSizes(requests, sheetId):
+    runCardWriter(requests, sheetId, 0).columns(RUN_CARD_COLUMNS)
+
+    for pokemonCardId in range(len(ZONES)):
+        pokemonCardWriter(requests, sheetId, 0, pokemonCardId).columns(POKEMON_CARD_COLUMNS)
+
+# IV cell colored by the nature of the Pokémon
+def ivCell(stat, statBuffed, statDebuffed):
+    if stat == statBuffed:
+        return POKEMON_CARD["buffedIVs"][stat]
+
+    if stat == statDebuffed:
+        return POKEMON_CARD["debuffedIVs"][stat]
+
+    return POKEMON_CARD["IVs"][stat]
+
+
+# New run card inserted at the top, or written at runCardId in rows inserted beforehand (backfill)
+def generateRunCard(requests, sheetId, runId, runData, lang, runNumber = None, runCardId = None):
+    card = runCardWriter(requests, sheetId, runCardId or 0)
+
+    # Insert 18 rows and clear formatting to make place for the new run
+    if runCardId is None:
+        insertRows(requests, sheetId, 18)
+
+    clearFormatting(requests, card.range(RUN_CARD["clear"]))
+
+    # Left/right white separator, merge all cells vertically
+    card.content(RUN_CARD["leftSeparator"], "")
+    card.content(RUN_CARD["rightSeparator"], "")
+
+    # Top grey line and top white line, merge all cells horizontally
+    card.content(RUN_CARD["topGreyLine"], "")
+    card.content(RUN_CARD["topWhiteLine"], "")
+
+    # Run number, static value computed from the run index (blank runs get a bare title)
+    card.content(RUN_CARD["title"], f"Run #{runNumber}" if runNumber else "Run #")
+
+    # Run start/end dates, won battles and dead Pokémon, with their labels
+    for key in RUN_DATA_FIELDS:
+        card.content(RUN_CARD[key + "Label"], RUN_CARD[key + "Label"].label(lang))
+        card.content(RUN_CARD[key], runData[key])
+
+    # White separator, merge all cells horizontally, hide runId in white font
+    card.content(RUN_CARD["runId"], f"RundId : {runId}")
+
+    # Gym Badges label and sprites
+    card.content(RUN_CARD["gymBadgesLabel"], RUN_CARD["gymBadgesLabel"].label(lang))
+
+    for i in range(8):
+        card.content(RUN_CARD["gymBadges"][i], f'=VLOOKUP("{BADGES[i]}",Sprites!$A:$B,2,FALSE)' if i < runData["gymBadges"] else "",
+                     formula = i < runData["gymBadges"])
+
+    # White separator, merge all cells horizontally
+    card.merge(RUN_CARD["badgesSeparator"])
+
+    # Personal Best Trainer Name
+    card.content(RUN_CARD["personalBest"], "")
+    card.boldSplit(RUN_CARD["personalBest"], "Personal Best : ", runData["personalBest"]["trainerName"])
+
+    # Merge trainer team separators
+    for separator in RUN_CARD["teamSeparators"]:
+        card.merge(separator)
+
+    # Personal Best Trainer Sprite
+    card.content(RUN_CARD["trainerSprite"], f'=VLOOKUP("{runData["personalBest"]["trainerSprite"]}",Sprites!$A:$B,2,FALSE)')
+
+    # Personal Best Trainer Team Sprites, 3 on top and 3 on bottom
+    trainerTeam = runData["personalBest"]["trainerTeam"]
+
+    for i in range(6):
+        card.content(RUN_CARD["trainerTeam"][i], f'=VLOOKUP({trainerTeam[i]},Sprites!$A:$B,2,FALSE)' if i < len(trainerTeam) else "",
+                     formula = i < len(trainerTeam))
+
+    # Bottom white line and bottom grey line, merge all cells horizontally
+    card.content(RUN_CARD["bottomWhiteLine"], "")
+    card.content(RUN_CARD["bottomGreyLine"], "")
+
+    # Add borders
+    card.borders(RUN_CARD["borders"])
+
+
+# Cells of a new run card depending on the language and the run number, written over a copy of the card compiled for another target
+def runCardOverlay(requests, sheetId, runId, runData, lang, runNumber = None, runCardId = None):
+    card = runCardWriter(requests, sheetId, runCardId or 0)
+    card.value(RUN_CARD["title"], f"Run #{runNumber}" if runNumber else "Run #")
+
+    for key in RUN_DATA_FIELDS + ["gymBadges"]:
+        card.value(RUN_CARD[key + "Label"], RUN_CARD[key + "Label"].label(lang))
+
+
+def updateRunCard(requests, sheetId, runCardId, runData, previousRunData = None):
+    card = runCardWriter(requests, sheetId, runCardId)
+    previousRunData = previousRunData or {}
+
+    # Only keep parameters that changed since the last pushed state
+    runData = {key: value for key, value in runData.items() if previousRunData.get(key) != value}
+
+    # Run start/end dates, won battles and dead Pokémon
+    for key in RUN_DATA_FIELDS:
+        if key in runData:
+            card.content(RUN_CARD[key], runData[key], merge = False)
+
+    # Gym Badges sprites, starting after the badges already displayed, or cleared down to the new count
+    if "gymBadges" in runData:
+        previousBadges = previousRunData.get("gymBadges", 0)
+
+        for col in range(previousBadges, runData["gymBadges"]):
+            card.content(RUN_CARD["gymBadges"][col], f'=VLOOKUP("{BADGES[col]}",Sprites!$A:$B,2,FALSE)', merge = False)
+
+        for col in range(runData["gymBadges"], previousBadges):
+            card.content(RUN_CARD["gymBadges"][col], "", merge = False, formula = False)
+
+    # Personal Best
+    if "personalBest" in runData:
+        personalBest = runData["personalBest"]
+        previousPersonalBest = previousRunData.get("personalBest", {})
+
+        # Personal Best Trainer Name
+        if personalBest["trainerName"] != previousPersonalBest.get("trainerName"):
+            card.boldSplit(RUN_CARD["personalBest"], "Personal Best : ", personalBest["trainerName"])
+
+        # Personal Best Trainer Sprite
+        if personalBest["trainerSprite"] != previousPersonalBest.get("trainerSprite"):
+            card.content(RUN_CARD["trainerSprite"], f'=VLOOKUP("{personalBest["trainerSprite"]}",Sprites!$A:$B,2,FALSE)', merge = False)
+
+        # Personal Best Trainer Team Sprites, 3 on top and 3 on bottom
+        previousTrainerTeam = previousPersonalBest.get("trainerTeam")
+
+        for i in range(6):
+            if previousTrainerTeam is not None and personalBest["trainerTeam"][i : i + 1] == previousTrainerTeam[i : i + 1]:
+                continue
+
+            card.content(RUN_CARD["trainerTeam"][i], f'=VLOOKUP({personalBest["trainerTeam"][i]},Sprites!$A:$B,2,FALSE)' if i < len(personalBest["trainerTeam"]) else "",
+                         merge = False, formula = i < len(personalBest["trainerTeam"]))
+
+
+# Static "Run #N" title of existing run cards
+def updateRunTitles(requests, sheetId, runIndex, runIds):
+    for runId in sorted(runIds, key = runIndex.get):
+        runCardWriter(requests, sheetId, runIndex.get(runId)).value(RUN_CARD["title"], f"Run #{runIndex.runNumber(runId)}")
+
+# Same result as generateRunCard followed by empty Pokémon cards, using the blank run card of a template sheet
+def generateRunCardFromTemplate(requests, sheetId, templateSheetId, runId, runData, runNumber):
+    card = runCardWriter(requests, sheetId, 0)
+
+    # Insert 18 rows and paste the blank run card with its layout, labels and empty Pokémon cards
+    insertRows(requests, sheetId, 18)
+    copyRange(requests, {**card.range(RUN_CARD["template"]), "sheetId": templateSheetId}, card.range(RUN_CARD["template"]))
+
+    # Run number
+    card.value(RUN_CARD["title"], f"Run #{runNumber}")
+
+    # White separator, hide runId in white font
+    card.value(RUN_CARD["runId"], f"RundId : {runId}")
+
+    # Run data, Gym Badges and Personal Best
+    updateRunCard(requests, sheetId, 0, runData)
+
+
+def generatePokemonCard(requests, sheetId, pokemon, zone, runCardId, pokemonCardId, lang):
+    card = pokemonCardWriter(requests, sheetId, runCardId, pokemonCardId)
+
+    # Add borders
+    card.borders(POKEMON_CARD["borders"])
+
+    pokemonCardContent(card, pokemon, zone, lang)
+
+# Values and formats of a Pokémon card, merged as they are written unless merge is False (layout pasted beforehand)
+def pokemonCardContent(card, pokemon, zone, lang, merge = True):
+
+    # Right white separator, merge all cells vertically
+    card.content(POKEMON_CARD["rightSeparator"], "", merge = merge)
+
+    # Zone name
+    card.content(POKEMON_CARD["zone"], zone, merge = merge)
+
+    # Reset Pokémon card by unmerging all cells
+    if merge:
+        card.unmerge(POKEMON_CARD["body"])
+
+    # Pokémon caught in the zone : display all Pokémon data
+    if pokemon:
+
+        # Pokémon sprite
+        card.content(POKEMON_CARD["sprite"], f"=VLOOKUP({pokemon["pokedexId"]},Sprites!$A:$B,2,FALSE)", merge = merge)
+
+        # Pokémon name + nickname, next to the dead emoji if the Pokémon is dead
+        nameCell = POKEMON_CARD["name"][pokemon["alive"]]
+
+        if merge:
+            card.unmerge(POKEMON_CARD["nameRow"])
+
+        card.content(nameCell, "", merge = merge)
+        card.boldSplit(nameCell, pokemon["nickname"], f"({pokemon["pokemonName"]})")
+
+        # Dead emoji
+        if (not pokemon["alive"]):
+            card.content(POKEMON_CARD["dead"], "💀")
+
+        # Ability
+        card.content(POKEMON_CARD["ability"], pokemon["ability"], merge = merge)
+
+        # Level
+        card.content(POKEMON_CARD["level"], f"{POKEMON_CARD["level"].label(lang)} {pokemon["level"]}", merge = merge)
+
+        # White separator, merge all cells horizontally, hide PID in white font
+        card.content(POKEMON_CARD["pid"], f"{pokemon["pid"]}", merge = merge)
+
+        # Moves
+        for i in range(4):
+            card.content(POKEMON_CARD["moves"][i], pokemon["moves"][i], merge = merge)
+
+        # White separator, merge all cells horizontally
+        if merge:
+            card.merge(POKEMON_CARD["movesSeparator"])
+
+        # Nature
+        card.content(POKEMON_CARD["nature"], pokemon["nature"], merge = merge)
+
+        # Stats
+        statBuffed, statDebuffed = NATURE_DICO[pokemon["nature"]]
+
+        for i in range(6):
+            card.content(POKEMON_CARD["statNames"][i], STATS_NAMES[lang][i])
+            card.content(ivCell(i, statBuffed, statDebuffed), pokemon["IVs"][i])
+
+    # No Pokémon caught in the zone : merge all cells
+    else:
+        if merge:
+            card.merge(POKEMON_CARD["body"])
+
+        emptyCell(card.requests, card.range(POKEMON_CARD["emptyBody"]))
+
+# Merges pokemonCardContent makes in blank rows, for an empty card or a card with a Pokémon alive or dead
+def pokemonCardLayout(card, pokemon):
+    card.merge(POKEMON_CARD["rightSeparator"])
+    card.merge(POKEMON_CARD["zone"])
+
+    if not pokemon:
+        card.merge(POKEMON_CARD["body"])
+        return
+
+    for cell in [POKEMON_CARD["sprite"], POKEMON_CARD["name"][pokemon["alive"]], POKEMON_CARD["ability"], POKEMON_CARD["level"], POKEMON_CARD["pid"],
+                 *POKEMON_CARD["moves"], POKEMON_CARD["movesSeparator"], POKEMON_CARD["nature"]]:
+        card.merge(cell)
+
+# Every Pokémon card of a new run, in blank rows, with a handful of pastes instead of the borders and merges of each card :
+# the first card of each kind (empty, alive, dead) is laid out, the most common kind is pasted over every other card,
+# then the other kinds over their runs of consecutive cards (a paste replaces the merges it covers), then each card gets its values
+def generatePokemonCards(requests, sheetId, pokemonData, runCardId, lang):
+    kinds = {}
+
+    for pokemonCardId, zone in enumerate(ZONES):
+        pokemon = pokemonData.get(zone)
+        kinds.setdefault(pokemon["alive"] if pokemon else None, []).append(pokemonCardId)
+
+    def cardRange(firstCardId, lastCardId):
+        area = pokemonCardWriter(requests, sheetId, runCardId, firstCardId).range(POKEMON_CARD["card"])
+        area["endColumnIndex"] = pokemonCardWriter(requests, sheetId, runCardId, lastCardId).range(POKEMON_CARD["card"])["endColumnIndex"]
+        return area
+
+    # A destination spanning several cards gets the source card repeated over it
+    def pasteCard(sourceCardId, pokemonCardIds):
+        pastedRuns = []
+
+        for pokemonCardId in pokemonCardIds:
+            if pastedRuns and pastedRuns[-1][1] == pokemonCardId - 1:
+                pastedRuns[-1][1] = pokemonCardId
+            else:
+                pastedRuns.append([pokemonCardId, pokemonCardId])
+
+        for first, last in pastedRuns:
+            copyRange(requests, cardRange(sourceCardId, sourceCardId), cardRange(first, last))
+
+    sourceCardIds = {kind: pokemonCardIds[0] for kind, pokemonCardIds in kinds.items()}
+
+    for sourceCardId in sourceCardIds.values():
+        card = pokemonCardWriter(requests, sheetId, runCardId, sourceCardId)
+        card.borders(POKEMON_CARD["borders"])
+        pokemonCardLayout(card, pokemonData.get(ZONES[sourceCardId]))
+
+    baseKind = max(kinds, key = lambda kind: len(kinds[kind]))
+    pasteCard(sourceCardIds[baseKind], [pokemonCardId for pokemonCardId in range(len(ZONES)) if pokemonCardId not in sourceCardIds.values()])
+
+    for kind, pokemonCardIds in kinds.items():
+        if kind != baseKind:
+            pasteCard(sourceCardIds[kind], pokemonCardIds[1:])
+
+    for pokemonCardId, zone in enumerate(ZONES):
+        pokemonCardContent(pokemonCardWriter(requests, sheetId, runCardId, pokemonCardId), pokemonData.get(zone), zone, lang, merge = False)
+
+
+# Cells of a Pokémon card depending on the language, written over a copy of the card compiled for another target
+def pokemonCardOverlay(requests, sheetId, pokemon, zone, runCardId, pokemonCardId, lang):
+    if not pokemon:
+        return
+
+    card = pokemonCardWriter(requests, sheetId, runCardId, pokemonCardId)
+    card.value(POKEMON_CARD["level"], f"{POKEMON_CARD["level"].label(lang)} {pokemon["level"]}")
+
+    for i in range(6):
+        card.value(POKEMON_CARD["statNames"][i], STATS_NAMES[lang][i])
+
+# Cells of every Pokémon card of a new run depending on the language
+def pokemonCardsOverlay(requests, sheetId, pokemonData, runCardId, lang):
+    for pokemonCardId, zone in enumerate(ZONES):
+        pokemonCardOverlay(requests, sheetId, pokemonData.get(zone), zone, runCardId, pokemonCardId, lang)
+
+
+
+def updatePokemonCard(requests, sheetId, previousPokemon, pokemon, zone, runCardId, pokemonCardId, lang):
+
+    # Nothing changed since the last pushed state
+    if pokemon == previousPokemon:
+        return
+
+    # Pokémon caught, released or dead : merges and colors change, regenerate the whole card
+    if not pokemon or not previousPokemon or pokemon["alive"] != previousPokemon["alive"]:
+        generatePokemonCard(requests, sheetId, pokemon, zone, runCardId, pokemonCardId, lang)
+        return
+
+    card = pokemonCardWriter(requests, sheetId, runCardId, pokemonCardId)
+
+    # Pokémon sprite
+    if pokemon["pokedexId"] != previousPokemon["pokedexId"]:
+        card.value(POKEMON_CARD["sprite"], f"=VLOOKUP({pokemon["pokedexId"]},Sprites!$A:$B,2,FALSE)", formula = True)
+
+    # Pokémon name + nickname
+    if pokemon["nickname"] != previousPokemon["nickname"] or pokemon["pokemonName"] != previousPokemon["pokemonName"]:
+        card.boldSplit(POKEMON_CARD["name"][pokemon["alive"]], pokemon["nickname"], f"({pokemon["pokemonName"]})")
+
+    # Ability
+    if pokemon["ability"] != previousPokemon["ability"]:
+        card.value(POKEMON_CARD["ability"], pokemon["ability"])
+
+    # Level
+    if pokemon["level"] != previousPokemon["level"]:
+        card.value(POKEMON_CARD["level"], f"{POKEMON_CARD["level"].label(lang)} {pokemon["level"]}")
+
+    # Hidden PID
+    if pokemon["pid"] != previousPokemon["pid"]:
+        card.value(POKEMON_CARD["pid"], f"{pokemon["pid"]}")
+
+    # Moves
+    for i in range(4):
+        if pokemon["moves"][i] != previousPokemon["moves"][i]:
+            card.value(POKEMON_CARD["moves"][i], pokemon["moves"][i])
+
+    # Nature
+    if pokemon["nature"] != previousPokemon["nature"]:
+        card.value(POKEMON_CARD["nature"], pokemon["nature"])
+
+    # Stats : a new nature changes the colors of the previous and new buffed/debuffed stats
+    statBuffed, statDebuffed = NATURE_DICO[pokemon["nature"]]
+    restyledStats = set(NATURE_DICO[previousPokemon["nature"]] + NATURE_DICO[pokemon["nature"]]) if pokemon["nature"] != previousPokemon["nature"] else set()
+
+    for i in range(6):
+        if i in restyledStats:
+            card.content(ivCell(i, statBuffed, statDebuffed), pokemon["IVs"][i])
+        elif pokemon["IVs"][i] != previousPokemon["IVs"][i]:
+            card.value(POKEMON_CARD["IVs"][i], pokemon["IVs"][i])
+
+# Same cells as updatePokemonCard wrote depending on the language, for a copy of the card compiled for another target
+def updatedPokemonCardOverlay(requests, sheetId, previousPokemon, pokemon, zone, runCardId, pokemonCardId, lang):
+    if pokemon == previousPokemon:
+        return
+
+    if not pokemon or not previousPokemon or pokemon["alive"] != previousPokemon["alive"]:
+        pokemonCardOverlay(requests, sheetId, pokemon, zone, runCardId, pokemonCardId, lang)
+
+    elif pokemon["level"] != previousPokemon["level"]:
+        pokemonCardWriter(requests, sheetId, runCardId, pokemonCardId).value(POKEMON_CARD["level"], f"{POKEMON_CARD["level"].label(lang)} {pokemon["level"]}")
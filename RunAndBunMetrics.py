@@ -0,0 +1,107 @@
+import threading
+import time
+import copy
+from contextlib import contextmanager
+
+# Prometheus metrics, rendered in text format by /metrics
+TIME_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+COUNT_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+class Metrics:
+    def __init__(self):
+        self.definitions = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def define(self, name, metricType, description, buckets = None):
+        self.definitions[name] = (metricType, description, buckets)
+
+    def increment(self, name, labels = {}, value = 1):
+        key = (name, tuple(sorted((labelName, str(labelValue)) for labelName, labelValue in labels.items())))
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    # Histogram values are [count per bucket, sum, count], buckets are made cumulative when rendered
+    def observe(self, name, value, labels = {}):
+        key = (name, tuple(sorted((labelName, str(labelValue)) for labelName, labelValue in labels.items())))
+        buckets = self.definitions[name][2]
+
+        with self.lock:
+            histogram = self.values.setdefault(key, [[0] * len(buckets), 0, 0])
+
+            for i, bucket in enumerate(buckets):
+                if value <= bucket:
+                    histogram[0][i] += 1
+                    break
+
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, labels = {}):
+        startTime = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - startTime, labels)
+
+    def render(self):
+        lines = []
+
+        with self.lock:
+            values = sorted(copy.deepcopy(self.values).items())
+
+        def formatLabels(labels):
+            escapedLabels = []
+
+            for labelName, labelValue in labels:
+                labelValue = str(labelValue).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                escapedLabels.append(f'{labelName}="{labelValue}"')
+
+            return "{" + ",".join(escapedLabels) + "}" if escapedLabels else ""
+
+        for name, (metricType, description, buckets) in self.definitions.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metricType}")
+
+            for (valueName, labels), value in values:
+                if valueName != name:
+                    continue
+
+                if metricType != "histogram":
+                    lines.append(f"{name}{formatLabels(labels)} {value}")
+                    continue
+
+                cumulativeCount = 0
+                for bucket, bucketCount in zip(buckets, value[0]):
+                    cumulativeCount += bucketCount
+                    lines.append(f"{name}_bucket{formatLabels(labels + (("le", bucket),))} {cumulativeCount}")
+
+                lines.append(f"{name}_bucket{formatLabels(labels + (("le", "+Inf"),))} {value[2]}")
+                lines.append(f"{name}_sum{formatLabels(labels)} {value[1]}")
+                lines.append(f"{name}_count{formatLabels(labels)} {value[2]}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.define("runandbun_phase_seconds", "histogram", "Time spent in each phase of an update (parse, validate, queue, scan, lookup, compile, compact, upload)", TIME_BUCKETS)
+metrics.define("runandbun_sheets_call_seconds", "histogram", "Latency of Google Sheets API calls, one observation per batchUpdate chunk", TIME_BUCKETS)
+metrics.define("runandbun_sheets_calls_total", "counter", "Google Sheets API calls by method")
+metrics.define("runandbun_sheets_errors_total", "counter", "Failed Google Sheets API calls by method and HTTP status")
+metrics.define("runandbun_upload_retries_total", "counter", "Retried batchUpdate chunks")
+metrics.define("runandbun_upload_throttled_seconds_total", "counter", "Time spent waiting for write quota tokens")
+metrics.define("runandbun_upload_requests_total", "counter", "Requests uploaded with batchUpdate, after compaction")
+metrics.define("runandbun_upload_bytes_total", "counter", "Serialized bytes of the uploaded requests")
+metrics.define("runandbun_compiled_requests_total", "counter", "Requests compiled by card type, before compaction")
+metrics.define("runandbun_run_requests", "histogram", "Requests compiled per updated run, before compaction", COUNT_BUCKETS)
+metrics.define("runandbun_updates_total", "counter", "Answered /updateRun calls by HTTP status")
+metrics.define("runandbun_updates_deduplicated_total", "counter", "/updateRun calls answered by an earlier update, by Idempotency-Key or identical payload")
+metrics.define("runandbun_fanout_cards_total", "counter", "Run and Pokémon cards of fan-out updates, compiled for a first target or reused for another one")
+metrics.define("runandbun_captured_updates_total", "counter", "/updateRun bodies handed to the capture file, by result (recorded, dropped on a full queue or file, invalid)")
+metrics.define("runandbun_run_index_drifts_total", "counter", "Run indexes rebuilt because a run card was not where the index expected it")
+metrics.define("runandbun_journal_updates_total", "counter", "Updates that failed midway, by outcome (kept to be resumed, resumed, abandoned)")
+metrics.define("runandbun_profiles_total", "counter", "/updateRun profiles written to PROFILE_DIRECTORY, by reason (slow, sampled, header)")
+metrics.define("runandbun_updates_rejected_total", "counter", "/updateRun calls refused with a 429 before any work, by client or spreadsheet rate limit, full spreadsheet queue or server overload")
@@ -0,0 +1,205 @@
+from json.decoder import scanstring
+from collections.abc import Mapping
+import json
+import zlib
+import gzip
+import re
+import io
+import os
+import zstandard
+
+# /updateRun payload reading of RunAndBunStats : mandatory keys, decompression and the JSON scanner leaving fullData.runs undecoded
+
+# Max /updateRun body size once decompressed
+MAX_PAYLOAD_BYTES = int(os.getenv("MAX_PAYLOAD_BYTES", 64_000_000))
+
+def missingMandatoryKeys(data):
+    mandatoryKeys = {
+        "keys.spreadsheetId": data.get("keys", {}).get("spreadsheetId"),
+        "keys.sheetId": data.get("keys", {}).get("sheetId"),
+        "updatedData.runs": data.get("updatedData", {}).get("runs"),
+        "fullData.runs": data.get("fullData", {}).get("runs"),
+        "lang": data.get("lang")
+    }
+
+    # Protocol version 2 : fullData is kept in the run store, only the changes are sent
+    if data.get("version", 1) == 2:
+        del mandatoryKeys["fullData.runs"]
+
+    # Fan-out : each target replaces keys and lang
+    if "targets" in data:
+        del mandatoryKeys["keys.spreadsheetId"], mandatoryKeys["keys.sheetId"], mandatoryKeys["lang"]
+        mandatoryKeys["targets"] = data["targets"]
+
+        for i, target in enumerate(data["targets"] or []):
+            for key in ["spreadsheetId", "sheetId", "lang"]:
+                mandatoryKeys[f"targets.{i}.{key}"] = target.get(key)
+
+    for keyName, keyValue in mandatoryKeys.items():
+        if (not keyValue):
+            print(f"❌ Missing parameter {keyName}")
+            return keyValue
+        
+    # No missing keys
+    return None
+        
+
+def containsOutdatedKeys(data):
+    outdatedKeys = ["newRuns", "numberOfRuns"]
+
+    for key in outdatedKeys:
+        if key in data.get("updatedData", {}):
+            return True
+        
+    # No outdated key
+    return False
+
+
+class PayloadError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+# Decompress (gzip, zstd) and decode the /updateRun body, at most MAX_PAYLOAD_BYTES once decompressed
+def readRequestBody(body, contentEncoding):
+    contentEncoding = contentEncoding.strip().lower()
+
+    try:
+        if contentEncoding in ["", "identity"]:
+            text = body[: MAX_PAYLOAD_BYTES + 1]
+        elif contentEncoding in ["gzip", "x-gzip"]:
+            text = gzip.GzipFile(fileobj = io.BytesIO(body)).read(MAX_PAYLOAD_BYTES + 1)
+        elif contentEncoding == "zstd":
+            text = zstandard.ZstdDecompressor().stream_reader(body).read(MAX_PAYLOAD_BYTES + 1)
+        else:
+            raise PayloadError(f"Unsupported Content-Encoding {contentEncoding}", 415)
+
+        if len(text) > MAX_PAYLOAD_BYTES:
+            raise PayloadError(f"Payload larger than {MAX_PAYLOAD_BYTES} bytes", 413)
+
+        return text.decode("utf-8")
+
+    except (OSError, EOFError, zlib.error, zstandard.ZstdError, UnicodeDecodeError) as e:
+        raise PayloadError(f"Unreadable payload : {e}", 400)
+
+
+jsonDecoder = json.JSONDecoder()
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+def skipWhitespace(text, index):
+    return JSON_WHITESPACE.match(text, index).end()
+
+# Iterate on the members of the JSON object starting at text[index] without decoding them
+# readValue(key, valueIndex) returns the end of the value, or None to stop : the end of the object is returned (None if stopped)
+def scanObject(text, index, readValue):
+    index = skipWhitespace(text, index)
+    if text[index : index + 1] != "{":
+        raise json.JSONDecodeError("Expecting object", text, index)
+
+    index = skipWhitespace(text, index + 1)
+    if text[index : index + 1] == "}":
+        return index + 1
+
+    while True:
+        if text[index : index + 1] != '"':
+            raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, index)
+
+        key, index = scanstring(text, index + 1)
+        index = skipWhitespace(text, index)
+
+        if text[index : index + 1] != ":":
+            raise json.JSONDecodeError("Expecting ':' delimiter", text, index)
+
+        index = readValue(key, skipWhitespace(text, index + 1))
+        if index is None:
+            return None
+
+        index = skipWhitespace(text, index)
+
+        if text[index : index + 1] == "}":
+            return index + 1
+
+        if text[index : index + 1] != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, index)
+
+        index = skipWhitespace(text, index + 1)
+
+# fullData.runs, only decoded run by run when a run is read (new runs)
+# Runs are located on first use : each one is decoded and dropped, so the whole history is never in memory at once
+class LazyRuns(Mapping):
+    def __init__(self, text, index):
+        self.text = text
+        self.start = index
+        self.spans = None
+        self.endIndex = None
+        self.runs = {}
+
+    def index(self):
+        if self.spans is None:
+            spans = {}
+
+            def readRun(runId, index):
+                spans[runId] = index
+                return jsonDecoder.raw_decode(self.text, index)[1]
+
+            self.endIndex = scanObject(self.text, self.start, readRun)
+            self.spans = spans
+
+        return self.spans
+
+    def end(self):
+        self.index()
+        return self.endIndex
+
+    def __getitem__(self, runId):
+        if runId not in self.runs:
+            self.runs[runId] = jsonDecoder.raw_decode(self.text, self.index()[runId])[0]
+
+        return self.runs[runId]
+
+    def __iter__(self):
+        return iter(self.index())
+
+    def __len__(self):
+        return len(self.index())
+
+    # Checked by missingMandatoryKeys : no need to locate every run
+    def __bool__(self):
+        index = skipWhitespace(self.text, self.start)
+
+        if self.text[index : index + 1] != "{":
+            return bool(jsonDecoder.raw_decode(self.text, index)[0])
+
+        return self.text[skipWhitespace(self.text, index + 1) : skipWhitespace(self.text, index + 1) + 1] != "}"
+
+# Decode every member of the /updateRun payload but fullData.runs, stopping after it when the other members are known
+def parseUpdatePayload(text):
+    data = {}
+
+    def readFullData(key, index):
+        if key != "runs":
+            return jsonDecoder.raw_decode(text, index)[1]
+
+        data["fullData"]["runs"] = LazyRuns(text, index)
+
+        # Members after fullData (targets, version) are still read : the runs are only indexed, not decoded
+        return data["fullData"]["runs"].end()
+
+    def readMember(key, index):
+        if key == "fullData" and text[index : index + 1] == "{":
+            data["fullData"] = {}
+            return scanObject(text, index, readFullData)
+
+        data[key], index = jsonDecoder.raw_decode(text, index)
+        return index
+
+    # Anything but an object is decoded as is
+    if not text.lstrip(" \t\n\r").startswith("{"):
+        return json.loads(text)
+
+    end = scanObject(text, 0, readMember)
+
+    if end is not None and skipWhitespace(text, end) != len(text):
+        raise json.JSONDecodeError("Extra data", text, end)
+
+    return data
@@ -0,0 +1,175 @@
+import argparse
+import threading
+import random
+import json
+import time
+import os
+
+# Load test replaying /updateRun traffic captured with CAPTURE_PATH, against an in-process server backed by FakeSheetsService :
+#
+#   python RunAndBunReplay.py capture.jsonl                              # same pace as captured
+#   python RunAndBunReplay.py capture.jsonl --speed 10 --streamers 50    # 10x faster, each streamer copied 50 times
+#   python RunAndBunReplay.py capture.jsonl --speed 0 --latency 0.3      # as fast as possible, slow Google
+#
+# Each update is sent at its captured time (divided by --speed) and its latency is measured from that time, so updates
+# waiting for a free client thread are counted as slow instead of slowing the replay down.
+# Synthetic streamers are copies of the captured ones with their own spreadsheets and client addresses, shifted by up to --spread seconds.
+# Server settings (quotas, rate limits, queues) are read from the environment as usual, protocol version 2 updates need RUN_STORE_PATH.
+
+# Settings read by the RunAndBun modules at import : no persisted state, no capture of the replayed traffic, known password
+os.environ.setdefault("API_PASSWORD", "replay")
+os.environ["RUN_INDEX_DIRECTORY"] = ""
+os.environ["SNAPSHOT_DIRECTORY"] = ""
+os.environ["CAPTURE_PATH"] = ""
+
+from concurrent.futures import ThreadPoolExecutor
+from FakeSheetsService import FakeSheetsService
+import RunAndBunStats
+import RunAndBunUpload
+
+
+# Captured updates in arrival order, as (arrivedAt, client, async, payload)
+def readCapture(path):
+    with open(path, encoding = "utf-8") as captureFile:
+        updates = [json.loads(line) for line in captureFile if line.strip()]
+
+    updates.sort(key = lambda update: update["arrivedAt"])
+    return [(update["arrivedAt"], update["client"], update.get("async", False), update["payload"]) for update in updates]
+
+# Payload of a synthetic streamer : same runs, its own spreadsheets
+def streamerPayload(payload, streamer):
+    if not streamer:
+        return payload
+
+    payload = dict(payload)
+
+    if "keys" in payload:
+        payload["keys"] = dict(payload["keys"], spreadsheetId = f"{payload["keys"]["spreadsheetId"]}-{streamer}")
+
+    if "targets" in payload:
+        payload["targets"] = [dict(target, spreadsheetId = f"{target["spreadsheetId"]}-{streamer}") for target in payload["targets"]]
+
+    return payload
+
+# (sendAt, client, async, payload, streamer) sorted by send time, relative to the start of the replay
+def schedule(updates, options):
+    rng = random.Random(options.seed)
+    firstArrival = updates[0][0] if updates else 0
+    scheduled = []
+
+    for streamer in range(options.streamers):
+        offset = rng.uniform(0, options.spread) if streamer else 0
+
+        for arrivedAt, client, asyncMode, payload in updates:
+            sendAt = (arrivedAt - firstArrival) / options.speed + offset if options.speed else 0
+            scheduled.append((sendAt, f"{client}-{streamer}", asyncMode, payload, streamer))
+
+    scheduled.sort(key = lambda update: update[0])
+    return scheduled
+
+
+def percentile(sortedValues, share):
+    if not sortedValues:
+        return 0
+
+    return sortedValues[min(len(sortedValues) - 1, int(share * len(sortedValues)))]
+
+def replay(options):
+    updates = readCapture(options.capture)
+    scheduled = schedule(updates, options)
+
+    fakeService = FakeSheetsService(latency = options.latency, latencyJitter = options.latency_jitter, errorRate = options.error_rate,
+                                    errorMethods = ["batchUpdate"], seed = options.seed)
+    RunAndBunUpload.sheetsService = fakeService
+
+    headers = {"Authorization": f"Bearer {RunAndBunStats.API_PASSWORD}"}
+    clients = threading.local()
+    results = []
+    resultsLock = threading.Lock()
+
+    # Latency from the scheduled send time, each client thread has its own test client
+    def send(startTime, sendAt, client, asyncMode, payload, streamer):
+        if getattr(clients, "client", None) is None:
+            clients.client = RunAndBunStats.flaskApp.test_client()
+
+        response = clients.client.post("/updateRun?async=true" if asyncMode else "/updateRun", json = streamerPayload(payload, streamer),
+                                       headers = headers, environ_base = {"REMOTE_ADDR": client})
+        latency = time.perf_counter() - (startTime + sendAt)
+
+        with resultsLock:
+            results.append((response.status_code, latency))
+
+    startTime = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers = options.clients, thread_name_prefix = "replay") as executor:
+        for sendAt, client, asyncMode, payload, streamer in scheduled:
+            delay = startTime + sendAt - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            executor.submit(send, startTime, sendAt, client, asyncMode, payload, streamer)
+
+    # Async updates answered 202 : wait for their jobs before measuring the Sheets calls
+    while True:
+        with RunAndBunStats.jobsLock:
+            pendingJobs = [job for job in RunAndBunStats.jobs.values() if job.status in ["queued", "running"]]
+
+        if not pendingJobs:
+            break
+
+        time.sleep(0.05)
+
+    wallSeconds = time.perf_counter() - startTime
+    latencies = sorted(latency for status, latency in results)
+    statuses = {}
+
+    for status, latency in results:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    summary = fakeService.summary()
+
+    return {
+        "updates": len(results),
+        "streamers": options.streamers,
+        "wallSeconds": wallSeconds,
+        "throughput": len(results) / wallSeconds if wallSeconds else 0,
+        "latency": {"p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95), "p99": percentile(latencies, 0.99), "max": latencies[-1] if latencies else 0},
+        "statuses": statuses,
+        "errorRate": sum(count for status, count in statuses.items() if status >= 400) / len(results) if results else 0,
+        "sheets": {"calls": sum(methodSummary["calls"] for methodSummary in summary.values()),
+                   "requests": sum(methodSummary["requests"] for methodSummary in summary.values()),
+                   "bytes": sum(methodSummary["bytes"] for methodSummary in summary.values()),
+                   "errors": sum(methodSummary["errors"] for methodSummary in summary.values())}
+    }
+
+def printReport(report):
+    latency = report["latency"]
+    sheets = report["sheets"]
+
+    print(f"Updates      {report["updates"]} ({report["streamers"]} streamer copies) in {report["wallSeconds"]:.1f}s, {report["throughput"]:.2f} updates/s")
+    print(f"Latency (ms) p50 {latency["p50"] * 1000:.0f}, p95 {latency["p95"] * 1000:.0f}, p99 {latency["p99"] * 1000:.0f}, max {latency["max"] * 1000:.0f}")
+    print(f"Statuses     {", ".join(f"{status} : {count}" for status, count in sorted(report["statuses"].items()))}, error rate {report["errorRate"]:.1%}")
+    print(f"Sheets API   {sheets["calls"]} calls, {sheets["requests"]} requests, {sheets["bytes"]} bytes, {sheets["errors"]} errors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Replay captured /updateRun traffic against a local RunAndBunStats with a simulated Google Sheets")
+    parser.add_argument("capture", help = "JSONL file written with CAPTURE_PATH")
+    parser.add_argument("--speed", type = float, default = 1, help = "Replay speed factor (2 = twice as fast, 0 = no wait between updates)")
+    parser.add_argument("--streamers", type = int, default = 1, help = "Copies of each captured streamer, with their own spreadsheets")
+    parser.add_argument("--spread", type = float, default = 60, help = "Max start shift of a streamer copy, in seconds")
+    parser.add_argument("--clients", type = int, default = 64, help = "Concurrent client connections")
+    parser.add_argument("--latency", type = float, default = 0.2, help = "Simulated seconds per API call")
+    parser.add_argument("--latency-jitter", type = float, default = 0.1, help = "Random extra seconds per API call")
+    parser.add_argument("--error-rate", type = float, default = 0, help = "Share of batchUpdate calls answered with a 429")
+    parser.add_argument("--seed", type = int, default = 0, help = "Streamer shifts and simulated errors seed")
+    parser.add_argument("--json", action = "store_true", help = "Print the report as JSON")
+    options = parser.parse_args()
+
+    report = replay(options)
+
+    if options.json:
+        print(json.dumps(report, indent = 2))
+    else:
+        printReport(report)
@@ -1,523 +1,1375 @@
-from google.auth import default
-from googleapiclient.discovery import build
-from flask import Flask, request, jsonify
+from googleapiclient.errors import HttpError
+from flask import Flask, request, jsonify, g
 import traceback
+import threading
+import sys
+import json
+import time
+import re
 import os
-
-ZONES = ["Starter", "Littleroot Town", "Route 101", "Oldale Town", "Route 103", "Route 102", "Petalburg City", "Route 104", "Dewford Town", "Route 107", "Route 106", "Granite Cave", "Route 109", "Slateport City", "Route 110", "Petalburg Woods", "Rustboro City", "Route 115", "Route 116", "Rusturf Tunnel", "Verdanturf Town", "Route 117", "Mauville City", "Route 111", "Route 118", "Altering Cave", "Mirage Tower", "Route 113", "Fallarbor Town", "Desert Underpass", "Route 114", "Meteor Falls", "Route 112", "Fiery Path", "Mt. Chimney", "Jagged Pass", "Lavaridge Town", "Route 134", "New Mauville", "Route 105", "Route 108", "Abandoned Ship", "Route 119", "Fortree City", "Route 120", "Scorched Slab", "Route 121", "Safari Zone", "Lilycove City", "Route 122", "Route 123", "Mt. Pyre", "Magma Hideout", "Aqua Hideout", "Route 124", "Mossdeep City", "Route 125", "Shoal Cave", "Route 127", "Route 124 Underwater", "Route 126", "Route 126 Underwater", "Sootopolis City", "Route 128", "Route 129", "Ever Grande City", "Seafloor Cavern", "Cave of Origin", "Route 130", "Route 131", "Pacifidlog Town", "Route 132", "Route 133", "Sky Pillar", "Victory Road"]
-BADGES = ["Knuckle Badge", "Stone Badge", "Dynamo Badge", "Balance Badge", "Heat Badge", "Feather Badge", "Mind Badge", "Rain Badge"]
-STATS_NAMES = {
-    "EN": ["HP", "Attack", "Defense", "Sp. Atk", "Sp. Def", "Speed"],
-    "FR": ["PV", "Attaque", "Défense", "Atq. Spé", "Def. Spé", "Vitesse"]
-}
-
-NATURE_DICO_FR = {
-    "Adamant": "Rigide",
-    "Bashful": "Pudique",
-    "Bold": "Assuré",
-    "Brave": "Brave",
-    "Calm": "Calme",
-    "Careful": "Prudent",
-    "Docile": "Docile",
-    "Gentle": "Gentil",
-    "Hardy": "Hardi",
-    "Hasty": "Pressé",
-    "Impish": "Malin",
-    "Jolly": "Jovial",
-    "Lax": "Lâche",
-    "Lonely": "Solo",
-    "Mild": "Doux",
-    "Modest": "Modeste",
-    "Naive": "Naïf",
-    "Naughty": "Mauvais",
-    "Quiet": "Discret",
-    "Quirky": "Bizarre",
-    "Rash": "Foufou",
-    "Relaxed": "Relax",
-    "Sassy": "Malpoli",
-    "Serious": "Sérieux",
-    "Timid": "Timide"
-}
-
-NATURE_DICO = {
-    "Hardy": [None, None],
-    "Lonely": [1, 2],
-    "Brave": [1, 5],
-    "Adamant": [1, 3],
-    "Naughty": [1, 4],
-	"Bold": [2, 1],
-    "Docile": [None, None],
-    "Relaxed": [2, 5],
-    "Impish": [2, 3],
-    "Lax": [2, 4],
-	"Timid": [5, 1],
-    "Hasty": [5, 2],
-    "Serious": [None, None],
-    "Jolly": [5, 3],
-    "Naive": [5, 4],
-	"Modest": [3, 1],
-    "Mild": [3, 2],
-    "Quiet": [3, 5],
-    "Bashful": [None, None],
-    "Rash": [3, 4],
-	"Calm": [4, 1],
-    "Gentle": [4, 2],
-    "Sassy": [4, 5],
-    "Careful": [4, 3],
-    "Quirky": [None, None]
-}
-
-# Setup NATURE_DICO with french Nature values
-for english, french in NATURE_DICO_FR.items():
-    NATURE_DICO[french] = NATURE_DICO[english]
+import copy
+import uuid
+import hashlib
+import zlib
+import math
+import queue
+from collections import deque, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from RunAndBunLayout import (ZONES, ZONE_INDEX, BADGES, NATURE_DICO, NATURE_NAMES_EN, RUN_CARD_HEIGHT, RUN_CARD_WIDTH, NEW_RUN_FIELDS,
+                             PERSONAL_BEST_FIELDS, POKEMON_FIELDS, insertRows, deleteRows, copyRange, addSheet, updateCardColumnSizes,
+                             generateRunCard, runCardOverlay, updateRunCard, updateRunTitles, generateRunCardFromTemplate, generatePokemonCard,
+                             generatePokemonCards, pokemonCardOverlay, pokemonCardsOverlay, updatePokemonCard, updatedPokemonCardOverlay)
+from RunAndBunCompaction import compactRequests
+from RunAndBunMetrics import metrics
+from RunAndBunPayload import PayloadError, missingMandatoryKeys, containsOutdatedKeys, readRequestBody, parseUpdatePayload
+from RunAndBunStorage import RunSnapshots, RunStore, StoredRuns, UpdateJournal, safeFileName
+from RunAndBunUpload import UPLOAD_MAX_BACKOFF, getSheetsService, executeSheetsCall, TokenBucket, UploadError, SheetsUploader
 
 API_PASSWORD = os.getenv("API_PASSWORD", "")
-UPLOAD_BATCH_SIZE = 200
-
-# Colors in API are 0..1 floats
-COLOR_WHITE = {"red": 1, "green": 1, "blue": 1}
-COLOR_BLACK = {"red": 0, "green": 0, "blue": 0}
-COLOR_GREY = {"red": 0.4, "green": 0.4, "blue": 0.4}
-COLOR_LIGHTGREY = {"red": 0.95, "green": 0.95, "blue": 0.95}
-COLOR_CYAN = {"red": 0, "green": 1, "blue": 1}
-COLOR_RED = {"red": 1, "green": 0, "blue": 0}
-COLOR_LIGHTRED = {"red": 1, "green": 0.5, "blue": 0.5}
-
-credentials, project = default(scopes = ['https://www.googleapis.com/auth/spreadsheets'])
-sheetsService = build('sheets', 'v4', credentials = credentials)
-flaskApp = Flask(__name__)
 
-MERGE = 1
-BOLD = 2
-CENTER = 3
-FONT_CYAN = 4
-FONT_RED = 5
-FONT_LIGHTRED = 6
-FONT_WHITE = 7
-BACKGROUND_GREY = 8
-BACKGROUND_LIGHTGREY = 9
-BACKGROUND_BLACK = 10
-FORMULA = 11
-
-def missingMandatoryKeys(data):
-    mandatoryKeys = {
-        "keys.spreadsheetId": data.get("keys", {}).get("spreadsheetId"),
-        "keys.sheetId": data.get("keys", {}).get("sheetId"),
-        "updatedData.runs": data.get("updatedData", {}).get("runs"),
-        "fullData.runs": data.get("fullData", {}).get("runs"),
-        "lang": data.get("lang")
-    }
-
-    for keyName, keyValue in mandatoryKeys.items():
-        if (not keyValue):
-            print(f"❌ Missing parameter {keyName}")
-            return keyValue
-        
-    # No missing keys
-    return None
-        
+# Fold small cell writes into grid-shaped requests before uploading (writes up to COMPACT_MAX_CELLS cells)
+COMPACT_REQUESTS = os.getenv("COMPACT_REQUESTS", "1") == "1"
+
+# Run index persistence (empty directory : memory only) and max age in seconds before the updated run cards are checked for moves
+# Set RUN_INDEX_MAX_AGE to 0 to never check them : only safe when this server is the only writer of its spreadsheets
+RUN_INDEX_DIRECTORY = os.getenv("RUN_INDEX_DIRECTORY", "")
+RUN_INDEX_MAX_AGE = int(os.getenv("RUN_INDEX_MAX_AGE", 300))
+
+# An update failing midway is resumed from its first unacknowledged chunk by the next update, or given up after JOURNAL_MAX_ATTEMPTS failures
+JOURNAL_MAX_ATTEMPTS = int(os.getenv("JOURNAL_MAX_ATTEMPTS", 3))
+
+# Sprite cells : "formula" writes VLOOKUP formulas on the Sprites sheet, "resolved" writes the Sprites cell itself (read every SPRITE_CACHE_TTL seconds)
+SPRITE_MODE = os.getenv("SPRITE_MODE", "formula")
+SPRITE_CACHE_TTL = int(os.getenv("SPRITE_CACHE_TTL", 3600))
+SPRITE_MISS_REFRESH = 60
+
+# SQLite database keeping every run sent by the clients, needed by protocol version 2 (empty path : disabled)
+RUN_STORE_PATH = os.getenv("RUN_STORE_PATH", "")
+
+# Copy new run cards from a hidden template sheet instead of building their layout request by request
+RUN_TEMPLATES = os.getenv("RUN_TEMPLATES", "0") == "1"
+TEMPLATE_SHEET_TITLE = "RunAndBunTemplate"
+
+# Move the oldest run cards of the live sheet into archive sheets (ARCHIVE_SHEET_RUNS cards each), at least ARCHIVE_BATCH_RUNS at a time
+# once the live sheet holds more than ARCHIVE_MAX_RUNS cards or ARCHIVE_MAX_CELLS cells (0 : no limit, both 0 : disabled)
+ARCHIVE_MAX_RUNS = int(os.getenv("ARCHIVE_MAX_RUNS", 0))
+ARCHIVE_MAX_CELLS = int(os.getenv("ARCHIVE_MAX_CELLS", 0))
+ARCHIVE_BATCH_RUNS = int(os.getenv("ARCHIVE_BATCH_RUNS", 20))
+ARCHIVE_SHEET_RUNS = int(os.getenv("ARCHIVE_SHEET_RUNS", 200))
+ARCHIVE_SHEET_TITLE = "RunAndBunArchive"
+ARCHIVE_SHEET_ID_BASE = 2_000_000_000
+
+# Worker pool uploading to different spreadsheets in parallel, and max updates waiting per spreadsheet
+DISPATCH_POOL_SIZE = int(os.getenv("DISPATCH_POOL_SIZE", 8))
+DISPATCH_MAX_QUEUE_DEPTH = int(os.getenv("DISPATCH_MAX_QUEUE_DEPTH", 10))
+DISPATCH_RETRY_AFTER = 5
+
+# Max updates waiting or running across all spreadsheets, beyond which new updates are refused with a 429
+DISPATCH_MAX_PENDING = int(os.getenv("DISPATCH_MAX_PENDING", 100))
+
+# Updates accepted per minute from each client address and for each spreadsheet (0 : unlimited), refused with a 429 beyond
+CLIENT_UPDATES_PER_MINUTE = int(os.getenv("CLIENT_UPDATES_PER_MINUTE", 120))
+SPREADSHEET_UPDATES_PER_MINUTE = int(os.getenv("SPREADSHEET_UPDATES_PER_MINUTE", 60))
+RATE_LIMIT_MAX_KEYS = 10000
+
+# Proxies in front of the server appending to X-Forwarded-For (Cloud Run : 1), the client address is the one seen by the outermost (0 : socket peer)
+CLIENT_PROXY_HOPS = int(os.getenv("CLIENT_PROXY_HOPS", 0))
+
+# Finished update jobs kept for /jobs/<jobId>
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", 1000))
+
+# Updates remembered for Idempotency-Key headers and exact retries, and for how long in seconds
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 3600))
+
+# Opt-in capture of /updateRun bodies for RunAndBunReplay.py (empty path : disabled), stopped once the file reaches CAPTURE_MAX_BYTES
+# Spreadsheet ids and client addresses are replaced by salted hashes (random salt per process unless CAPTURE_SALT is set)
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", 1_000_000_000))
+CAPTURE_SALT = os.getenv("CAPTURE_SALT") or uuid.uuid4().hex
+CAPTURE_QUEUE_SIZE = 1000
+
+# Sampling profiler of /updateRun calls : profiles kept when slower than PROFILE_SLOW_MS, for 1 call in PROFILE_ONE_IN, or with an "X-Profile: true" header (0 : off)
+# Stacks sampled every PROFILE_INTERVAL_MS, written in folded format to PROFILE_DIRECTORY where only the last PROFILE_MAX_DUMPS profiles are kept
+PROFILE_SLOW_MS = int(os.getenv("PROFILE_SLOW_MS", 0))
+PROFILE_ONE_IN = int(os.getenv("PROFILE_ONE_IN", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIRECTORY = os.getenv("PROFILE_DIRECTORY", "profiles")
+PROFILE_MAX_DUMPS = int(os.getenv("PROFILE_MAX_DUMPS", 50))
 
-def containsOutdatedKeys(data):
-    outdatedKeys = ["newRuns", "numberOfRuns"]
 
-    for key in outdatedKeys:
-        if key in data.get("updatedData", {}):
-            return True
-        
-    # No outdated key
-    return False
-    
+flaskApp = Flask(__name__)
 
-def mergeCells(requests, range):
-    requests.append({"mergeCells": {"range": range, "mergeType": "MERGE_ALL"}})
 
-def unmergeCells(requests, range):
-    requests.append({"unmergeCells": {"range": range}})
+uploader = SheetsUploader()
 
-def setCellContent(requests, range, cellContent, options = []):
-    userEnteredFormat = {"textFormat": {}}
-    fields = "userEnteredValue,userEnteredFormat(textFormat"
-    userEnteredValue = {}
 
-    if MERGE in options:
-        mergeCells(requests, range)
+# Update refused before doing any work : the client should come back after retryAfter seconds
+class RateLimitError(Exception):
+    def __init__(self, message, retryAfter = DISPATCH_RETRY_AFTER):
+        super().__init__(message)
+        self.retryAfter = retryAfter
 
-    if BOLD in options:
-        userEnteredFormat["textFormat"]["bold"] = True
+class QueueFullError(RateLimitError):
+    pass
 
-    if FONT_CYAN in options:
-        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_CYAN
 
-    elif FONT_RED in options:
-        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_RED
+# Inbound update budget per key (client address or spreadsheet), the least recently seen keys are forgotten beyond RATE_LIMIT_MAX_KEYS
+class RateLimiter:
+    def __init__(self, name, ratePerMinute):
+        self.name = name
+        self.ratePerMinute = ratePerMinute
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
 
-    elif FONT_LIGHTRED in options:
-        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_LIGHTRED
+    # Take one update from the key budget, raise RateLimitError when it is spent
+    def check(self, key):
+        if not self.ratePerMinute:
+            return
 
-    elif FONT_WHITE in options:
-        userEnteredFormat["textFormat"]["foregroundColor"] = COLOR_WHITE
+        with self.lock:
+            bucket = self.buckets.pop(key, None) or TokenBucket(self.ratePerMinute)
+            self.buckets[key] = bucket
 
-    if CENTER in options:
-        userEnteredFormat["horizontalAlignment"] = "CENTER"
-        fields += ",horizontalAlignment"
+            if len(self.buckets) > RATE_LIMIT_MAX_KEYS:
+                self.buckets.popitem(last = False)
 
-    if BACKGROUND_GREY in options:
-        userEnteredFormat["backgroundColor"] = COLOR_GREY
-        fields += ",backgroundColor"
+        wait = bucket.tryAcquire()
 
-    elif BACKGROUND_BLACK in options:
-        userEnteredFormat["backgroundColor"] = COLOR_BLACK
-        fields += ",backgroundColor"
+        if wait:
+            metrics.increment("runandbun_updates_rejected_total", {"reason": self.name})
+            raise RateLimitError(f"Too many updates for {self.name} {key} (max {self.ratePerMinute} per minute)", wait)
 
-    elif BACKGROUND_LIGHTGREY in options:
-        userEnteredFormat["backgroundColor"] = COLOR_LIGHTGREY
-        fields += ",backgroundColor"
 
-    if FORMULA in options:
-        userEnteredValue["formulaValue"] = cellContent
-    else:
-        userEnteredValue["stringValue"] = cellContent
+clientLimiter = RateLimiter("client", CLIENT_UPDATES_PER_MINUTE)
+spreadsheetLimiter = RateLimiter("spreadsheet", SPREADSHEET_UPDATES_PER_MINUTE)
 
-    requests.append({
-        "repeatCell": {
-            "range": range,
-            "cell": {
-                "userEnteredValue": userEnteredValue,
-                "userEnteredFormat": userEnteredFormat
-            },
-            "fields": fields + ")"
-        }
-    })
-
-def setCellBoldSplitContent(requests, range, boldString, regularString):
-    requests.append({
-        "updateCells": {
-            "range": range,
-            "rows": [
-                {
-                    "values": [
-                        {
-                            "userEnteredValue": {"stringValue": f"{boldString} {regularString}"},
-                            "textFormatRuns": [
-                                {"startIndex": 0, "format": {"bold": True}},
-                                {"startIndex": len(boldString), "format": {"bold": False}}
-                            ]
-                        }
-                    ]
-                }
-            ],
-            "fields": "userEnteredValue,textFormatRuns"
-        }
-    })
-
-def emptyCell(requests, range):
-    requests.append({
-        "repeatCell": {
-            "range": range,
-            "cell": { "userEnteredValue": None },
-            "fields": "userEnteredValue"
-        }
-    })
-
-def clearFormatting(requests, range):
-    requests.append({
-        "repeatCell": {
-            "range": range,
-            "cell": {"userEnteredFormat": {}},
-            "fields": "userEnteredFormat"
-        }
-    })
-
-def updateColumnSize(requests, sheetId, columnSize, columnId, columnNumbers = 1):
-    requests.append({
-        "updateDimensionProperties": {
-            "range": {"sheetId": sheetId, "dimension": "COLUMNS", "startIndex": columnId, "endIndex": columnId + columnNumbers},
-            "properties": {"pixelSize": columnSize},
-            "fields": "pixelSize"
-        }
-    })
-
-def addBorders(requests, range):
-    requests.append({
-        "updateBorders": {
-            "range": range,
-            "top": {"style": "SOLID", "width": 1, "color": COLOR_BLACK},
-            "bottom": {"style": "SOLID", "width": 1, "color": COLOR_BLACK},
-            "left": {"style": "SOLID", "width": 1, "color": COLOR_BLACK},
-            "right": {"style": "SOLID", "width": 1,"color": COLOR_BLACK},
-        }
-    })
-
-def insertRows(requests, sheetId, numberOfRows):
-    requests.append({
-        "insertDimension": {
-            "range": {
-                "sheetId": sheetId,
-                "dimension": "ROWS",
-                "startIndex": 0,
-                "endIndex": numberOfRows
-            }
-        }
-    })
+# Client of an update : the address seen by the outermost trusted proxy, earlier X-Forwarded-For entries are set by the client itself
+def clientAddress(request):
+    forwardedFor = [address.strip() for address in request.headers.get("X-Forwarded-For", "").split(",") if address.strip()]
 
+    if CLIENT_PROXY_HOPS and forwardedFor:
+        return forwardedFor[-min(CLIENT_PROXY_HOPS, len(forwardedFor))]
 
-def generateRunCard(requests, sheetId, runId, runData, lang):
-    startRow = 0
+    return request.remote_addr
+
+def retryAfterHeader(e):
+    return {"Retry-After": str(max(1, math.ceil(e.retryAfter)))}
 
-    # Helper to convert a relative inside-run row/col to absolute indices
-    def abs_range(rel_row_start, rel_row_end, rel_col_start, rel_col_end):
-        return {
-            "sheetId": sheetId,
-            "startRowIndex": startRow + rel_row_start,
-            "endRowIndex": startRow + rel_row_end,
-            "startColumnIndex": rel_col_start,
-            "endColumnIndex": rel_col_end
-        }
-    
-    # Insert 18 rows and clear formatting to make place for the new run
-    insertRows(requests, sheetId, 18)
-    clearFormatting(requests, abs_range(1, 18, 0, 500))
-    
-    # Update column sizes
-    updateColumnSize(requests, sheetId, 21, 0)
-    updateColumnSize(requests, sheetId, 55, 1, 8)
-    updateColumnSize(requests, sheetId, 21, 9)
 
-    # Left/right white separator, merge all cells vertically 
-    setCellContent(requests, abs_range(2, 17, 0, 1), "", options = [MERGE, BACKGROUND_LIGHTGREY])
-    setCellContent(requests, abs_range(2, 17, 9, 10), "", options = [MERGE, BACKGROUND_LIGHTGREY])
-    
-    # Top grey line, merge all cells horizontally
-    setCellContent(requests, abs_range(0, 1, 0, 500), "", options = [MERGE, BACKGROUND_GREY])
+# Run jobs of different spreadsheets in parallel on a worker pool, and jobs of the same spreadsheet strictly in order
+# A lane holds the running job of a spreadsheet followed by its queued jobs, and only exists while it is not empty
+class SpreadsheetDispatcher:
+    def __init__(self, poolSize, maxQueueDepth, maxPending):
+        self.executor = ThreadPoolExecutor(max_workers = poolSize, thread_name_prefix = "dispatcher")
+        self.maxQueueDepth = maxQueueDepth
+        self.maxPending = maxPending
+        self.pending = 0
+        self.lanes = {}
+        self.lock = threading.Lock()
 
-    # Top white line, merge all cells horizontally
-    setCellContent(requests, abs_range(1, 2, 0, 500), "", options = [MERGE, BACKGROUND_LIGHTGREY])
+    def submit(self, spreadsheetId, function, *args):
+        future = Future()
 
-    # Run number
-    setCellContent(requests, abs_range(2, 3, 1, 9), 
-                   '=IFERROR("Run #" & (1 + VALUE(REGEXEXTRACT(INDIRECT("B" & ROW() + 18), "\\d+"))), "Run #1")',
-                   options = [MERGE, BOLD, CENTER, FONT_CYAN, BACKGROUND_GREY, FORMULA])
+        with self.lock:
+            if len(self.lanes.get(spreadsheetId, [])) >= self.maxQueueDepth:
+                metrics.increment("runandbun_updates_rejected_total", {"reason": "queue"})
+                raise QueueFullError(f"Too many pending updates for spreadsheet {spreadsheetId}")
 
-    # Run start date
-    setCellContent(requests, abs_range(3, 4, 1, 5), "Début de la run" if lang == "FR" else "Run start", options = [MERGE, BOLD, CENTER])
-    setCellContent(requests, abs_range(3, 4, 5, 9), runData["runStart"], options = [MERGE, CENTER])
+            # Whole server busy : shed the update instead of queueing work that could not finish in time
+            if self.pending >= self.maxPending:
+                metrics.increment("runandbun_updates_rejected_total", {"reason": "overload"})
+                raise QueueFullError(f"Server busy : {self.pending} updates pending")
 
-    # Run end date
-    setCellContent(requests, abs_range(4, 5, 1, 5), "Fin de la run" if lang == "FR" else "Run end", options = [MERGE, BOLD, CENTER])
-    setCellContent(requests, abs_range(4, 5, 5, 9), runData["runEnd"], options = [MERGE, CENTER])
+            lane = self.lanes.setdefault(spreadsheetId, deque())
+            lane.append((future, function, args))
+            self.pending += 1
 
-    # Run end date
-    setCellContent(requests, abs_range(5, 6, 1, 5), "Combats gagnés" if lang == "FR" else "Won battles", options = [MERGE, BOLD, CENTER])
-    setCellContent(requests, abs_range(5, 6, 5, 9), runData["wonBattles"], options = [MERGE, CENTER])
+            # Idle lane : start it
+            if len(lane) == 1:
+                self.executor.submit(self.runNext, spreadsheetId)
 
-    # Dead Pokémon
-    setCellContent(requests, abs_range(6, 7, 1, 5), "Pokémons morts" if lang == "FR" else "Dead Pokémon", options = [MERGE, BOLD, CENTER])
-    setCellContent(requests, abs_range(6, 7, 5, 9), runData["deadPokemon"], options = [MERGE, CENTER])
+        return future
 
-    # White separator, merge all cells horizontally, hide runId in white font
-    setCellContent(requests, abs_range(7, 8, 1, 9), f"RundId : {runId}", options = [MERGE, CENTER, FONT_WHITE])
+    # Run the first job of a lane, then give the worker back to the pool so other spreadsheets get their turn
+    def runNext(self, spreadsheetId):
+        with self.lock:
+            future, function, args = self.lanes[spreadsheetId][0]
 
-    # Gym Badges label
-    setCellContent(requests, abs_range(8, 9, 1, 9), "Badges" if lang == "FR" else "Gym Badges", options = [MERGE, BOLD, CENTER])
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(function(*args))
 
-    # Gym Badges sprites
-    for i in range(8):
-        setCellContent(requests, abs_range(9, 11, i + 1, i + 2), 
-                       f'=VLOOKUP("{BADGES[i]}",Sprites!$A:$B,2,FALSE)' if i < runData["gymBadges"] else "",
-                       options = [MERGE, CENTER, FORMULA if i < runData["gymBadges"] else None])
+            except BaseException as e:
+                future.set_exception(e)
 
-    # White separator, merge all cells horizontally 
-    mergeCells(requests, abs_range(11, 12, 1, 9))
+        with self.lock:
+            lane = self.lanes[spreadsheetId]
+            lane.popleft()
+            self.pending -= 1
 
-    # Personal Best Trainer Name
-    setCellContent(requests, abs_range(12, 13, 1, 9), "", options = [MERGE, CENTER])
-    setCellBoldSplitContent(requests, abs_range(12, 13, 1, 9), "Personal Best : ", runData["personalBest"]["trainerName"])
+            if lane:
+                self.executor.submit(self.runNext, spreadsheetId)
+            else:
+                del self.lanes[spreadsheetId]
+
+    def queueDepth(self, spreadsheetId):
+        with self.lock:
+            return len(self.lanes.get(spreadsheetId, []))
 
-    # Merge trainer team separators
-    for row in [1,4,8]:
-        mergeCells(requests, abs_range(13, 17, row, row + 1))
 
-    # Personal Best Trainer Sprite
-    setCellContent(requests, abs_range(13, 17, 2, 4), f'=VLOOKUP("{runData["personalBest"]["trainerSprite"]}",Sprites!$A:$B,2,FALSE)', options = [MERGE, CENTER, FORMULA])
+dispatcher = SpreadsheetDispatcher(DISPATCH_POOL_SIZE, DISPATCH_MAX_QUEUE_DEPTH, DISPATCH_MAX_PENDING)
 
-    # Personal Best Trainer Team Sprite top
-    for i in range(3):
-        setCellContent(requests, abs_range(13, 15, 5 + i, 6 + i), 
-                    f'=VLOOKUP({runData["personalBest"]["trainerTeam"][i]},Sprites!$A:$B,2,FALSE)' if i < len(runData["personalBest"]["trainerTeam"]) else "",
-                    options = [MERGE, CENTER, FORMULA if i < len(runData["personalBest"]["trainerTeam"]) else None])
 
-    # Personal Best Trainer Team Sprite bottom
-    for i in range(3):
-        setCellContent(requests, abs_range(15, 17, 5 + i, 6 + i), 
-                    f'=VLOOKUP({runData["personalBest"]["trainerTeam"][i + 3]},Sprites!$A:$B,2,FALSE)' if i + 3 < len(runData["personalBest"]["trainerTeam"]) else "",
-                    options = [MERGE, CENTER, FORMULA if i + 3 < len(runData["personalBest"]["trainerTeam"]) else None])
+# An update processed on the dispatcher, kept after completion so clients can poll its status
+class UpdateJob:
+    def __init__(self, spreadsheetId):
+        self.jobId = uuid.uuid4().hex
+        self.spreadsheetId = spreadsheetId
+        self.status = "queued"
+        self.createdAt = time.time()
+        self.startedAt = None
+        self.finishedAt = None
+        self.result = None
+        self.error = None
 
-    # Bottom white line, merge all cells horizontally
-    setCellContent(requests, abs_range(17, 18, 0, 500), "", options = [MERGE, BACKGROUND_LIGHTGREY])
+    def run(self, function, *args):
+        self.start()
+        metrics.observe("runandbun_phase_seconds", self.startedAt - self.createdAt, {"phase": "queue"})
 
-    # Bottom grey line, merge all cells horizontally
-    setCellContent(requests, abs_range(18, 19, 0, 500), "", options = [MERGE, BACKGROUND_GREY])
+        try:
+            return self.finish(function(*args))
 
-    # Add borders
-    addBorders(requests, abs_range(2,17,1,9))
+        except Exception as e:
+            self.fail(e)
+            raise
 
+    # Lifecycle steps, also followed by the update tasks of the asyncio serving mode
+    def start(self):
+        self.status = "running"
+        self.startedAt = time.time()
 
+    def finish(self, result):
+        self.result = result
+        self.status = "done"
+        self.finishedAt = time.time()
+        return result
 
-def updateRunCard(requests, sheetId, runCardId, runData):
-    startRow = 18 * runCardId
+    def fail(self, e):
+        print(f"❌ Job {self.jobId} failed : {e}")
+        self.error = {"message": str(e), "status": e.status if isinstance(e, (UploadError, PayloadError)) else 500}
+        self.status = "failed"
+        self.finishedAt = time.time()
 
-    # Helper to convert a relative inside-run row/col to absolute indices
-    def abs_range(rel_row_start, rel_row_end, rel_col_start, rel_col_end):
+    def describe(self):
         return {
-            "sheetId": sheetId,
-            "startRowIndex": startRow + rel_row_start,
-            "endRowIndex": startRow + rel_row_end,
-            "startColumnIndex": rel_col_start,
-            "endColumnIndex": rel_col_end
+            "jobId": self.jobId,
+            "spreadsheetId": self.spreadsheetId,
+            "status": self.status,
+            "createdAt": self.createdAt,
+            "startedAt": self.startedAt,
+            "finishedAt": self.finishedAt,
+            "queuedSeconds": (self.startedAt or time.time()) - self.createdAt,
+            "runningSeconds": (self.finishedAt or time.time()) - self.startedAt if self.startedAt else None,
+            "result": self.result,
+            "error": self.error
         }
 
-    # Run start date
-    if "runStart" in runData: setCellContent(requests, abs_range(3, 4, 5, 9), runData["runStart"], options = [CENTER])
 
-    # Run end date
-    if "runEnd" in runData: setCellContent(requests, abs_range(4, 5, 5, 9), runData["runEnd"], options = [CENTER])
+# Last JOB_HISTORY_SIZE jobs, oldest evicted first
+jobs = OrderedDict()
+jobsLock = threading.Lock()
 
-    # Run end date
-    if "wonBattles" in runData: setCellContent(requests, abs_range(5, 6, 5, 9), runData["wonBattles"], options = [CENTER])
+def registerJob(job):
+    with jobsLock:
+        jobs[job.jobId] = job
 
-    # Dead Pokémon
-    if "deadPokemon" in runData: setCellContent(requests, abs_range(6, 7, 5, 9), runData["deadPokemon"], options = [CENTER])
+        while len(jobs) > JOB_HISTORY_SIZE:
+            jobs.popitem(last = False)
 
-    # Gym Badges sprites
-    for col in range(runData["gymBadges"] if "gymBadges" in runData else 0):
-        setCellContent(requests, abs_range(9, 11, col + 1, col + 2), f'=VLOOKUP("{BADGES[col]}",Sprites!$A:$B,2,FALSE)', options = [CENTER, FORMULA])
 
-    # Personal Best
-    if "personalBest" in runData:
+class IdempotencyError(Exception):
+    pass
 
-        # Personal Best Trainer Name
-        setCellBoldSplitContent(requests, abs_range(12, 13, 1, 9), "Personal Best : ", runData["personalBest"]["trainerName"])
 
-        # Personal Best Trainer Sprite
-        setCellContent(requests, abs_range(13, 17, 2, 4), f'=VLOOKUP("{runData["personalBest"]["trainerSprite"]}",Sprites!$A:$B,2,FALSE)', options = [CENTER, FORMULA])
+# Updates already submitted, so a client retry is answered by the first attempt instead of being processed twice
+# An update is found by its Idempotency-Key header, else each run is compared with the last update of the same run :
+# runs sent again unchanged are skipped, the update is answered by the earlier one when none of its runs changed
+# (an older state of a run is not reused : the updates sent since may have changed the same cells)
+# Entries hold the future of the update and its job, failed updates are never reused
+class UpdateDeduplicator:
+    def __init__(self, maxSize, ttl):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
 
-        # Personal Best Trainer Team Sprite top
-        for i in range(3):
-            setCellContent(requests, abs_range(13, 15, 5 + i, 6 + i), 
-                        f'=VLOOKUP({runData["personalBest"]["trainerTeam"][i]},Sprites!$A:$B,2,FALSE)' if i < len(runData["personalBest"]["trainerTeam"]) else "",
-                        options = [CENTER, FORMULA if i < len(runData["personalBest"]["trainerTeam"]) else None])
+    # Return (future, job, replayed), start(runIds) being only called with the runs no earlier update can answer
+    def submit(self, spreadsheetId, idempotencyKey, payloadHash, runHashes, start):
+        with self.lock:
+            if idempotencyKey:
+                entry = self.find(("key", spreadsheetId, idempotencyKey))
 
-        # Personal Best Trainer Team Sprite bottom
-        for i in range(3):
-            setCellContent(requests, abs_range(15, 17, 5 + i, 6 + i), 
-                        f'=VLOOKUP({runData["personalBest"]["trainerTeam"][i + 3]},Sprites!$A:$B,2,FALSE)' if i + 3 < len(runData["personalBest"]["trainerTeam"]) else "",
-                        options = [CENTER, FORMULA if i + 3 < len(runData["personalBest"]["trainerTeam"]) else None])
+                if entry and entry["payloadHash"] != payloadHash:
+                    raise IdempotencyError(f"Idempotency-Key {idempotencyKey} was already used with a different payload")
 
+                if entry:
+                    metrics.increment("runandbun_updates_deduplicated_total", {"reason": "key"})
+                    return entry["future"], entry["job"], True
 
+            runEntries = {runId: self.find(("run", spreadsheetId, runId)) for runId in runHashes}
+            changedRunIds = [runId for runId, runHash in runHashes.items() if runEntries[runId] is None or runEntries[runId]["runHash"] != runHash]
 
-def generatePokemonCard(requests, sheetId, pokemon, zone, runCardId, pokemonCardId, lang):
-    startRow = 18 * runCardId + 2
-    startColumn = 10 + 5 * pokemonCardId
+            # Every run already sent as is : answered by the last update that sent one of them
+            if runHashes and not changedRunIds:
+                entry = max(runEntries.values(), key = lambda runEntry: runEntry["createdAt"])
+                future, job, replayed = entry["future"], entry["job"], True
+                metrics.increment("runandbun_updates_deduplicated_total", {"reason": "runs"})
 
-    # Helper to convert a relative inside-run row/col to absolute indices
-    def abs_range(rel_row_start, rel_row_end, rel_col_start, rel_col_end):
-        return {
-            "sheetId": sheetId,
-            "startRowIndex": startRow + rel_row_start,
-            "endRowIndex": startRow + rel_row_end,
-            "startColumnIndex": startColumn + rel_col_start,
-            "endColumnIndex": startColumn + rel_col_end
-        }
-    
-    # Update column sizes
-    updateColumnSize(requests, sheetId, 75, startColumn)
-    updateColumnSize(requests, sheetId, 21, startColumn + 1)
-    updateColumnSize(requests, sheetId, 75, startColumn + 2)
-    updateColumnSize(requests, sheetId, 21, startColumn + 3, 2)
+            else:
+                future, job = start(changedRunIds)
+                replayed = False
+                metrics.increment("runandbun_runs_deduplicated_total", {}, len(runHashes) - len(changedRunIds))
 
-    # Add borders
-    addBorders(requests, abs_range(0, 15, 0, 4))
+                for runId in changedRunIds:
+                    self.put(("run", spreadsheetId, runId), {"runHash": runHashes[runId], "future": future, "job": job, "createdAt": time.time()})
 
-    # Right white separator, merge all cells vertically 
-    setCellContent(requests, abs_range(0, 15, 4, 5), "", options = [MERGE, BACKGROUND_LIGHTGREY])
+            if idempotencyKey:
+                self.put(("key", spreadsheetId, idempotencyKey), {"payloadHash": payloadHash, "future": future, "job": job, "createdAt": time.time()})
 
-    # Zone name
-    setCellContent(requests, abs_range(0, 1, 0, 4), zone, options = [MERGE, BOLD, CENTER, FONT_CYAN, BACKGROUND_GREY])
+            return future, job, replayed
 
-    # Reset Pokémon card by unmerging all cells
-    unmergeCells(requests, abs_range(1, 15, 0, 4))
+    def find(self, key):
+        entry = self.entries.get(key)
 
-    # Pokémon caught in the zone : display all Pokémon data
-    if pokemon:
+        if entry is None:
+            return None
 
-        # Pokémon sprite
-        setCellContent(requests, abs_range(1, 5, 0, 4), f"=VLOOKUP({pokemon["pokedexId"]},Sprites!$A:$B,2,FALSE)", options = [MERGE, CENTER, FORMULA])
+        future = entry["future"]
+        expired = time.time() - entry["createdAt"] > self.ttl
+        failed = future.done() and (future.cancelled() or future.exception() is not None)
 
-        # Pokémon name + nickname
-        unmergeCells(requests, abs_range(5, 6, 0, 4))
-        setCellContent(requests, abs_range(5, 6, 0, 3 + pokemon["alive"]), "", options = [MERGE, CENTER])
-        setCellBoldSplitContent(requests, abs_range(5, 6, 0, 3 + pokemon["alive"]), pokemon["nickname"], f"({pokemon["pokemonName"]})")
+        if expired or failed:
+            del self.entries[key]
+            return None
 
-        # Dead emoji
-        if (not pokemon["alive"]):
-            setCellContent(requests, abs_range(5, 6, 3, 4), "💀", options = [CENTER, BACKGROUND_BLACK])
+        self.entries.move_to_end(key)
+        return entry
 
-        # Ability
-        setCellContent(requests, abs_range(6, 7, 0, 2), pokemon["ability"], options = [MERGE, CENTER])
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
 
-        # Level
-        setCellContent(requests, abs_range(6, 7, 2, 4),  f"{"Niveau" if lang == "FR" else "Level"} {pokemon["level"]}", options = [MERGE, CENTER])
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last = False)
 
-        # White separator, merge all cells horizontally, hide PID in white font
-        setCellContent(requests, abs_range(7, 8, 0, 4), f"{pokemon["pid"]}", options = [MERGE, CENTER, FONT_WHITE])
 
-        # Moves
-        for i in range(4):
-            setCellContent(requests, abs_range(8 + i // 2, 9 + i // 2, 2*(i % 2), 2 + 2*(i % 2)), pokemon["moves"][i], options = [MERGE, CENTER])
+deduplicator = UpdateDeduplicator(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
 
-        # White separator, merge all cells horizontally
-        mergeCells(requests, abs_range(10, 11, 0, 4))
+def hashPayload(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-        # Nature
-        setCellContent(requests, abs_range(11, 12, 0, 4), pokemon["nature"], options = [BOLD, MERGE, CENTER])
+# Hash of each updated run as it would be written : key order and the rest of the payload (fullData, other runs) don't matter
+def hashRuns(sheetId, lang, updatedData):
+    return {runId: hashPayload(json.dumps([sheetId, lang, run], sort_keys = True, separators = (",", ":"), ensure_ascii = False))
+            for runId, run in updatedData.items()}
 
-        # Stats
-        statBuffed, statDebuffed = NATURE_DICO[pokemon["nature"]]
 
-        for i in range(6):
-            setCellContent(requests, abs_range(12 + i % 3, 13 + i % 3, 2*(i // 3), 1 + 2*(i // 3)), STATS_NAMES[lang][i], options = [CENTER])
-            setCellContent(requests, abs_range(12 + i % 3, 13 + i % 3, 1 + 2*(i // 3), 2 + 2*(i // 3)), pokemon["IVs"][i], options = [CENTER, FONT_LIGHTRED if i == statDebuffed else None,
-                                                                                                                                      FONT_RED if i == statBuffed else None, BOLD if i == statBuffed else None])
-    
-    # No Pokémon caught in the zone : merge all cells
-    else:
-        mergeCells(requests, abs_range(1, 15, 0, 4))
-        emptyCell(requests, abs_range(1, 2, 0, 1))
+def readRunCardColumn(spreadsheetId):
 
+    # Retrieve all strings in column B, formulas as written (run titles)
+    with metrics.timer("runandbun_phase_seconds", {"phase": "scan"}):
+        return executeSheetsCall("values.get", getSheetsService().spreadsheets().values().get(
+            spreadsheetId = spreadsheetId,
+            range = "B:B",
+            valueRenderOption = "FORMULA"
+        )).get("values", [])
 
-def getRunCardId(runId, spreadsheetId):
+# Titles of the archive sheets, archive n being the n-th one (archives stop at the first missing number)
+def listArchiveSheets(sheets):
+    titles = {sheet["properties"]["sheetId"] - ARCHIVE_SHEET_ID_BASE: sheet["properties"]["title"] for sheet in sheets}
+    archiveTitles = []
 
-    # Retrieve all strings in column B
-    column = sheetsService.spreadsheets().values().get(
-        spreadsheetId = spreadsheetId,
-        range = "B:B"
-    ).execute().get("values", [])
+    while len(archiveTitles) + 1 in titles:
+        archiveTitles.append(titles[len(archiveTitles) + 1])
 
-    # Iterate on each to find a run with provided runId
+    return archiveTitles
+
+def getArchiveSheetId(archive):
+    return ARCHIVE_SHEET_ID_BASE + archive
+
+def archiveSheetTitle(archive):
+    return f"{ARCHIVE_SHEET_TITLE} {archive}"
+
+def archiveColumnRange(title):
+    return "'" + title.replace("'", "''") + "'!B:B"
+
+# Max run cards on the live sheet (0 : archiving disabled), live run cards span 500 columns
+def archiveLimit():
+    limits = [ARCHIVE_MAX_RUNS, max(1, ARCHIVE_MAX_CELLS // (RUN_CARD_HEIGHT * 500)) if ARCHIVE_MAX_CELLS else 0]
+    return min([limit for limit in limits if limit], default = 0)
+
+# Move the oldest run cards of the live sheet to the archive sheets, creating them when full
+def archiveRuns(requests, sheetId, runIndex):
+    liveRuns = runIndex.liveRuns()
+
+    if liveRuns <= archiveLimit():
+        return
+
+    # Archive in bulk so the next runs do not each trigger a move
+    archivedRuns = min(liveRuns, max(liveRuns - archiveLimit(), ARCHIVE_BATCH_RUNS))
+    stamp = runIndex.archivedRuns() + 1
+    lastStamp = stamp + archivedRuns - 1
+
+    while stamp <= lastStamp:
+
+        # New archive sheet, with the column sizes of the live sheet
+        if not runIndex.archives or runIndex.archives[-1] >= ARCHIVE_SHEET_RUNS:
+            runIndex.archives.append(0)
+            archiveSheetId = getArchiveSheetId(len(runIndex.archives))
+
+            addSheet(requests, archiveSheetId, archiveSheetTitle(len(runIndex.archives)), 1, RUN_CARD_WIDTH)
+            updateCardColumnSizes(requests, archiveSheetId)
+
+        archiveSheetId = getArchiveSheetId(len(runIndex.archives))
+        movedRuns = min(lastStamp - stamp + 1, ARCHIVE_SHEET_RUNS - runIndex.archives[-1])
+
+        # Live run cards of the moved stamps, newest at the top, pasted at the top of the archive sheet
+        startRow = RUN_CARD_HEIGHT * (runIndex.sequence - (stamp + movedRuns - 1))
+        endRow = RUN_CARD_HEIGHT * (runIndex.sequence - stamp + 1)
+
+        insertRows(requests, archiveSheetId, endRow - startRow)
+        copyRange(requests,
+                  {"sheetId": sheetId, "startRowIndex": startRow, "endRowIndex": endRow, "startColumnIndex": 0, "endColumnIndex": RUN_CARD_WIDTH},
+                  {"sheetId": archiveSheetId, "startRowIndex": 0, "endRowIndex": endRow - startRow, "startColumnIndex": 0, "endColumnIndex": RUN_CARD_WIDTH})
+
+        runIndex.archives[-1] += movedRuns
+        stamp += movedRuns
+
+    deleteRows(requests, sheetId, RUN_CARD_HEIGHT * (liveRuns - archivedRuns), RUN_CARD_HEIGHT * liveRuns)
+
+# Cell holding the runId of a run card, in the live sheet (archive 0) or an archive sheet
+def runIdCellRange(archive, runCardId):
+    row = RUN_CARD_HEIGHT * runCardId + 8
+    return f"B{row}:B{row}" if not archive else "'" + archiveSheetTitle(archive).replace("'", "''") + f"'!B{row}:B{row}"
+
+# Cells of column B expected to hold the given runIds, in a single call
+def readRunIdCells(spreadsheetId, ranges):
+    with metrics.timer("runandbun_phase_seconds", {"phase": "scan"}):
+        return executeSheetsCall("values.batchGet", getSheetsService().spreadsheets().values().batchGet(
+            spreadsheetId = spreadsheetId,
+            ranges = ranges,
+            valueRenderOption = "FORMULA"
+        )).get("valueRanges", [])
+
+# Column B of every archive sheet, only read when archiving is enabled
+def readArchiveColumns(spreadsheetId):
+    if not archiveLimit():
+        return []
+
+    with metrics.timer("runandbun_phase_seconds", {"phase": "scan"}):
+        sheets = executeSheetsCall("get", getSheetsService().spreadsheets().get(
+            spreadsheetId = spreadsheetId,
+            fields = "sheets.properties(sheetId,title)"
+        )).get("sheets", [])
+
+        return [executeSheetsCall("values.get", getSheetsService().spreadsheets().values().get(
+            spreadsheetId = spreadsheetId,
+            range = archiveColumnRange(title)
+        )).get("values", []) for title in listArchiveSheets(sheets)]
+
+def parseRunCardIds(column):
+    runCardIds = {}
+
+    # Iterate on each to find every run card
     for rowIndex, row in enumerate(column, start = 1):
         
         # Check only rows starting with "runId :"
-        if row and row[0].startswith("RundId : "):
+        if row and str(row[0]).startswith("RundId : "):
 
             # Extract the runId after the prefix
-            parsedRunId = row[0].split("RundId : ", 1)[1].strip()
+            parsedRunId = str(row[0]).split("RundId : ", 1)[1].strip()
 
             # Calculate runCardId (0 : first card)
-            if parsedRunId == runId:
-                return int((rowIndex - 8) / 18)
+            runCardIds.setdefault(parsedRunId, int((rowIndex - 8) / RUN_CARD_HEIGHT))
+
+    return runCardIds
+
+# Runs whose title (3rd row of the card) is the former INDIRECT formula or a wrong "Run #N"
+# Titles edited by hand are left alone
+def findOutdatedTitles(column, runCardIds, sequence):
+    outdatedTitles = set()
+
+    for runId, runCardId in runCardIds.items():
+        rowIndex = RUN_CARD_HEIGHT * runCardId + 2
+        title = str(column[rowIndex][0]) if rowIndex < len(column) and column[rowIndex] else ""
+
+        if title.startswith('=IFERROR("Run #"') or (re.fullmatch(r"Run #\d+", title) and title != f"Run #{sequence - runCardId}"):
+            outdatedTitles.add(runId)
+
+    return outdatedTitles
+
+
+# Position of every run card of a spreadsheet, shifted in place when a new run card is inserted at the top
+# Each run stores the insertion sequence number it was created with : runCardId = sequence - stamp
+# The oldest runs can be moved to archive sheets : archives holds the number of run cards of each archive sheet,
+# filled in order, so archive n holds the stamps right after the ones of archive n - 1, newest run card at the top
+class RunIndex:
+    def __init__(self, spreadsheetId):
+        self.spreadsheetId = spreadsheetId
+        self.lock = threading.RLock()
+        self.sequence = 0
+        self.stamps = None
+        self.archives = []
+        self.outdatedTitles = set()
+        self.loadedAt = 0
+        self.load()
+
+    def path(self):
+        if not RUN_INDEX_DIRECTORY:
+            return None
+
+        return os.path.join(RUN_INDEX_DIRECTORY, safeFileName(self.spreadsheetId) + ".json")
+
+    def load(self):
+        path = self.path()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding = "utf-8") as indexFile:
+                    content = json.load(indexFile)
+
+                self.restore(content)
+
+            except (OSError, ValueError, KeyError):
+                print(f"❌ Unreadable run index {path}, it will be rebuilt")
+                self.stamps = None
+
+    def save(self):
+        path = self.path()
+
+        if path and self.stamps is not None:
+            os.makedirs(RUN_INDEX_DIRECTORY, exist_ok = True)
+
+            # Write to a temporary file first so a crash never leaves a truncated index
+            with open(path + ".tmp", "w", encoding = "utf-8") as indexFile:
+                json.dump(self.state(), indexFile)
+
+            os.replace(path + ".tmp", path)
+
+    def state(self):
+        return {"sequence": self.sequence, "stamps": dict(self.stamps), "archives": list(self.archives),
+                "outdatedTitles": sorted(self.outdatedTitles), "loadedAt": self.loadedAt}
+
+    def restore(self, content):
+        self.sequence = content["sequence"]
+        self.stamps = dict(content["stamps"])
+        self.archives = list(content.get("archives", []))
+        self.outdatedTitles = set(content.get("outdatedTitles", []))
+        self.loadedAt = content["loadedAt"]
+
+    # Column B of the live and archive sheets can be read beforehand by the caller (async client)
+    def rebuild(self, column = None, archiveColumns = None):
+        if column is None:
+            column = readRunCardColumn(self.spreadsheetId)
+
+        if archiveColumns is None:
+            archiveColumns = readArchiveColumns(self.spreadsheetId)
+
+        self.stamps = {}
+        self.archives = []
+
+        # Archived runs come first in stamp order
+        for archiveColumn in archiveColumns:
+            archiveCardIds = parseRunCardIds(archiveColumn)
+            self.archives.append(max(archiveCardIds.values(), default = -1) + 1)
+
+            for runId, runCardId in archiveCardIds.items():
+                self.stamps[runId] = sum(self.archives) - runCardId
+
+        runCardIds = parseRunCardIds(column)
+
+        self.sequence = sum(self.archives) + max(runCardIds.values(), default = -1) + 1
+        self.stamps.update({runId: self.sequence - runCardId for runId, runCardId in runCardIds.items()})
+        self.outdatedTitles = findOutdatedTitles(column, runCardIds, self.sequence)
+        self.loadedAt = time.time()
+
+    def invalidate(self):
+        self.stamps = None
+
+        path = self.path()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    # Older than RUN_INDEX_MAX_AGE : cards may have been moved since by another writer (second server, manual edit)
+    def isAged(self):
+        return RUN_INDEX_MAX_AGE and time.time() - self.loadedAt > RUN_INDEX_MAX_AGE
+
+    # Make sure every provided runId can be trusted : an unknown runId may be a new run or a run card created elsewhere
+    # Known runs cost no read until the index is aged, the runId cells of their cards are then read to check they did not move
+    # A batchUpdate refused by Google (a card moved, rows out of range) invalidates the index, rebuilt by the next update
+    def verify(self, runIds):
+        if self.needsRebuild(runIds):
+            self.rebuild()
+
+        elif self.isAged() and (ranges := self.runIdRanges(runIds)) and self.hasDrifted(ranges, readRunIdCells(self.spreadsheetId, list(ranges.values()))):
+            self.rebuild()
+
+    def needsRebuild(self, runIds):
+        return self.stamps is None or any(runId not in self.stamps for runId in runIds)
+
+    # Cell expected to hold each known runId
+    def runIdRanges(self, runIds):
+        return {runId: runIdCellRange(*self.locate(runId)) for runId in runIds if self.get(runId) != -1}
+
+    # Card moved since the index was built (card inserted or deleted by hand or by another server)
+    # Every card where expected : the index is trusted for RUN_INDEX_MAX_AGE more
+    def hasDrifted(self, ranges, valueRanges):
+        for runId, valueRange in zip(ranges, valueRanges):
+            values = valueRange.get("values", [])
+            cell = str(values[0][0]) if values and values[0] else ""
+
+            if not cell.startswith("RundId : ") or cell.split("RundId : ", 1)[1].strip() != runId:
+                print(f"❌ Run card of {runId} moved in {self.spreadsheetId}, the run index will be rebuilt")
+                metrics.increment("runandbun_run_index_drifts_total")
+                return True
+
+        if len(valueRanges) < len(ranges):
+            return True
+
+        self.loadedAt = time.time()
+        return False
+
+    def get(self, runId):
+        return self.locate(runId)[1]
+
+    # Sheet holding the run (0 : live sheet, n : archive n) and runCardId inside that sheet
+    def locate(self, runId):
+        if self.stamps is None or runId not in self.stamps:
+            return 0, -1
+
+        stamp = self.stamps[runId]
+        if stamp > self.archivedRuns():
+            return 0, self.sequence - stamp
+
+        lastArchivedStamp = 0
+        for archive, archivedRuns in enumerate(self.archives, start = 1):
+            lastArchivedStamp += archivedRuns
+
+            if stamp <= lastArchivedStamp:
+                return archive, lastArchivedStamp - stamp
+
+    def archivedRuns(self):
+        return sum(self.archives)
+
+    def liveRuns(self):
+        return self.sequence - self.archivedRuns()
+
+    # A new run card is always inserted at the top : every other card moves one card down
+    # Stamps follow the card order from the bottom, so the stamp is also the run number
+    def insertRun(self, runId):
+        self.sequence += 1
+        self.stamps[runId] = self.sequence
+
+        return self.sequence
+
+    def runNumber(self, runId):
+        return self.stamps[runId]
+
+
+runIndexes = {}
+runIndexesLock = threading.Lock()
+
+def getRunIndex(spreadsheetId):
+    with runIndexesLock:
+        if spreadsheetId not in runIndexes:
+            runIndexes[spreadsheetId] = RunIndex(spreadsheetId)
+
+        return runIndexes[spreadsheetId]
+
+
+runSnapshots = {}
+runSnapshotsLock = threading.Lock()
+
+def getRunSnapshots(spreadsheetId):
+    with runSnapshotsLock:
+        if spreadsheetId not in runSnapshots:
+            runSnapshots[spreadsheetId] = RunSnapshots(spreadsheetId)
+
+        return runSnapshots[spreadsheetId]
+
+
+runStore = RunStore(RUN_STORE_PATH) if RUN_STORE_PATH else None
+
+# Keep the update in the run store and return the full runs to build cards from
+def recordUpdate(spreadsheetId, updatedData, fullData):
+    if runStore is None:
+        return fullData
+
+    runStore.merge(spreadsheetId, updatedData, fullData)
+    return StoredRuns(runStore, spreadsheetId)
+
+
+# Cross-run statistics of a spreadsheet, kept up to date by each update instead of reading the sheet again :
+# Pokémon caught and dead per zone and per Pokémon, runs reaching each badge, natures and personal best trainers
+# Each run keeps its contribution so an update replaces it, the aggregates are built from the stored runs on first use
+class RunStats:
+    def __init__(self, spreadsheetId):
+        self.spreadsheetId = spreadsheetId
+        self.built = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.contributions = {}
+        self.badgeRuns = 0
+        self.badgeSum = 0
+        self.badgesReached = [0] * len(BADGES)
+        self.zones = {zone: [0, 0] for zone in ZONES}
+        self.pokemon = {}
+        self.natures = Counter()
+        self.trainers = Counter()
+        self.rankings = None
+        self.builtAt = None
+
+    # Runs from the run store when enabled, else from the snapshots of the pushed cards
+    def rebuild(self):
+        with self.lock:
+            self.reset()
+
+            if runStore is not None:
+                runs = ((runId, runStore.get(self.spreadsheetId, runId)) for runId in runStore.runIds(self.spreadsheetId))
+            else:
+                runs = getRunSnapshots(self.spreadsheetId).items()
+
+            for runId, run in runs:
+                self.replace(runId, run)
+
+            self.built = True
+            self.builtAt = time.time()
+
+    # Pushed snapshot of a run, only the parameters and zones it holds change (snapshots may be partial after a restart)
+    def update(self, runId, run):
+        with self.lock:
+            if self.built:
+                self.replace(runId, run)
+
+    def replace(self, runId, run):
+        previous = self.contributions.pop(runId, None)
+        contribution = {"gymBadges": None, "trainer": None, "pokemon": {}} if previous is None else dict(previous, pokemon = dict(previous["pokemon"]))
+        runData = run.get("runData") or {}
+
+        if "gymBadges" in runData:
+            contribution["gymBadges"] = min(int(runData["gymBadges"] or 0), len(BADGES))
+
+        if "personalBest" in runData:
+            contribution["trainer"] = (runData["personalBest"] or {}).get("trainerName") or None
+
+        for zone, pokemon in (run.get("pokemonData") or {}).items():
+            if pokemon and zone in self.zones:
+                nature = pokemon.get("nature")
+                contribution["pokemon"][zone] = (pokemon.get("pokemonName"), bool(pokemon.get("alive")), NATURE_NAMES_EN.get(nature, nature))
+            else:
+                contribution["pokemon"].pop(zone, None)
+
+        if previous is not None:
+            self.count(previous, -1)
+
+        self.count(contribution, 1)
+        self.contributions[runId] = contribution
+
+    def count(self, contribution, sign):
+        self.rankings = None
+
+        if contribution["gymBadges"] is not None:
+            self.badgeRuns += sign
+            self.badgeSum += sign * contribution["gymBadges"]
+
+            for badge in range(contribution["gymBadges"]):
+                self.badgesReached[badge] += sign
+
+        if contribution["trainer"]:
+            self.trainers[contribution["trainer"]] += sign
+
+        for zone, (pokemonName, alive, nature) in contribution["pokemon"].items():
+            self.zones[zone][0] += sign
+            self.zones[zone][1] += sign * (not alive)
+
+            pokemon = self.pokemon.setdefault(pokemonName, [0, 0])
+            pokemon[0] += sign
+            pokemon[1] += sign * (not alive)
+
+            self.natures[nature] += sign
+
+    # Sorted lists of the aggregates, kept until the next counted contribution
+    def rank(self):
+        def deaths(caught, dead):
+            return {"caught": caught, "dead": dead, "deathRate": dead / caught if caught else 0}
+
+        return {
+            "badges": [{"badge": badge, "runs": runs, "rate": runs / self.badgeRuns if self.badgeRuns else 0} for badge, runs in zip(BADGES, self.badgesReached)],
+            "zones": [{"zone": zone, **deaths(caught, dead)} for zone, (caught, dead) in self.zones.items() if caught],
+            "pokemon": [{"pokemon": name, **deaths(caught, dead)} for name, (caught, dead) in sorted(self.pokemon.items(), key = lambda item: -item[1][0]) if caught],
+            "natures": [{"nature": nature, "count": count} for nature, count in self.natures.most_common() if count > 0],
+            "personalBestTrainers": [{"trainer": trainer, "runs": count} for trainer, count in self.trainers.most_common() if count > 0]
+        }
+
+    # Answer built from the aggregates only, whatever the number of runs, sorted again only after an update
+    def describe(self):
+        if not self.built:
+            self.rebuild()
+
+        with self.lock:
+            if self.rankings is None:
+                self.rankings = self.rank()
+
+            return {
+                "spreadsheetId": self.spreadsheetId,
+                "runs": len(self.contributions),
+                "averageBadges": self.badgeSum / self.badgeRuns if self.badgeRuns else 0,
+                **self.rankings,
+                "source": "runStore" if runStore is not None else "snapshots",
+                "builtAt": self.builtAt
+            }
+
+
+runStats = {}
+runStatsLock = threading.Lock()
+
+def getRunStats(spreadsheetId):
+    with runStatsLock:
+        if spreadsheetId not in runStats:
+            runStats[spreadsheetId] = RunStats(spreadsheetId)
+
+        return runStats[spreadsheetId]
+
+
+# Sprites sheet of each spreadsheet (column A : key, column B : sprite cell), to write sprites without VLOOKUP formulas
+# Entries expire after SPRITE_CACHE_TTL, or after SPRITE_MISS_REFRESH when a key was missing (sprite added to the sheet)
+SPRITE_FORMULA = re.compile(r'=VLOOKUP\(("(?:[^"]|"")*"|[^,]*),Sprites!\$A:\$B,2,FALSE\)')
+
+def spriteKey(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    # VLOOKUP is not case sensitive
+    return str(value).strip().lower()
+
+# Sprite cell written as a formula : formulas are copied, values are written as literals
+def spriteFormula(value):
+    if isinstance(value, str) and value.startswith("="):
+        return value
+
+    if isinstance(value, str):
+        return '="' + value.replace('"', '""') + '"'
+
+    return f"={value}"
+
+def parseSprites(rows):
+    return {spriteKey(row[0]): spriteFormula(row[1]) for row in rows if len(row) >= 2 and row[0] != ""}
+
+def readSprites(spreadsheetId):
+    try:
+        return executeSheetsCall("values.get", getSheetsService().spreadsheets().values().get(
+            spreadsheetId = spreadsheetId,
+            range = "Sprites!A:B",
+            valueRenderOption = "FORMULA"
+        )).get("values", [])
+
+    # No Sprites sheet : every sprite stays a VLOOKUP formula
+    except HttpError as e:
+        if e.resp.status != 400:
+            raise
+
+        print(f"❌ No Sprites sheet in {spreadsheetId}, sprites are written as formulas")
+        return []
+
+class SpriteCache:
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def needsRefresh(self, spreadsheetId):
+        with self.lock:
+            entry = self.entries.get(spreadsheetId)
+
+        if entry is None:
+            return True
+
+        age = time.time() - entry["loadedAt"]
+        return age > SPRITE_CACHE_TTL or (entry["missing"] and age > SPRITE_MISS_REFRESH)
+
+    # Sprites rows can be read beforehand by the caller (async client)
+    def get(self, spreadsheetId, rows = None):
+        if rows is not None or self.needsRefresh(spreadsheetId):
+            sprites = parseSprites(readSprites(spreadsheetId) if rows is None else rows)
+
+            with self.lock:
+                self.entries[spreadsheetId] = {"loadedAt": time.time(), "sprites": sprites, "missing": False}
+
+        with self.lock:
+            return self.entries[spreadsheetId]["sprites"]
+
+    def markMissing(self, spreadsheetId):
+        with self.lock:
+            if spreadsheetId in self.entries:
+                self.entries[spreadsheetId]["missing"] = True
+
+
+spriteCache = SpriteCache()
+
+# Replace VLOOKUP formulas on the Sprites sheet by the sprite cells, unknown keys keep their formula
+def resolveSprites(requests, sprites):
+    missingKeys = set()
+
+    for sheetRequest in requests:
+        cell = sheetRequest.get("repeatCell", {}).get("cell", {})
+        formula = (cell.get("userEnteredValue") or {}).get("formulaValue")
+        match = SPRITE_FORMULA.fullmatch(formula) if formula else None
+
+        if match:
+            key = match[1][1:-1].replace('""', '"') if match[1].startswith('"') else match[1]
+
+            if spriteKey(key) in sprites:
+                cell["userEnteredValue"] = {"formulaValue": sprites[spriteKey(key)]}
+            else:
+                missingKeys.add(key)
+
+    return missingKeys
+
+
+# Blank run card with every Pokémon card, in the layout and language of a new run
+def generateBlankRun(requests, sheetId, lang):
+    blankRunData = {"runStart": "", "runEnd": "", "wonBattles": "", "deadPokemon": "", "gymBadges": 0,
+                    "personalBest": {"trainerName": "", "trainerSprite": "", "trainerTeam": []}}
+
+    generateRunCard(requests, sheetId, "", blankRunData, lang)
+    generatePokemonCards(requests, sheetId, {}, 0, lang)
+
+# Sheets whose columns were sized for run cards : column sizes are written with the first run card of a sheet, not with every new run
+class SizedSheets:
+    def __init__(self):
+        self.sheets = set()
+        self.lock = threading.Lock()
+
+    def size(self, requests, spreadsheetId, sheetId):
+        with self.lock:
+            if (spreadsheetId, sheetId) not in self.sheets:
+                updateCardColumnSizes(requests, sheetId)
+                self.sheets.add((spreadsheetId, sheetId))
+
+    # Upload failed or columns changed by hand : size the sheets of the spreadsheet again next time
+    def forget(self, spreadsheetId):
+        with self.lock:
+            self.sheets = {key for key in self.sheets if key[0] != spreadsheetId}
+
+
+sizedSheets = SizedSheets()
+
+def getTemplateSheetId(lang):
+    return 1_000_000_000 + zlib.crc32(lang.encode()) % 1_000_000_000
+
+
+# Hidden template sheet per spreadsheet and language, rendered once and copied for every new run
+class RunTemplates:
+    def __init__(self):
+        self.templateSheetIds = {}
+        self.lock = threading.Lock()
+
+    # Return the template sheetId, adding the requests creating the template and sizing the run sheet columns if needed
+    # The spreadsheet sheets can be read beforehand by the caller (async client)
+    def prepare(self, requests, spreadsheetId, sheetId, lang, sheets = None):
+        with self.lock:
+            if (spreadsheetId, lang) not in self.templateSheetIds:
+                title = f"{TEMPLATE_SHEET_TITLE} {lang}"
+
+                # Template may have been created before a restart
+                if sheets is None:
+                    sheets = executeSheetsCall("get", getSheetsService().spreadsheets().get(
+                        spreadsheetId = spreadsheetId,
+                        fields = "sheets.properties(sheetId,title)"
+                    )).get("sheets", [])
+
+                existingIds = [sheet["properties"]["sheetId"] for sheet in sheets if sheet["properties"]["title"] == title]
+
+                if existingIds:
+                    self.templateSheetIds[(spreadsheetId, lang)] = existingIds[0]
+
+                else:
+                    addSheet(requests, getTemplateSheetId(lang), title, 19, 500, hidden = True)
+                    generateBlankRun(requests, getTemplateSheetId(lang), lang)
+                    self.templateSheetIds[(spreadsheetId, lang)] = getTemplateSheetId(lang)
+
+            # Column sizes are not copied with the template
+            sizedSheets.size(requests, spreadsheetId, sheetId)
+
+            return self.templateSheetIds[(spreadsheetId, lang)]
+
+    def isKnown(self, spreadsheetId, lang):
+        with self.lock:
+            return (spreadsheetId, lang) in self.templateSheetIds
+
+    # Template deleted or upload failed : check the spreadsheet again next time
+    def forget(self, spreadsheetId):
+        with self.lock:
+            self.templateSheetIds = {key: value for key, value in self.templateSheetIds.items() if key[0] != spreadsheetId}
+
+
+runTemplates = RunTemplates()
+
+
+# Card requests shared by the targets of a fan-out update : a card is compiled for the first target showing it
+# and copied for the others, moved to their sheet and run card position
+# Cards are keyed on their content only : the language and run number of the target (args[variantArgs]) are written
+# by overlay(requests, *args) after the copy when they differ from the ones the card was compiled with
+class CardCache:
+    def __init__(self):
+        self.cards = {}
+        self.lock = threading.Lock()
+
+    # Append the requests of function(requests, *args), args being (sheetId, ...) with the run card position at args[runCardArg]
+    def compile(self, requests, function, args, runCardArg, variantArgs = (), overlay = None):
+        sheetId, runCardId = args[0], args[runCardArg] or 0
+        variant = [args[i] for i in variantArgs]
+        key = (function.__name__, json.dumps([arg for i, arg in enumerate(args) if i not in (0, runCardArg, *variantArgs)], sort_keys = True, default = str))
+
+        with self.lock:
+            card = self.cards.get(key)
+
+        if card is None:
+            cardRequests = []
+            function(cardRequests, *args)
+            card = self.cards.setdefault(key, (cardRequests, sheetId, runCardId, variant))
+            metrics.increment("runandbun_fanout_cards_total", {"result": "compiled"})
+        else:
+            metrics.increment("runandbun_fanout_cards_total", {"result": "reused"})
+
+        cardRequests, cardSheetId, cardRunCardId, cardVariant = card
+        requests.extend(relocateRequests(cardRequests, sheetId, RUN_CARD_HEIGHT * (runCardId - cardRunCardId)))
+
+        if variant != cardVariant:
+            overlay(requests, *args)
+
+# Copy of requests moved to sheetId and rowShift rows lower
+def relocateRequests(requests, sheetId, rowShift):
+    def relocate(value):
+        if isinstance(value, list):
+            return [relocate(item) for item in value]
+
+        if not isinstance(value, dict):
+            return value
+
+        value = {key: relocate(item) for key, item in value.items()}
+
+        # Grid range, or rows dimension range
+        if "sheetId" in value:
+            value["sheetId"] = sheetId
+
+            if "startRowIndex" in value:
+                value["startRowIndex"] += rowShift
+                value["endRowIndex"] += rowShift
+
+            elif value.get("dimension") == "ROWS":
+                value["startIndex"] += rowShift
+                value["endIndex"] += rowShift
+
+        return value
+
+    return [relocate(request) for request in requests]
+
+
+def locateRunCard(runId, spreadsheetId):
+
+    # Default : runCardId = -1 (no run found), archive 0 is the live sheet
+    return getRunIndex(spreadsheetId).locate(runId)
+
+# Refuse with a 400 what the card functions could not compile, before the run index or the run store are changed
+def validateUpdate(spreadsheetId, updatedData, fullData):
+    runIndex = getRunIndex(spreadsheetId)
+
+    for runId, run in updatedData.items():
+        if not isinstance(run, dict) or not isinstance(run.get("runData"), dict) or not isinstance(run.get("pokemonData"), dict):
+            raise PayloadError(f"Run {runId} must have runData and pokemonData objects", 400)
+
+        for zone, pokemon in run["pokemonData"].items():
+            if zone not in ZONE_INDEX:
+                raise PayloadError(f"Unknown zone {zone} in run {runId}", 400)
+
+            if pokemon and (missingFields := [key for key in POKEMON_FIELDS if key not in pokemon]):
+                raise PayloadError(f"Pokémon of run {runId}, zone {zone} is missing required fields : {", ".join(missingFields)}", 400)
+
+            if pokemon and pokemon["nature"] not in NATURE_DICO:
+                raise PayloadError(f"Unknown nature {pokemon["nature"]} in run {runId}, zone {zone}", 400)
+
+        # A new run card is built from the whole run
+        if runIndex.get(runId) == -1 and fullData is not None and runId not in fullData:
+            raise PayloadError(f"New run {runId} is missing from fullData.runs", 400)
+
+# Fields missing from a whole run to build its cards, as "runData.gymBadges" or "pokemonData.<zone>.nature"
+def missingRunFields(run):
+    runData = run.get("runData") if isinstance(run.get("runData"), dict) else {}
+    missingFields = [f"runData.{key}" for key in NEW_RUN_FIELDS if key not in runData]
+
+    if "personalBest" in runData:
+        personalBest = runData["personalBest"] if isinstance(runData["personalBest"], dict) else {}
+        missingFields += [f"runData.personalBest.{key}" for key in PERSONAL_BEST_FIELDS if key not in personalBest]
+
+    for zone, pokemon in (run.get("pokemonData") or {}).items():
+        if pokemon:
+            missingFields += [f"pokemonData.{zone}.{key}" for key in POKEMON_FIELDS if key not in pokemon]
+
+    return missingFields
+
+# New runs once merged with the run store (protocol version 2 only sends changes) : refused with a 400 when their card cannot be built
+def validateNewRuns(spreadsheetId, updatedData, fullData):
+    runIndex = getRunIndex(spreadsheetId)
+
+    for runId in updatedData:
+        if runIndex.get(runId) == -1 and (missingFields := missingRunFields(fullData.get(runId) or {})):
+            raise PayloadError(f"New run {runId} is missing required fields : {", ".join(missingFields)}", 400)
+
+
+updateJournals = {}
+updateJournalsLock = threading.Lock()
+
+def getUpdateJournal(spreadsheetId):
+    with updateJournalsLock:
+        if spreadsheetId not in updateJournals:
+            updateJournals[spreadsheetId] = UpdateJournal(spreadsheetId)
+
+            # Journal left unreadable by a previous process : what it applied is unknown
+            if updateJournals[spreadsheetId].unreadable:
+                getRunIndex(spreadsheetId).invalidate()
+
+        return updateJournals[spreadsheetId]
+
+# Upload failed : keep the journal when some chunks were applied so the next update resumes it,
+# else (nothing applied, request refused by Google, too many attempts) rebuild the layout from the sheet
+def failUpdate(spreadsheetId, e):
+    journal = getUpdateJournal(spreadsheetId)
+    journal.fail()
+    refused = isinstance(e, UploadError) and e.status != 429 and e.status < 500
+
+    if journal.acknowledged and not refused and journal.attempts < JOURNAL_MAX_ATTEMPTS:
+        print(f"❌ Update of {spreadsheetId} stopped after {journal.acknowledged}/{len(journal.requests)} requests, the next update resumes it")
+        metrics.increment("runandbun_journal_updates_total", {"outcome": "kept"})
+        return
+
+    if journal.acknowledged:
+        metrics.increment("runandbun_journal_updates_total", {"outcome": "abandoned"})
+
+    abortUpdate(spreadsheetId, journal.snapshots)
+    journal.discard()
+
+# Every chunk acknowledged : the run index and snapshots of the journaled update become the known sheet layout
+def finishUpdate(spreadsheetId):
+    journal = getUpdateJournal(spreadsheetId)
+    getRunIndex(spreadsheetId).restore(journal.index)
+    commitUpdate(spreadsheetId, journal.snapshots)
+    journal.discard()
+
+# Requests left by an update that failed midway, None if there is none
+def resumableRequests(spreadsheetId):
+    journal = getUpdateJournal(spreadsheetId)
+
+    if not journal.pending():
+        return None
+
+    print(f"⏳ Resuming update of {spreadsheetId} at request {journal.acknowledged}/{len(journal.requests)}")
+    return journal.remaining()
+
+
+# Compile and upload the requests updating each provided run, one update at a time per spreadsheet
+def processUpdate(spreadsheetId, sheetId, updatedData, fullData, lang, cardCache = None):
+    runIndex = getRunIndex(spreadsheetId)
+    journal = getUpdateJournal(spreadsheetId)
+
+    # Only one update at a time per spreadsheet, the index must match the sheet layout
+    with runIndex.lock:
+
+        # Finish the update that failed midway first, the sheet layout is only known once it is applied
+        if (remainingRequests := resumableRequests(spreadsheetId)) is not None:
+            try:
+                with metrics.timer("runandbun_phase_seconds", {"phase": "upload"}):
+                    uploader.upload(spreadsheetId, remainingRequests, journal.acknowledge)
+
+            except Exception as e:
+                failUpdate(spreadsheetId, e)
+                raise
+
+            finishUpdate(spreadsheetId)
+            metrics.increment("runandbun_journal_updates_total", {"outcome": "resumed"})
+
+        # Read column B only if a runId is unknown or the index is outdated
+        runIndex.verify(updatedData.keys())
+        validateUpdate(spreadsheetId, updatedData, fullData)
+
+        fullData = recordUpdate(spreadsheetId, updatedData, fullData)
+        validateNewRuns(spreadsheetId, updatedData, fullData)
+        sprites = spriteCache.get(spreadsheetId) if SPRITE_MODE == "resolved" else None
+        requests, pushedSnapshots = compileCheckedUpdate(spreadsheetId, sheetId, updatedData, fullData, lang, sprites = sprites, cardCache = cardCache)
+        journal.begin(requests, pushedSnapshots, runIndex.state(), not uploader.fitsOneChunk(spreadsheetId, requests))
+
+        try:
+            # Upload requests to Google Sheets API, divided into chunks
+            with metrics.timer("runandbun_phase_seconds", {"phase": "upload"}):
+                uploadStats = uploader.upload(spreadsheetId, requests, journal.acknowledge)
+
+        except Exception as e:
+            failUpdate(spreadsheetId, e)
+            raise
+
+        finishUpdate(spreadsheetId)
+
+    return uploadStats
+
+# Requests updating each provided run, with the snapshots they push : the run index must be verified beforehand
+# The spreadsheet sheets can be provided for the run templates, so no call is made to Google (async client)
+# Sprites read from the Sprites sheet are written instead of VLOOKUP formulas when provided
+# Run and Pokémon cards already compiled for another target of a fan-out update are reused from cardCache when provided
+def compileUpdate(spreadsheetId, sheetId, updatedData, fullData, lang, sheets = None, sprites = None, cardCache = None):
+    requests = []
+    runIndex = getRunIndex(spreadsheetId)
+    snapshots = getRunSnapshots(spreadsheetId)
+    pushedSnapshots = {}
+
+    # Compile a card, counting its requests by card type
+    # Cards with their run card position at args[runCardArg] can be taken from the fan-out cache
+    def compileCard(card, function, *args, runCardArg = None, variantArgs = (), overlay = None):
+        requestStart = len(requests)
+
+        if cardCache is not None and runCardArg is not None:
+            result = cardCache.compile(requests, function, args, runCardArg, variantArgs, overlay)
+        else:
+            result = function(requests, *args)
+
+        metrics.increment("runandbun_compiled_requests_total", {"card": card}, len(requests) - requestStart)
+        return result
+
+    # Iterate on each updated run and update run/pokemon cards
+    for runId, run in updatedData.items():
+
+        # Search for runId to find runCardId, and the sheet holding it
+        with metrics.timer("runandbun_phase_seconds", {"phase": "lookup"}):
+            archive, runCardId = locateRunCard(runId, spreadsheetId)
+            runSheetId = getArchiveSheetId(archive) if archive else sheetId
+
+        compileStart, runRequestStart = time.perf_counter(), len(requests)
+
+        # No run found : create the new run
+        if (runCardId == -1):
+            runCardId = 0
+            runNumber = runIndex.insertRun(runId)
+
+            # Insert a new run card, shifting every other card down
+            if RUN_TEMPLATES:
+                templateSheetId = compileCard("template", runTemplates.prepare, spreadsheetId, sheetId, lang, sheets)
+                compileCard("run", generateRunCardFromTemplate, sheetId, templateSheetId, runId, fullData[runId]["runData"], runNumber)
+            else:
+                compileCard("columns", sizedSheets.size, spreadsheetId, sheetId)
+                compileCard("run", generateRunCard, sheetId, runId, fullData[runId]["runData"], lang, runNumber, None,
+                            runCardArg = 5, variantArgs = (3, 4), overlay = runCardOverlay)
+
+                # Every Pokémon card at once : the layouts of empty, alive and dead cards are pasted over the other cards of the same kind
+                compileCard("pokemon", generatePokemonCards, sheetId, fullData[runId]["pokemonData"], 0, lang,
+                            runCardArg = 2, variantArgs = (3,), overlay = pokemonCardsOverlay)
+
+            # The whole run is now displayed
+            snapshot = {"lang": lang, "runData": copy.deepcopy(fullData[runId]["runData"]), "pokemonData": {}}
+
+            # Insert a Pokémon card for each zone
+            for i in range(len(ZONES)):
+                zone = ZONES[i]
+                pokemon = fullData[runId]["pokemonData"][zone] if zone in fullData[runId]["pokemonData"] else None
+
+                # Template copied : generate the cards with Pokémon data, empty cards come with the template
+                if pokemon and RUN_TEMPLATES:
+                    compileCard("pokemon", generatePokemonCard, sheetId, pokemon, zone, 0, i, lang, runCardArg = 3, variantArgs = (5,), overlay = pokemonCardOverlay)
+
+                snapshot["pokemonData"][zone] = copy.deepcopy(pokemon)
+
+        # RunId found : update row
+        else:
+            snapshot = snapshots.get(runId, lang)
+
+            # If runData has parameters to update, update the ones that changed
+            if (run["runData"]):
+                compileCard("run", updateRunCard, runSheetId, runCardId, run["runData"], snapshot["runData"], runCardArg = 1)
+                snapshot["runData"].update(copy.deepcopy(run["runData"]))
+
+            # Iterate on each Pokémon and update cards
+            for zone, pokemon in run["pokemonData"].items():
+
+                # Calculate pokemon card id from zone order (0 : first card)
+                pokemonCardId = ZONE_INDEX[zone]
+
+                # Pokémon card already pushed : only update what changed
+                if zone in snapshot["pokemonData"]:
+                    compileCard("pokemon", updatePokemonCard, runSheetId, snapshot["pokemonData"][zone], pokemon, zone, runCardId, pokemonCardId, lang,
+                                runCardArg = 4, variantArgs = (6,), overlay = updatedPokemonCardOverlay)
+
+                # Update/create Pokémon card with provided Pokémon data
+                else:
+                    compileCard("pokemon", generatePokemonCard, runSheetId, pokemon, zone, runCardId, pokemonCardId, lang,
+                                runCardArg = 3, variantArgs = (5,), overlay = pokemonCardOverlay)
+
+                snapshot["pokemonData"][zone] = copy.deepcopy(pokemon)
+
+        pushedSnapshots[runId] = snapshot
+        metrics.observe("runandbun_phase_seconds", time.perf_counter() - compileStart, {"phase": "compile"})
+        metrics.observe("runandbun_run_requests", len(requests) - runRequestStart)
+
+    # Replace the volatile formula (or a wrong number) left by former versions with the static run number
+    if runIndex.outdatedTitles:
+        compileCard("title", updateRunTitles, sheetId, runIndex, runIndex.outdatedTitles)
+        runIndex.outdatedTitles = set()
+
+    # Keep the live sheet small : move the oldest run cards to the archive sheets
+    if archiveLimit():
+        compileCard("archive", archiveRuns, sheetId, runIndex)
+
+    if sprites is not None and resolveSprites(requests, sprites):
+        spriteCache.markMissing(spreadsheetId)
+
+    # Fold the requests into fewer, larger ones
+    if COMPACT_REQUESTS:
+        with metrics.timer("runandbun_phase_seconds", {"phase": "compact"}):
+            requests = compactRequests(requests)
+
+    return requests, pushedSnapshots
+
+# compileUpdate changes the run index as it goes (new runs, archives, titles) : restored as it was when compilation fails, nothing was sent
+def compileCheckedUpdate(spreadsheetId, *args, **kwargs):
+    runIndex = getRunIndex(spreadsheetId)
+    indexState = runIndex.state()
+
+    try:
+        return compileUpdate(spreadsheetId, *args, **kwargs)
+
+    except Exception:
+        runIndex.restore(indexState)
+        runTemplates.forget(spreadsheetId)
+        sizedSheets.forget(spreadsheetId)
+        raise
+
+# Sheet layout unknown after a failed upload : next update rebuilds the index and the updated cards
+def abortUpdate(spreadsheetId, pushedSnapshots):
+    getRunIndex(spreadsheetId).invalidate()
+    runTemplates.forget(spreadsheetId)
+    sizedSheets.forget(spreadsheetId)
+
+    for runId in pushedSnapshots:
+        getRunSnapshots(spreadsheetId).discard(runId)
+
+# Cards are now up to date in the sheet
+def commitUpdate(spreadsheetId, pushedSnapshots):
+    getRunIndex(spreadsheetId).save()
+
+    for runId, snapshot in pushedSnapshots.items():
+        getRunSnapshots(spreadsheetId).put(runId, snapshot)
+        getRunStats(spreadsheetId).update(runId, snapshot)
 
-    # Default : runCardId = -1 (no run found) 
-    return -1
 
 # Webapp root
 @flaskApp.route("/", methods=["GET"])
@@ -525,99 +1377,558 @@ def home():
     return "Run&BunStats en cours d'exécution..."
 
 
-# Check password on protected routes
+# Check password on protected routes, and the update budget of the client
 @flaskApp.before_request
 def require_auth():
-    protectedRoutes = ["/updateRun"]
+    refused = authorizeRequest(request)
+
+    if refused is not None:
+        return jsonAnswer(*refused)
+
+    # Sampled until the update is answered, written if slow, sampled or asked for
+    if request.path == "/updateRun":
+        g.profile = profiler.start(request.headers.get("X-Profile") == "true")
+
+
+# Count /updateRun answers by status
+@flaskApp.after_request
+def countUpdates(response):
+    if request.path == "/updateRun":
+        metrics.increment("runandbun_updates_total", {"status": response.status_code})
+
+    return response
+
+# End of a profiled update, even on an unexpected error
+@flaskApp.teardown_request
+def stopProfile(exception):
+    profile = g.pop("profile", None)
+
+    if profile is not None:
+        profiler.stop(profile)
+
+
+# Same value, same pseudonym within a capture
+def pseudonym(value):
+    return hashlib.sha256(f"{CAPTURE_SALT}:{value}".encode()).hexdigest()[:16]
+
+# Captured payload without what identifies a streamer : spreadsheet ids pseudonymized, Pokémon nicknames masked (same length)
+def sanitizePayload(data):
+    if "keys" in data:
+        data["keys"]["spreadsheetId"] = pseudonym(data["keys"].get("spreadsheetId"))
+
+    for target in data.get("targets") or []:
+        target["spreadsheetId"] = pseudonym(target.get("spreadsheetId"))
+
+    for section in ["updatedData", "fullData"]:
+        for run in ((data.get(section) or {}).get("runs") or {}).values():
+            for pokemon in (run.get("pokemonData") or {}).values():
+                if pokemon and "nickname" in pokemon:
+                    pokemon["nickname"] = "N" * len(str(pokemon["nickname"]))
+
+    return data
+
+
+# Appends captured updates to a JSONL file from a background thread, so requests never wait for the disk
+# One line per update : {"arrivedAt": epoch seconds, "client": pseudonym, "async": bool, "payload": sanitized body}
+class CaptureRecorder:
+    def __init__(self, path, maxBytes):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.pending = queue.Queue(CAPTURE_QUEUE_SIZE)
+        threading.Thread(target = self.write, name = "capture", daemon = True).start()
+
+    # Updates arriving while the writer is behind are dropped rather than delaying the request
+    def record(self, text, arrivedAt, client, asyncMode):
+        try:
+            self.pending.put_nowait((text, arrivedAt, client, asyncMode))
+
+        except queue.Full:
+            metrics.increment("runandbun_captured_updates_total", {"result": "dropped"})
+
+    def write(self):
+        with open(self.path, "a", encoding = "utf-8") as captureFile:
+            while True:
+                text, arrivedAt, client, asyncMode = self.pending.get()
+
+                if captureFile.tell() >= self.maxBytes:
+                    metrics.increment("runandbun_captured_updates_total", {"result": "dropped"})
+                    continue
+
+                try:
+                    payload = sanitizePayload(json.loads(text))
+
+                except (ValueError, AttributeError, TypeError):
+                    metrics.increment("runandbun_captured_updates_total", {"result": "invalid"})
+                    continue
+
+                captureFile.write(json.dumps({"arrivedAt": arrivedAt, "client": pseudonym(client), "async": asyncMode, "payload": payload},
+                                             ensure_ascii = False, separators = (",", ":")) + "\n")
+                captureFile.flush()
+                metrics.increment("runandbun_captured_updates_total", {"result": "recorded"})
+
+
+captureRecorder = CaptureRecorder(CAPTURE_PATH, CAPTURE_MAX_BYTES) if CAPTURE_PATH else None
+
+
+# Stack samples of one request, on its own thread and the dispatcher threads running its jobs
+# Reason : "header" and "sampled" profiles are always kept, "slow" ones only past PROFILE_SLOW_MS
+class Profile:
+    def __init__(self, reason):
+        self.reason = reason
+        self.startedAt = time.time()
+        self.start = time.perf_counter()
+        self.threads = {}
+        self.samples = Counter()
+
+
+# One sampler thread records the stacks of every profiled thread, nothing runs when no request is profiled
+# Kept profiles are folded stacks ("a;b;c <samples>" lines) for flamegraph.pl, speedscope or inferno, named <start>-<duration>ms-<reason>-<random>
+class Profiler:
+    def __init__(self, directory, maxDumps, interval):
+        self.directory = directory
+        self.maxDumps = maxDumps
+        self.interval = interval
+        self.requests = 0
+        self.active = set()
+        self.sampler = None
+        self.dumps = None
+        self.lock = threading.Lock()
+        self.wakeUp = threading.Condition(self.lock)
+        self.dumpLock = threading.Lock()
+
+    # Profile of a request starting on the current thread, None when the request is not profiled
+    def start(self, forced):
+        with self.lock:
+            self.requests += 1
+
+            if forced:
+                reason = "header"
+            elif PROFILE_ONE_IN and self.requests % PROFILE_ONE_IN == 0:
+                reason = "sampled"
+            elif PROFILE_SLOW_MS:
+                reason = "slow"
+            else:
+                return None
+
+            profile = Profile(reason)
+            self.active.add(profile)
+
+            if self.sampler is None:
+                self.sampler = threading.Thread(target = self.sample, name = "profiler", daemon = True)
+                self.sampler.start()
+
+            self.wakeUp.notify()
+
+        self.enter(profile)
+        return profile
+
+    # End of the request : the profile is written once its jobs are done too
+    def stop(self, profile):
+        self.leave(profile)
+
+    # Job function submitted by a profiled request, its thread is sampled while it runs
+    # Jobs starting after the request ended (async mode) are not profiled
+    def follow(self, profile, function):
+        if profile is None:
+            return function
+
+        def followed(*args):
+            if not self.enter(profile):
+                return function(*args)
+
+            try:
+                return function(*args)
+
+            finally:
+                self.leave(profile)
+
+        return followed
+
+    def enter(self, profile):
+        threadId = threading.get_ident()
+
+        with self.lock:
+            if profile not in self.active:
+                return False
+
+            profile.threads[threadId] = profile.threads.get(threadId, 0) + 1
+            return True
+
+    def leave(self, profile):
+        threadId = threading.get_ident()
+
+        with self.lock:
+            profile.threads[threadId] -= 1
+
+            if not profile.threads[threadId]:
+                del profile.threads[threadId]
+
+            if profile.threads:
+                return
+
+            self.active.discard(profile)
+
+        duration = time.perf_counter() - profile.start
+
+        if profile.reason != "slow" or duration * 1000 >= PROFILE_SLOW_MS:
+            self.dump(profile, duration)
+
+    def sample(self):
+        while True:
+            with self.lock:
+                while not self.active:
+                    self.wakeUp.wait()
+
+                profiledThreads = [(profile, list(profile.threads)) for profile in self.active]
+
+            frames = sys._current_frames()
+            stacks = [(profile, [foldedStack(frames[threadId]) for threadId in threadIds if threadId in frames]) for profile, threadIds in profiledThreads]
+
+            with self.lock:
+                for profile, profileStacks in stacks:
+                    if profile in self.active:
+                        profile.samples.update(profileStacks)
+
+            time.sleep(self.interval)
+
+    # Profile names in the directory, oldest first, read once
+    def dumpNames(self):
+        if self.dumps is None:
+            fileNames = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+            self.dumps = deque(sorted(fileName.removesuffix(".folded") for fileName in fileNames if fileName.endswith(".folded")))
+
+        return self.dumps
+
+    def dump(self, profile, duration):
+        profileId = f"{time.strftime("%Y%m%dT%H%M%S", time.gmtime(profile.startedAt))}-{round(duration * 1000)}ms-{profile.reason}-{uuid.uuid4().hex[:6]}"
+
+        try:
+            with self.dumpLock:
+                dumps = self.dumpNames()
+                os.makedirs(self.directory, exist_ok = True)
+
+                with open(os.path.join(self.directory, profileId + ".folded"), "w", encoding = "utf-8") as profileFile:
+                    profileFile.writelines(f"{stack} {count}\n" for stack, count in profile.samples.most_common())
+
+                dumps.append(profileId)
+
+                # Ring buffer : oldest profiles deleted
+                while len(dumps) > self.maxDumps:
+                    try:
+                        os.remove(os.path.join(self.directory, dumps.popleft() + ".folded"))
+
+                    except FileNotFoundError:
+                        pass
+
+            metrics.increment("runandbun_profiles_total", {"reason": profile.reason})
+
+        except OSError as e:
+            print(f"❌ Profile {profileId} not written : {e}")
+
+    # Kept profiles, newest first
+    def describe(self):
+        with self.dumpLock:
+            profileIds = list(self.dumpNames())
+
+        profiles = []
+
+        for profileId in reversed(profileIds):
+            match = re.fullmatch(r"(\d{8}T\d{6})-(\d+)ms-(\w+)-\w+", profileId)
+            profiles.append({"profileId": profileId, "startedAt": match[1] if match else None, "durationMs": int(match[2]) if match else None,
+                             "reason": match[3] if match else None, "location": f"/profiles/{profileId}"})
+
+        return profiles
+
+    # Folded stacks of a kept profile, None when unknown
+    def read(self, profileId):
+        with self.dumpLock:
+            if profileId not in self.dumpNames():
+                return None
+
+        try:
+            with open(os.path.join(self.directory, profileId + ".folded"), encoding = "utf-8") as profileFile:
+                return profileFile.read()
+
+        except FileNotFoundError:
+            return None
+
+
+# Root first, one "file:function" per frame
+def foldedStack(frame):
+    names = []
+
+    while frame is not None:
+        names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_qualname}")
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+profiler = Profiler(PROFILE_DIRECTORY, PROFILE_MAX_DUMPS, PROFILE_INTERVAL_MS / 1000)
+
+
+# /updateRun handling shared by the Flask and asyncio apps : they only read the request, run the jobs and send the answers
+# Answers are (body, status, headers), the body being jsonified by the app
+
+def isAsyncMode(request):
+    return request.args.get("async") == "true" or "respond-async" in request.headers.get("Prefer", "")
+
+# Refusal of a request without the password, or of an update from a client over its budget (before reading the payload), else None
+def authorizeRequest(request):
+    protectedRoutes = ["/updateRun", "/metrics", "/profiles"]
+    protectedPrefixes = ["/jobs/", "/stats/", "/profiles/"]
 
     # Check the 'Authorization' header for a simple password
-    if request.path in protectedRoutes:
+    if request.path in protectedRoutes or request.path.startswith(tuple(protectedPrefixes)):
         auth = request.headers.get("Authorization")
 
         if not auth or auth != f"Bearer {API_PASSWORD}":
-            return jsonify({"error": "Unauthorized"}), 401
+            return {"error": "Unauthorized"}, 401, {}
+
+    if request.path == "/updateRun":
+        try:
+            clientLimiter.check(clientAddress(request))
+
+        except RateLimitError as e:
+            return errorAnswer(e)
+
+    return None
+
+# Decoded and checked /updateRun payload : (text, data), PayloadError when it can't be processed
+def readUpdate(request, body, arrivedAt):
+
+    # Convert provided data to JSON, fullData runs are only decoded when read
+    with metrics.timer("runandbun_phase_seconds", {"phase": "parse"}):
+        text = readRequestBody(body, request.headers.get("Content-Encoding", ""))
+        data = parseUpdatePayload(text)
+
+    # Traffic capture for load tests, decoded and written by the recorder thread
+    if captureRecorder is not None:
+        captureRecorder.record(text, arrivedAt, clientAddress(request), isAsyncMode(request))
+
+    # No data received
+    if not data:
+        raise PayloadError("No data received", 400)
+
+    # Outdated parameters and missing required fields
+    with metrics.timer("runandbun_phase_seconds", {"phase": "validate"}):
+        outdatedKeys = containsOutdatedKeys(data)
+        missingKey = missingMandatoryKeys(data) if not outdatedKeys else None
+
+    if outdatedKeys:
+        raise PayloadError("Outdated version : please download the latest RunAndBunDisplay version https://github.com/Sykless/RunAndBunDisplay/releases", 400)
 
+    if missingKey:
+        raise PayloadError(f"Missing required fields : {missingKey}", 400)
+
+    # Protocol version 2 : full runs are read from the run store
+    if data.get("version", 1) == 2 and runStore is None:
+        raise PayloadError("Protocol version 2 is not enabled on this server (RUN_STORE_PATH)", 400)
+
+    # Same runs mirrored to several spreadsheets
+    if "targets" in data and len({target["spreadsheetId"] for target in data["targets"]}) != len(data["targets"]):
+        raise PayloadError("Each target must be a different spreadsheet", 400)
+
+    return text, data
+
+# Submit the update of a spreadsheet : (future or task, job, replayed)
+# A retry of an update already submitted waits for it instead, runs sent again unchanged are skipped
+# start(spreadsheetId, sheetId, updatedData, fullData, lang, cardCache) runs the update of the changed runs and returns (future or task, job)
+def submitUpdate(spreadsheetId, sheetId, lang, updatedData, fullData, request, payloadHash, start, cardCache = None):
+
+    # Retries of an update already submitted are not counted in the spreadsheet budget
+    def startJob(runIds):
+        spreadsheetLimiter.check(spreadsheetId)
+        return start(spreadsheetId, sheetId, {runId: updatedData[runId] for runId in runIds}, fullData, lang, cardCache)
+
+    return deduplicator.submit(spreadsheetId, request.headers.get("Idempotency-Key", "").strip(), payloadHash, hashRuns(sheetId, lang, updatedData), startJob)
+
+# Fan-out update : the same runs submitted for several spreadsheets, cards compiled once and relocated for every target showing the same card
+# (spreadsheetId, future or task, job, replayed, error) per target : the targets are refused, succeed or fail separately
+def submitTargets(data, request, payloadHash, start):
+    cardCache = CardCache()
+    updatedData, fullData = data["updatedData"]["runs"], data.get("fullData", {}).get("runs")
+    submitted = []
+
+    for target in data["targets"]:
+        try:
+            submitted.append((target["spreadsheetId"], *submitUpdate(target["spreadsheetId"], target["sheetId"], target["lang"], updatedData, fullData,
+                                                                     request, payloadHash, start, cardCache), None))
+
+        # Target refused, the other ones are still updated
+        except (RateLimitError, IdempotencyError) as e:
+            submitted.append((target["spreadsheetId"], None, None, False, e))
+
+    return submitted
+
+# Answer of an update submitted in async mode : the client polls the job status
+def jobAnswer(job, replayed):
+    return {"jobId": job.jobId, "status": job.status}, 202, {"Location": f"/jobs/{job.jobId}", **replayedHeader(replayed)}
+
+def updateAnswer(uploadStats, replayed):
+    return {"message": "Data received successfully", "upload": uploadStats}, 200, replayedHeader(replayed)
+
+def replayedHeader(replayed):
+    return {"Idempotent-Replayed": "true"} if replayed else {}
+
+# Answer of a fan-out update in async mode : the client polls the job of each target
+def targetJobsAnswer(submitted):
+    targetResults = [{"spreadsheetId": spreadsheetId, "status": 202, "jobId": job.jobId, "jobStatus": job.status, "location": f"/jobs/{job.jobId}", "replayed": replayed}
+                     if error is None else {"spreadsheetId": spreadsheetId, **targetError(error)}
+                     for spreadsheetId, future, job, replayed, error in submitted]
+
+    return {"targets": targetResults}, targetsStatus(targetResults, 202), {}
+
+# Answer of a fan-out update, results holding the upload stats or the exception of each submitted target
+def targetsAnswer(submitted, results):
+    targetResults = []
+
+    for (spreadsheetId, future, job, replayed, error), result in zip(submitted, results):
+        if error is None and not isinstance(result, BaseException):
+            targetResults.append({"spreadsheetId": spreadsheetId, "status": 200, "upload": result, "replayed": replayed})
+        else:
+            targetResults.append({"spreadsheetId": spreadsheetId, **targetError(error or result)})
+
+    status = targetsStatus(targetResults, 200)
+    return {"message": "Data received successfully" if status == 200 else "Update failed on some targets", "targets": targetResults}, status, {}
+
+# Answer of a refused or failed update
+def errorAnswer(e):
+
+    # Compressed or JSON payload unreadable, or missing fields
+    if isinstance(e, PayloadError):
+        print(f"❌ {e}")
+        return {"error": str(e)}, e.status, {}
+
+    if isinstance(e, json.JSONDecodeError):
+        print(f"❌ Invalid JSON payload : {e}")
+        return {"error": f"Invalid JSON payload : {e}"}, 400, {}
+
+    # Client or spreadsheet over its update budget, too many updates already waiting for it or for the whole server
+    if isinstance(e, RateLimitError):
+        print(f"❌ {e}")
+        return {"error": str(e)}, 429, retryAfterHeader(e)
+
+    # Same Idempotency-Key with another payload
+    if isinstance(e, IdempotencyError):
+        print(f"❌ {e}")
+        return {"error": str(e)}, 422, {}
+
+    traceback.print_exception(e)
+
+    # Google Sheets still unavailable after retries : tell the client when to come back
+    if isinstance(e, UploadError) and e.status == 429:
+        return {"error": str(e)}, 429, {"Retry-After": e.retryAfter or str(int(UPLOAD_MAX_BACKOFF))}
+
+    return {"error": str(e)}, 502 if isinstance(e, UploadError) else 500, {}
+
+# Answer of a fan-out target that failed, with the status its own /updateRun call would have got
+def targetError(e):
+    body, status, headers = errorAnswer(e)
+
+    if "Retry-After" in headers:
+        return {"status": status, **body, "retryAfter": int(headers["Retry-After"])}
+
+    return {"status": status, **body}
+
+# Status of a fan-out update : 200 (or 202 in async mode) when every target succeeded, else 207 with the status of each target
+def targetsStatus(targetResults, successStatus):
+    return successStatus if all(targetResult["status"] == successStatus for targetResult in targetResults) else 207
+
+
+# (body, status, headers) answer sent as JSON
+def jsonAnswer(body, status, headers):
+    return jsonify(body), status, headers
+
+# Process the update on the spreadsheet lane, after the updates already queued for it
+def startJob(spreadsheetId, sheetId, updatedData, fullData, lang, cardCache):
+    job = UpdateJob(spreadsheetId)
+    future = dispatcher.submit(spreadsheetId, profiler.follow(g.get("profile"), job.run), processUpdate, spreadsheetId, sheetId, updatedData, fullData, lang, cardCache)
+    registerJob(job)
+    return future, job
 
 # Update each provided run and caught Pokemon
 @flaskApp.route("/updateRun", methods = ["POST"])
 def updateRun():
-    requests = []
-    
+    arrivedAt = time.time()
+
     try:
-        # Convert provided data to JSON
-        data = request.get_json()
+        text, data = readUpdate(request, request.get_data(), arrivedAt)
 
-        # No data received
-        if not data:
-            return jsonify({"error": "No data received"}), 400
-        
-        # Outdated parameters
-        if containsOutdatedKeys(data):
-            return jsonify({"error": "Outdated version : please download the latest RunAndBunDisplay version https://github.com/Sykless/RunAndBunDisplay/releases"}), 400
-
-        # Missing required fields
-        missingKey = missingMandatoryKeys(data)
-        if missingKey:
-            return jsonify({"error": f"Missing required fields : {missingKey}"}), 400
-        
-        spreadsheetId = data["keys"]["spreadsheetId"]
-        sheetId = data["keys"]["sheetId"]
-        updatedData = data["updatedData"]["runs"]
-        fullData = data["fullData"]["runs"]
-        lang = data["lang"]
+        if "targets" in data:
+            submitted = submitTargets(data, request, hashPayload(text), startJob)
 
-        # Iterate on each updated run and update run/pokemon cards
-        for runId, run in updatedData.items():
+            if isAsyncMode(request):
+                return jsonAnswer(*targetJobsAnswer(submitted))
 
-            # Search for runId to find runCardId
-            runCardId = getRunCardId(runId, spreadsheetId)
+            results = []
 
-            # No run found : create the new run
-            if (runCardId == -1):
-                runCardId = 0
+            for spreadsheetId, future, job, replayed, error in submitted:
+                try:
+                    results.append(future.result() if error is None else None)
 
-                # Insert a new run card
-                generateRunCard(requests, sheetId, runId, fullData[runId]["runData"], lang)
+                except Exception as e:
+                    results.append(e)
 
-                # Insert a Pokémon card for each zone
-                for i in range(len(ZONES)):
-                    zone = ZONES[i]
-                    pokemon = fullData[runId]["pokemonData"][zone] if zone in fullData[runId]["pokemonData"] else None
+            return jsonAnswer(*targetsAnswer(submitted, results))
 
-                    # Generate a Pokémon card with Pokémon data if provided
-                    generatePokemonCard(requests, sheetId, pokemon, zone, 0, i, lang)
+        future, job, replayed = submitUpdate(data["keys"]["spreadsheetId"], data["keys"]["sheetId"], data["lang"], data["updatedData"]["runs"],
+                                             data.get("fullData", {}).get("runs"), request, hashPayload(text), startJob)
 
-            # RunId found : update row
-            else:
+        if isAsyncMode(request):
+            return jsonAnswer(*jobAnswer(job, replayed))
+
+        return jsonAnswer(*updateAnswer(future.result(), replayed))
 
-                # If runData has parameters to update, update them
-                if (run["runData"]):
-                    updateRunCard(requests, sheetId, runCardId, run["runData"])
+    except Exception as e:
+        return jsonAnswer(*errorAnswer(e))
 
-                # Iterate on each Pokémon and update cards
-                for zone, pokemon in run["pokemonData"].items():
 
-                    # Calculate pokemon card id from zone order (0 : first card)
-                    pokemonCardId = ZONES.index(zone)
+# Status of an update job
+@flaskApp.route("/jobs/<jobId>", methods = ["GET"])
+def getJob(jobId):
+    with jobsLock:
+        job = jobs.get(jobId)
 
-                    # Update/create Pokémon card with provided Pokémon data
-                    generatePokemonCard(requests, sheetId, pokemon, zone, runCardId, pokemonCardId, lang)
+    if not job:
+        return jsonify({"error": f"Unknown job {jobId}"}), 404
 
-        # Execute the requests divided into chunks
-        for chunkStart in range(0, len(requests), UPLOAD_BATCH_SIZE):
-            chunk = requests[chunkStart : chunkStart + UPLOAD_BATCH_SIZE]
+    return jsonify(job.describe()), 200
 
-            # Upload requests to Google Sheets API
-            reponse = sheetsService.spreadsheets().batchUpdate(
-                spreadsheetId = spreadsheetId,
-                body = {"requests": chunk}).execute()
 
-        # Return success
-        return jsonify({"message": "Data received successfully"}), 200
+# Cross-run statistics of a spreadsheet
+@flaskApp.route("/stats/<spreadsheetId>", methods = ["GET"])
+def getStats(spreadsheetId):
+    return jsonify(getRunStats(spreadsheetId).describe()), 200
 
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+# Build the statistics again from the stored runs
+@flaskApp.route("/stats/<spreadsheetId>/rebuild", methods = ["POST"])
+def rebuildStats(spreadsheetId):
+    runStats = getRunStats(spreadsheetId)
+    runStats.rebuild()
+    return jsonify(runStats.describe()), 200
+
+
+# Profiles kept by the sampling profiler, newest first
+@flaskApp.route("/profiles", methods = ["GET"])
+def getProfiles():
+    return jsonify({"profiles": profiler.describe()}), 200
+
+# Folded stacks of a profile, for flamegraph.pl, speedscope or inferno
+@flaskApp.route("/profiles/<profileId>", methods = ["GET"])
+def getProfile(profileId):
+    profile = profiler.read(profileId)
+
+    if profile is None:
+        return jsonify({"error": f"Unknown profile {profileId}"}), 404
+
+    return profile, 200, {"Content-Type": "text/plain; charset=utf-8", "Content-Disposition": f'attachment; filename="{profileId}.folded"'}
+
+
+# Prometheus metrics
+@flaskApp.route("/metrics", methods = ["GET"])
+def getMetrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
 
 # Start server
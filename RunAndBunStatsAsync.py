@@ -0,0 +1,405 @@
+from google.auth import default
+from google_auth_httplib2 import Request as AuthorizedRequest
+from googleapiclient.errors import HttpError
+from quart import Quart, request, jsonify, g
+from urllib.parse import quote
+import asyncio
+import httplib2
+import httpx
+import json
+import time
+import os
+
+from RunAndBunStats import (RUN_TEMPLATES, DISPATCH_MAX_QUEUE_DEPTH, DISPATCH_MAX_PENDING, getRunIndex,
+                            runTemplates, compileCheckedUpdate, validateUpdate, validateNewRuns, recordUpdate, SPRITE_MODE, spriteCache,
+                            archiveLimit, listArchiveSheets, archiveColumnRange, QueueFullError, hashPayload, getRunStats, profiler, UpdateJob, registerJob,
+                            jobs, jobsLock, getUpdateJournal, resumableRequests, failUpdate, finishUpdate, isAsyncMode, authorizeRequest, readUpdate,
+                            submitUpdate, submitTargets, jobAnswer, updateAnswer, targetJobsAnswer, targetsAnswer, errorAnswer)
+from RunAndBunMetrics import metrics
+from RunAndBunUpload import SHEETS_TIMEOUT, SheetsUploader
+
+# asyncio serving mode of RunAndBunStats : same routes and cards, but updates wait for Google without holding a thread
+# Google Sheets REST calls share one HTTP/2 connection pool, run with :
+#
+#   hypercorn RunAndBunStatsAsync:asyncApp --bind 0.0.0.0:8080
+
+SHEETS_API_URL = "https://sheets.googleapis.com/v4/spreadsheets/"
+SHEETS_MAX_CONNECTIONS = int(os.getenv("SHEETS_MAX_CONNECTIONS", 20))
+
+asyncApp = Quart(__name__)
+
+
+# Google Sheets REST client on httpx, failing with the same HttpError as googleapiclient
+class AsyncSheetsClient:
+    def __init__(self):
+        self.client = None
+        self.credentials = None
+        self.credentialsLock = asyncio.Lock()
+
+    async def authorize(self, headers):
+        async with self.credentialsLock:
+            if self.credentials is None:
+                self.credentials, project = default(scopes = ['https://www.googleapis.com/auth/spreadsheets'])
+
+            # Token shared by every call, refreshed once shortly before it expires
+            if not self.credentials.valid:
+                await asyncio.to_thread(self.credentials.refresh, AuthorizedRequest(httplib2.Http(timeout = SHEETS_TIMEOUT)))
+
+        self.credentials.apply(headers)
+        return headers
+
+    async def call(self, method, httpMethod, url, **kwargs):
+        if self.client is None:
+            self.client = httpx.AsyncClient(http2 = True, timeout = SHEETS_TIMEOUT,
+                                            limits = httpx.Limits(max_connections = SHEETS_MAX_CONNECTIONS, max_keepalive_connections = SHEETS_MAX_CONNECTIONS))
+
+        metrics.increment("runandbun_sheets_calls_total", {"method": method})
+
+        try:
+            with metrics.timer("runandbun_sheets_call_seconds", {"method": method}):
+                response = await self.client.request(httpMethod, url, headers = await self.authorize({"Content-Type": "application/json"}), **kwargs)
+
+        except httpx.TransportError:
+            metrics.increment("runandbun_sheets_errors_total", {"method": method, "status": "timeout"})
+            raise
+
+        if response.status_code >= 400:
+            metrics.increment("runandbun_sheets_errors_total", {"method": method, "status": response.status_code})
+            headers = {"status": response.status_code}
+
+            if "retry-after" in response.headers:
+                headers["retry-after"] = response.headers["retry-after"]
+
+            raise HttpError(httplib2.Response(headers), response.content, uri = url)
+
+        return response.json()
+
+    async def batchUpdate(self, spreadsheetId, requests):
+        return await self.call("batchUpdate", "POST", f"{SHEETS_API_URL}{quote(spreadsheetId)}:batchUpdate",
+                               content = json.dumps({"requests": requests}, separators = (",", ":")))
+
+    async def getValues(self, spreadsheetId, range, **params):
+        return await self.call("values.get", "GET", f"{SHEETS_API_URL}{quote(spreadsheetId)}/values/{quote(range)}", params = params)
+
+    async def batchGetValues(self, spreadsheetId, ranges, **params):
+        return await self.call("values.batchGet", "GET", f"{SHEETS_API_URL}{quote(spreadsheetId)}/values:batchGet", params = dict(params, ranges = ranges))
+
+    async def getSheets(self, spreadsheetId):
+        return await self.call("get", "GET", f"{SHEETS_API_URL}{quote(spreadsheetId)}", params = {"fields": "sheets.properties(sheetId,title)"})
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+sheetsClient = AsyncSheetsClient()
+
+
+# Same chunks, retries and write quotas as SheetsUploader, waiting with asyncio.sleep
+class AsyncSheetsUploader(SheetsUploader):
+    async def upload(self, spreadsheetId, requests, acknowledge = None):
+        steps = self.uploadSteps(spreadsheetId, requests, acknowledge)
+        answer = None
+
+        try:
+            while True:
+                action, value = steps.send(answer)
+
+                if action == "wait":
+                    await asyncio.sleep(value)
+                    answer = None
+                else:
+                    answer = await self.send(spreadsheetId, value)
+
+        except StopIteration as done:
+            return done.value
+
+    # One batchUpdate call : None once applied, else (status, retryAfter, message)
+    async def send(self, spreadsheetId, chunk):
+        try:
+            await sheetsClient.batchUpdate(spreadsheetId, chunk)
+            return None
+
+        except HttpError as e:
+            return e.resp.status, e.resp.get("retry-after"), str(e)
+
+        except httpx.TransportError as e:
+            return 504, None, str(e)
+
+uploader = AsyncSheetsUploader()
+
+
+# One update at a time per spreadsheet, in arrival order, with at most DISPATCH_MAX_QUEUE_DEPTH waiting
+spreadsheetLocks = {}
+pendingUpdates = {}
+
+# Checked, recorded in the run store, compiled and journaled : the requests to upload
+def prepareUpdate(spreadsheetId, sheetId, updatedData, fullData, lang, sheets, sprites, cardCache):
+    validateUpdate(spreadsheetId, updatedData, fullData)
+    fullData = recordUpdate(spreadsheetId, updatedData, fullData)
+    validateNewRuns(spreadsheetId, updatedData, fullData)
+    requests, pushedSnapshots = compileCheckedUpdate(spreadsheetId, sheetId, updatedData, fullData, lang, sheets, sprites, cardCache)
+    getUpdateJournal(spreadsheetId).begin(requests, pushedSnapshots, getRunIndex(spreadsheetId).state(), not uploader.fitsOneChunk(spreadsheetId, requests))
+    return requests
+
+# Whether a run card of the updated known runs moved since the index was built, checked with one read once the index is aged
+async def hasDrifted(spreadsheetId, runIndex, runIds):
+    if not runIndex.isAged() or not (ranges := runIndex.runIdRanges(runIds)):
+        return False
+
+    with metrics.timer("runandbun_phase_seconds", {"phase": "scan"}):
+        valueRanges = (await sheetsClient.batchGetValues(spreadsheetId, list(ranges.values()), valueRenderOption = "FORMULA")).get("valueRanges", [])
+
+    return runIndex.hasDrifted(ranges, valueRanges)
+
+async def processUpdate(spreadsheetId, sheetId, updatedData, fullData, lang, cardCache = None):
+    runIndex = getRunIndex(spreadsheetId)
+    journal = getUpdateJournal(spreadsheetId)
+    lock = spreadsheetLocks.setdefault(spreadsheetId, asyncio.Lock())
+    pendingUpdates[spreadsheetId] = pendingUpdates.get(spreadsheetId, 0) + 1
+    queuedAt = time.time()
+
+    try:
+        async with lock:
+            metrics.observe("runandbun_phase_seconds", time.time() - queuedAt, {"phase": "queue"})
+
+            # Finish the update that failed midway first, the sheet layout is only known once it is applied
+            if (remainingRequests := resumableRequests(spreadsheetId)) is not None:
+                try:
+                    with metrics.timer("runandbun_phase_seconds", {"phase": "upload"}):
+                        await uploader.upload(spreadsheetId, remainingRequests, journal.acknowledge)
+
+                except Exception as e:
+                    await asyncio.to_thread(failUpdate, spreadsheetId, e)
+                    raise
+
+                await asyncio.to_thread(finishUpdate, spreadsheetId)
+                metrics.increment("runandbun_journal_updates_total", {"outcome": "resumed"})
+
+            # Read column B only if a runId is unknown, the index is invalidated or a known run card moved
+            if runIndex.needsRebuild(updatedData.keys()) or await hasDrifted(spreadsheetId, runIndex, updatedData.keys()):
+                with metrics.timer("runandbun_phase_seconds", {"phase": "scan"}):
+                    column = (await sheetsClient.getValues(spreadsheetId, "B:B", valueRenderOption = "FORMULA")).get("values", [])
+                    archiveColumns = []
+
+                    # Archived runs must be known too, or their next update would create a new run card
+                    if archiveLimit():
+                        for title in listArchiveSheets((await sheetsClient.getSheets(spreadsheetId)).get("sheets", [])):
+                            archiveColumns.append((await sheetsClient.getValues(spreadsheetId, archiveColumnRange(title))).get("values", []))
+
+                runIndex.rebuild(column, archiveColumns)
+
+            # New run card from a template never looked up : check if the spreadsheet already has it
+            sheets = None
+            if RUN_TEMPLATES and not runTemplates.isKnown(spreadsheetId, lang) and any(runIndex.get(runId) == -1 for runId in updatedData):
+                sheets = (await sheetsClient.getSheets(spreadsheetId)).get("sheets", [])
+
+            # Sprites sheet read again when expired
+            sprites = None
+            if SPRITE_MODE == "resolved":
+                spriteRows = None
+
+                if spriteCache.needsRefresh(spreadsheetId):
+                    try:
+                        spriteRows = (await sheetsClient.getValues(spreadsheetId, "Sprites!A:B", valueRenderOption = "FORMULA")).get("values", [])
+
+                    # No Sprites sheet : every sprite stays a VLOOKUP formula
+                    except HttpError as e:
+                        if e.resp.status != 400:
+                            raise
+
+                        spriteRows = []
+
+                sprites = spriteCache.get(spreadsheetId, spriteRows)
+
+            # Run store, compilation and journal in a thread : the other updates keep going meanwhile
+            requests = await asyncio.to_thread(prepareUpdate, spreadsheetId, sheetId, updatedData, fullData, lang, sheets, sprites, cardCache)
+
+            try:
+                # Upload requests to Google Sheets API, divided into chunks
+                with metrics.timer("runandbun_phase_seconds", {"phase": "upload"}):
+                    uploadStats = await uploader.upload(spreadsheetId, requests, journal.acknowledge)
+
+            except Exception as e:
+                await asyncio.to_thread(failUpdate, spreadsheetId, e)
+                raise
+
+            await asyncio.to_thread(finishUpdate, spreadsheetId)
+
+        return uploadStats
+
+    finally:
+        pendingUpdates[spreadsheetId] -= 1
+
+        if not pendingUpdates[spreadsheetId]:
+            del pendingUpdates[spreadsheetId]
+            del spreadsheetLocks[spreadsheetId]
+
+
+# Webapp root
+@asyncApp.route("/", methods=["GET"])
+async def home():
+    return "Run&BunStats en cours d'exécution..."
+
+
+# Check password on protected routes, and the update budget of the client
+@asyncApp.before_request
+async def require_auth():
+    refused = authorizeRequest(request)
+
+    if refused is not None:
+        return jsonAnswer(*refused)
+
+    # Samples of the event loop thread : they include the other updates running meanwhile
+    if request.path == "/updateRun":
+        g.profile = profiler.start(request.headers.get("X-Profile") == "true")
+
+
+# Count /updateRun answers by status
+@asyncApp.after_request
+async def countUpdates(response):
+    if request.path == "/updateRun":
+        metrics.increment("runandbun_updates_total", {"status": response.status_code})
+
+    return response
+
+# End of a profiled update, even on an unexpected error
+@asyncApp.teardown_request
+async def stopProfile(exception):
+    profile = g.pop("profile", None)
+
+    if profile is not None:
+        profiler.stop(profile)
+
+
+# Refuse an update when too many updates already wait for the spreadsheet or the whole server
+def checkQueues(spreadsheetId):
+    if pendingUpdates.get(spreadsheetId, 0) >= DISPATCH_MAX_QUEUE_DEPTH:
+        metrics.increment("runandbun_updates_rejected_total", {"reason": "queue"})
+        raise QueueFullError(f"Too many pending updates for spreadsheet {spreadsheetId}")
+
+    # Whole server busy : shed the update instead of queueing work that could not finish in time
+    pending = sum(pendingUpdates.values())
+
+    if pending >= DISPATCH_MAX_PENDING:
+        metrics.increment("runandbun_updates_rejected_total", {"reason": "overload"})
+        raise QueueFullError(f"Server busy : {pending} updates pending")
+
+
+# Update task followed by its job, running even if the client disconnects so a retry or /jobs/<id> can wait for it
+def startJobTask(spreadsheetId, update):
+    job = UpdateJob(spreadsheetId)
+
+    async def runJob():
+        job.start()
+
+        try:
+            return job.finish(await update)
+
+        except Exception as e:
+            job.fail(e)
+            raise
+
+    task = asyncio.ensure_future(runJob())
+
+    # Failures of async mode jobs are reported by /jobs/<id>, not by asyncio
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    registerJob(job)
+    return task, job
+
+def startTask(spreadsheetId, sheetId, updatedData, fullData, lang, cardCache):
+    checkQueues(spreadsheetId)
+    return startJobTask(spreadsheetId, processUpdate(spreadsheetId, sheetId, updatedData, fullData, lang, cardCache))
+
+# (body, status, headers) answer sent as JSON
+def jsonAnswer(body, status, headers):
+    return jsonify(body), status, headers
+
+
+# Update each provided run and caught Pokemon
+@asyncApp.route("/updateRun", methods = ["POST"])
+async def updateRun():
+    arrivedAt = time.time()
+
+    try:
+        text, data = readUpdate(request, await request.get_data(), arrivedAt)
+
+        # Fan-out update : one task per target spreadsheet, uploading concurrently
+        if "targets" in data:
+            submitted = submitTargets(data, request, hashPayload(text), startTask)
+
+            if isAsyncMode(request):
+                return jsonAnswer(*targetJobsAnswer(submitted))
+
+            results = await asyncio.gather(*[asyncio.shield(task) if task else asyncio.sleep(0) for spreadsheetId, task, job, replayed, error in submitted],
+                                           return_exceptions = True)
+            return jsonAnswer(*targetsAnswer(submitted, results))
+
+        task, job, replayed = submitUpdate(data["keys"]["spreadsheetId"], data["keys"]["sheetId"], data["lang"], data["updatedData"]["runs"],
+                                           data.get("fullData", {}).get("runs"), request, hashPayload(text), startTask)
+
+        if isAsyncMode(request):
+            return jsonAnswer(*jobAnswer(job, replayed))
+
+        return jsonAnswer(*updateAnswer(await asyncio.shield(task), replayed))
+
+    except Exception as e:
+        return jsonAnswer(*errorAnswer(e))
+
+
+# Status of an update job
+@asyncApp.route("/jobs/<jobId>", methods = ["GET"])
+async def getJob(jobId):
+    with jobsLock:
+        job = jobs.get(jobId)
+
+    if not job:
+        return jsonify({"error": f"Unknown job {jobId}"}), 404
+
+    return jsonify(job.describe()), 200
+
+
+# Cross-run statistics of a spreadsheet, built from the stored runs in a thread on first use
+@asyncApp.route("/stats/<spreadsheetId>", methods = ["GET"])
+async def getStats(spreadsheetId):
+    return jsonify(await asyncio.to_thread(getRunStats(spreadsheetId).describe)), 200
+
+# Build the statistics again from the stored runs
+@asyncApp.route("/stats/<spreadsheetId>/rebuild", methods = ["POST"])
+async def rebuildStats(spreadsheetId):
+    runStats = getRunStats(spreadsheetId)
+    await asyncio.to_thread(runStats.rebuild)
+    return jsonify(runStats.describe()), 200
+
+
+# Profiles kept by the sampling profiler, newest first
+@asyncApp.route("/profiles", methods = ["GET"])
+async def getProfiles():
+    return jsonify({"profiles": profiler.describe()}), 200
+
+# Folded stacks of a profile, for flamegraph.pl, speedscope or inferno
+@asyncApp.route("/profiles/<profileId>", methods = ["GET"])
+async def getProfile(profileId):
+    profile = await asyncio.to_thread(profiler.read, profileId)
+
+    if profile is None:
+        return jsonify({"error": f"Unknown profile {profileId}"}), 404
+
+    return profile, 200, {"Content-Type": "text/plain; charset=utf-8", "Content-Disposition": f'attachment; filename="{profileId}.folded"'}
+
+
+# Prometheus metrics
+@asyncApp.route("/metrics", methods = ["GET"])
+async def getMetrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@asyncApp.after_serving
+async def closeSheetsClient():
+    await sheetsClient.close()
+
+
+# Start server
+if __name__ == "__main__":
+    asyncApp.run(host = "0.0.0.0", port = int(os.environ.get("PORT", 8080)))
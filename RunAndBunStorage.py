@@ -0,0 +1,307 @@
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import copy
+import re
+import os
+from collections.abc import Mapping
+
+# State of RunAndBunStats kept on disk : run snapshots, the run store and the update journals
+
+# Last pushed state of each run persistence (empty directory : memory only)
+SNAPSHOT_DIRECTORY = os.getenv("SNAPSHOT_DIRECTORY", "")
+
+# Journal of the compiled requests of each update and of the chunks acknowledged by Google (empty directory : memory only)
+# Only updates uploaded in several chunks are written, a single chunk is either fully applied or not at all
+JOURNAL_DIRECTORY = os.getenv("JOURNAL_DIRECTORY", "")
+
+def safeFileName(name):
+    return re.sub(r"[^A-Za-z0-9_-]", "_", name)
+
+# File name of a run snapshot : runIds changed by safeFileName get a hash suffix, so "a:1" and "a_1" never share a file
+def snapshotFileName(runId):
+    fileName = safeFileName(runId)
+    return fileName if fileName == runId else f"{fileName}-{hashlib.sha256(runId.encode("utf-8")).hexdigest()[:16]}"
+
+
+# Last state pushed to the sheet for each run of a spreadsheet, so updates only send what changed
+# A snapshot only contains the run parameters and zones known to be displayed in the sheet
+class RunSnapshots:
+    def __init__(self, spreadsheetId):
+        self.spreadsheetId = spreadsheetId
+        self.snapshots = {}
+
+    def path(self, runId):
+        if not SNAPSHOT_DIRECTORY:
+            return None
+
+        return os.path.join(SNAPSHOT_DIRECTORY, safeFileName(self.spreadsheetId), snapshotFileName(runId) + ".json")
+
+    # Snapshot file content with the runId it belongs to, None if unreadable
+    def read(self, path):
+        try:
+            with open(path, encoding = "utf-8") as snapshotFile:
+                content = json.load(snapshotFile)
+
+            return content.pop("runId", None), content
+
+        except (OSError, ValueError, AttributeError):
+            print(f"❌ Unreadable snapshot {path}, the run will be fully updated")
+            return None, None
+
+    # Return a copy of the run snapshot, or an empty snapshot if nothing is known about the run
+    # A file written for another runId with the same file name, or by a former version without runId, is not trusted
+    def get(self, runId, lang):
+        path = self.path(runId)
+
+        if runId not in self.snapshots and path and os.path.exists(path):
+            fileRunId, snapshot = self.read(path)
+
+            if fileRunId == runId:
+                self.snapshots[runId] = snapshot
+
+        snapshot = copy.deepcopy(self.snapshots.get(runId, {"lang": lang, "runData": {}, "pokemonData": {}}))
+
+        # Labels are translated : Pokémon cards pushed in another language must be regenerated
+        if snapshot["lang"] != lang:
+            snapshot["lang"] = lang
+            snapshot["pokemonData"] = {}
+
+        return snapshot
+
+    def put(self, runId, snapshot):
+        self.snapshots[runId] = snapshot
+
+        path = self.path(runId)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+
+            with open(path + ".tmp", "w", encoding = "utf-8") as snapshotFile:
+                json.dump({"runId": runId, **snapshot}, snapshotFile)
+
+            os.replace(path + ".tmp", path)
+
+    # Every snapshot in memory or on disk, by the runId stored in its file
+    def items(self):
+        snapshots = dict(self.snapshots)
+        directory = os.path.dirname(self.path("")) if SNAPSHOT_DIRECTORY else None
+
+        if directory and os.path.isdir(directory):
+            for fileName in os.listdir(directory):
+                if fileName.endswith(".json"):
+                    runId, snapshot = self.read(os.path.join(directory, fileName))
+
+                    if runId is not None and runId not in snapshots:
+                        snapshots[runId] = snapshot
+
+        return snapshots.items()
+
+    def discard(self, runId):
+        self.snapshots.pop(runId, None)
+
+        path = self.path(runId)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+
+# Every run sent by the clients, merged update after update : runData parameters and one Pokémon per zone
+class RunStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs (spreadsheetId TEXT, runId TEXT, runData TEXT, updatedAt REAL, PRIMARY KEY (spreadsheetId, runId))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS pokemon (spreadsheetId TEXT, runId TEXT, zone TEXT, pokemon TEXT, PRIMARY KEY (spreadsheetId, runId, zone))")
+
+    # Merge the updated runs in a single transaction, runs unknown to the store start from fullData when provided
+    def merge(self, spreadsheetId, updatedData, fullData = None):
+        with self.lock:
+            self.connection.execute("BEGIN")
+
+            try:
+                for runId, run in updatedData.items():
+                    row = self.connection.execute("SELECT runData FROM runs WHERE spreadsheetId = ? AND runId = ?", (spreadsheetId, runId)).fetchone()
+                    runData = json.loads(row[0]) if row else {}
+                    pokemonData = dict(run["pokemonData"])
+
+                    if row is None and fullData and runId in fullData:
+                        runData = dict(fullData[runId]["runData"])
+                        pokemonData = dict(fullData[runId]["pokemonData"], **pokemonData)
+
+                    runData.update(run["runData"])
+
+                    self.connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)", (spreadsheetId, runId, json.dumps(runData), time.time()))
+                    self.connection.executemany("INSERT OR REPLACE INTO pokemon VALUES (?, ?, ?, ?)",
+                                                [(spreadsheetId, runId, zone, json.dumps(pokemon)) for zone, pokemon in pokemonData.items()])
+
+                self.connection.execute("COMMIT")
+
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    # Full run as sent in fullData, None if unknown
+    def get(self, spreadsheetId, runId):
+        with self.lock:
+            row = self.connection.execute("SELECT runData FROM runs WHERE spreadsheetId = ? AND runId = ?", (spreadsheetId, runId)).fetchone()
+
+            if row is None:
+                return None
+
+            pokemonRows = self.connection.execute("SELECT zone, pokemon FROM pokemon WHERE spreadsheetId = ? AND runId = ?", (spreadsheetId, runId)).fetchall()
+
+        return {"runData": json.loads(row[0]), "pokemonData": {zone: json.loads(pokemon) for zone, pokemon in pokemonRows}}
+
+    def runIds(self, spreadsheetId):
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT runId FROM runs WHERE spreadsheetId = ? ORDER BY updatedAt", (spreadsheetId,))]
+
+
+# Runs of a spreadsheet read from the store, used as fullData
+class StoredRuns(Mapping):
+    def __init__(self, runStore, spreadsheetId):
+        self.runStore = runStore
+        self.spreadsheetId = spreadsheetId
+        self.runs = {}
+
+    def __getitem__(self, runId):
+        if runId not in self.runs:
+            run = self.runStore.get(self.spreadsheetId, runId)
+
+            if run is None:
+                raise KeyError(runId)
+
+            self.runs[runId] = run
+
+        return self.runs[runId]
+
+    def __iter__(self):
+        return iter(self.runStore.runIds(self.spreadsheetId))
+
+    def __len__(self):
+        return len(self.runStore.runIds(self.spreadsheetId))
+
+
+# Write-ahead journal of the update being uploaded to a spreadsheet : compiled requests, pushed snapshots and run index once applied,
+# then one line per chunk acknowledged by Google and one "failed" line per failed attempt, so an update failing midway is resumed
+# instead of compiled and inserted again, even after a restart
+# Updates fitting in one chunk stay in memory, their journal is only written if their chunk is split and partly applied
+# The journal is deleted once every chunk is acknowledged (a chunk whose answer was lost is sent again)
+class UpdateJournal:
+    def __init__(self, spreadsheetId):
+        self.spreadsheetId = spreadsheetId
+        self.requests = None
+        self.snapshots = None
+        self.index = None
+        self.acknowledged = 0
+        self.attempts = 0
+        self.persisted = False
+        self.unreadable = False
+        self.load()
+
+    def path(self):
+        if not JOURNAL_DIRECTORY:
+            return None
+
+        return os.path.join(JOURNAL_DIRECTORY, safeFileName(self.spreadsheetId) + ".json")
+
+    # Update left unfinished by a previous process, acknowledgments written after an unreadable line are lost (resent)
+    def load(self):
+        path = self.path()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding = "utf-8") as journalFile:
+                    content = json.load(journalFile)
+
+                self.requests, self.snapshots, self.index = content["requests"], content["snapshots"], content["index"]
+                self.persisted = True
+
+            except (OSError, ValueError, KeyError):
+                print(f"❌ Unreadable update journal {path}, the run index will be rebuilt")
+                self.persisted = True
+                self.discard()
+                self.unreadable = True
+                return
+
+            if os.path.exists(path + ".acks"):
+                with open(path + ".acks", encoding = "utf-8") as acksFile:
+                    for line in acksFile:
+                        if line.strip() == "failed":
+                            self.attempts += 1
+                        elif line.strip().isdigit():
+                            self.acknowledged += int(line)
+                        else:
+                            break
+
+    def pending(self):
+        return self.requests is not None
+
+    def remaining(self):
+        return self.requests[self.acknowledged:]
+
+    # persist : the upload takes several chunks, the journal is written before the first one is sent
+    def begin(self, requests, pushedSnapshots, index, persist = True):
+        self.requests, self.snapshots, self.index = requests, pushedSnapshots, index
+        self.acknowledged = 0
+        self.attempts = 0
+        self.persisted = False
+
+        if persist:
+            self.write()
+
+    def write(self):
+        path = self.path()
+
+        if path:
+            os.makedirs(JOURNAL_DIRECTORY, exist_ok = True)
+
+            with open(path + ".tmp", "w", encoding = "utf-8") as journalFile:
+                json.dump({"requests": self.requests, "snapshots": self.snapshots, "index": self.index, "createdAt": time.time()},
+                          journalFile, separators = (",", ":"))
+
+            with open(path + ".acks", "w", encoding = "utf-8") as acksFile:
+                acksFile.write((f"{self.acknowledged}\n" if self.acknowledged else "") + "failed\n" * self.attempts)
+
+            os.replace(path + ".tmp", path)
+            self.persisted = True
+
+    def appendLine(self, line):
+        path = self.path()
+
+        if path and self.persisted:
+            with open(path + ".acks", "a", encoding = "utf-8") as acksFile:
+                acksFile.write(f"{line}\n")
+
+    def acknowledge(self, count):
+        self.acknowledged += count
+
+        # Single chunk split after a failure : the update is now partly applied and must survive a restart
+        if not self.persisted and self.acknowledged < len(self.requests):
+            self.write()
+        else:
+            self.appendLine(count)
+
+    def fail(self):
+        self.attempts += 1
+        self.appendLine("failed")
+
+    # Update fully applied or given up : compacted away
+    def discard(self):
+        self.requests = self.snapshots = self.index = None
+        self.acknowledged = 0
+        self.attempts = 0
+        path = self.path()
+
+        if path and self.persisted:
+            for journalPath in [path, path + ".acks"]:
+                if os.path.exists(journalPath):
+                    os.remove(journalPath)
+
+        self.persisted = False
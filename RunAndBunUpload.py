@@ -0,0 +1,276 @@
+from google.auth import default
+from google_auth_httplib2 import AuthorizedHttp, Request as AuthorizedRequest
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+import httplib2
+import threading
+import json
+import time
+import random
+import os
+
+from RunAndBunMetrics import metrics
+
+# Google Sheets client and batchUpdate uploads of RunAndBunStats, shared by the backfill and the asyncio app
+
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", 200))
+UPLOAD_BATCH_BYTES = int(os.getenv("UPLOAD_BATCH_BYTES", 2_000_000))
+
+# Google Sheets API socket timeout in seconds
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", 60))
+
+# Upload retries (exponential backoff in seconds) and Google Sheets write quotas, in batchUpdate calls per minute
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", 5))
+UPLOAD_BASE_BACKOFF = float(os.getenv("UPLOAD_BASE_BACKOFF", 1))
+UPLOAD_MAX_BACKOFF = float(os.getenv("UPLOAD_MAX_BACKOFF", 32))
+PROJECT_WRITES_PER_MINUTE = int(os.getenv("PROJECT_WRITES_PER_MINUTE", 60))
+SPREADSHEET_WRITES_PER_MINUTE = int(os.getenv("SPREADSHEET_WRITES_PER_MINUTE", 30))
+
+# Google Sheets clients, built on first use so the module can be imported without credentials (offline benchmarks)
+# httplib2 is not thread-safe : each worker thread gets its own client and keep-alive connection, sharing the same credentials
+# The discovery document bundled with googleapiclient is parsed once, startup does no network fetch
+sheetsService = None  # Replaces every client when set (FakeSheetsService)
+sheetsClients = threading.local()
+sheetsDiscoveryDocument = None
+credentials = None
+credentialsLock = threading.Lock()
+
+def getSheetsService():
+    global sheetsDiscoveryDocument, credentials
+
+    if sheetsService is not None:
+        return sheetsService
+
+    with credentialsLock:
+        if credentials is None:
+            credentials, project = default(scopes = ['https://www.googleapis.com/auth/spreadsheets'])
+            sheetsDiscoveryDocument = json.loads(get_static_doc("sheets", "v4"))
+
+        # Token shared by every client, refreshed by one thread shortly before it expires
+        if not credentials.valid:
+            credentials.refresh(AuthorizedRequest(httplib2.Http(timeout = SHEETS_TIMEOUT)))
+
+    if getattr(sheetsClients, "service", None) is None:
+        http = AuthorizedHttp(credentials, http = httplib2.Http(timeout = SHEETS_TIMEOUT))
+        sheetsClients.service = build_from_document(sheetsDiscoveryDocument, http = http)
+
+    return sheetsClients.service
+
+
+# Execute a Google Sheets API call, counting it and its errors
+def executeSheetsCall(method, httpRequest):
+    metrics.increment("runandbun_sheets_calls_total", {"method": method})
+
+    try:
+        with metrics.timer("runandbun_sheets_call_seconds", {"method": method}):
+            return httpRequest.execute()
+
+    except HttpError as e:
+        metrics.increment("runandbun_sheets_errors_total", {"method": method, "status": e.resp.status})
+        raise
+
+    except (TimeoutError, ConnectionError):
+        metrics.increment("runandbun_sheets_errors_total", {"method": method, "status": "timeout"})
+        raise
+
+
+# Refilled at a steady rate, each batchUpdate takes one token : waiting callers get tokens in arrival order
+class TokenBucket:
+    def __init__(self, ratePerMinute):
+        self.rate = ratePerMinute / 60
+        self.capacity = max(1, ratePerMinute / 6)
+        self.tokens = self.capacity
+        self.updatedAt = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Reserve a token, sleep until it is available and return the time spent waiting
+    def acquire(self):
+        wait = self.reserve()
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+    # Reserve a token and return how long to wait before using it
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate) - 1
+            self.updatedAt = now
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    # Take a token if one is available and return 0, else return how long until one is, without waiting
+    def tryAcquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+            self.updatedAt = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+
+# Bytes a request adds to a batchUpdate chunk
+def requestSize(request):
+    return len(json.dumps(request, separators = (",", ":")))
+
+
+class UploadError(Exception):
+    def __init__(self, message, status, retryAfter = None):
+        super().__init__(message)
+        self.status = status
+        self.retryAfter = retryAfter
+
+
+# Upload request lists with batchUpdate calls :
+# - chunks are limited in requests and serialized bytes, the request limit shrinks when Google fails on large chunks
+# - 429, 5xx and network errors are retried with exponential backoff and jitter (batchUpdate is atomic, a failed chunk applied nothing)
+# - every call waits for a token of the spreadsheet bucket and of the project bucket, so quotas are never exceeded on our side
+# Chunks hold at most chunkSize requests and chunkBytes bytes, failing chunks are split in two
+# splitChunks False : every upload is a single call, refused before sending when it does not fit in one chunk
+class SheetsUploader:
+    def __init__(self, chunkSize = UPLOAD_BATCH_SIZE, chunkBytes = UPLOAD_BATCH_BYTES, splitChunks = True):
+        self.projectBucket = TokenBucket(PROJECT_WRITES_PER_MINUTE)
+        self.spreadsheetBuckets = {}
+        self.lock = threading.Lock()
+        self.chunkSize = chunkSize
+        self.chunkBytes = chunkBytes
+        self.splitChunks = splitChunks
+        self.chunkLimits = {}
+
+    def spreadsheetBucket(self, spreadsheetId):
+        with self.lock:
+            if spreadsheetId not in self.spreadsheetBuckets:
+                self.spreadsheetBuckets[spreadsheetId] = TokenBucket(SPREADSHEET_WRITES_PER_MINUTE)
+
+            return self.spreadsheetBuckets[spreadsheetId]
+
+    # Chunk size of each spreadsheet, lowered after a failed chunk : only spreadsheets below chunkSize are kept
+    def chunkLimit(self, spreadsheetId):
+        with self.lock:
+            return self.chunkLimits.get(spreadsheetId, self.chunkSize)
+
+    # Success : slowly get back to the configured chunk size
+    def growChunkLimit(self, spreadsheetId):
+        with self.lock:
+            if spreadsheetId in self.chunkLimits:
+                chunkLimit = self.chunkLimits[spreadsheetId] + max(1, self.chunkLimits[spreadsheetId] // 4)
+
+                if chunkLimit >= self.chunkSize:
+                    del self.chunkLimits[spreadsheetId]
+                else:
+                    self.chunkLimits[spreadsheetId] = chunkLimit
+
+    def shrinkChunkLimit(self, spreadsheetId, chunkLimit):
+        with self.lock:
+            self.chunkLimits[spreadsheetId] = max(1, min(self.chunkLimits.get(spreadsheetId, self.chunkSize), chunkLimit))
+
+    # Whether the requests are uploaded in a single call (unless it fails and is split)
+    def fitsOneChunk(self, spreadsheetId, requests):
+        return len(requests) <= 1 or (len(requests) <= self.chunkLimit(spreadsheetId) and sum(map(requestSize, requests)) <= self.chunkBytes)
+
+    # Chunks, write quotas, retries and backoff of an upload, shared by the sync and async uploaders which only supply the transport :
+    # yields ("wait", seconds) and ("send", chunk), each "send" answered with None once applied or (status, retryAfter, message) on failure
+    # acknowledge(count) is called once each chunk is applied, with its number of requests, the upload stats are returned at the end
+    def uploadSteps(self, spreadsheetId, requests, acknowledge):
+        stats = {"calls": 0, "requests": len(requests), "bytes": 0, "retries": 0, "throttledSeconds": 0, "backoffSeconds": 0}
+        requestSizes = [requestSize(request) for request in requests]
+        chunkStart = 0
+
+        if not self.splitChunks and len(requests) > 1 and (len(requests) > self.chunkLimit(spreadsheetId) or sum(requestSizes) > self.chunkBytes):
+            raise UploadError(f"{len(requests)} requests ({sum(requestSizes)} bytes) do not fit in a single batchUpdate call", 413)
+
+        while chunkStart < len(requests):
+
+            # Fill the chunk up to the request limit and the byte limit, with at least one request
+            chunkEnd, chunkBytes, chunkLimit = chunkStart + 1, requestSizes[chunkStart], self.chunkLimit(spreadsheetId)
+            while chunkEnd < len(requests) and chunkEnd - chunkStart < chunkLimit and chunkBytes + requestSizes[chunkEnd] <= self.chunkBytes:
+                chunkBytes += requestSizes[chunkEnd]
+                chunkEnd += 1
+
+            for attempt in range(UPLOAD_MAX_RETRIES + 1):
+
+                # Both tokens are reserved at once, the call waits for the last one
+                throttledSeconds = max(self.spreadsheetBucket(spreadsheetId).reserve(), self.projectBucket.reserve())
+                if throttledSeconds:
+                    yield "wait", throttledSeconds
+
+                metrics.increment("runandbun_upload_throttled_seconds_total", value = throttledSeconds)
+                stats["throttledSeconds"] += throttledSeconds
+                stats["calls"] += 1
+
+                failure = yield "send", requests[chunkStart : chunkEnd]
+
+                if failure is None:
+                    self.growChunkLimit(spreadsheetId)
+                    break
+
+                status, retryAfter, message = failure
+
+                if status != 429 and status < 500:
+                    raise UploadError(f"Google Sheets API error {status} : {message}", status)
+
+                if attempt == UPLOAD_MAX_RETRIES:
+                    raise UploadError(f"Google Sheets API still failing after {UPLOAD_MAX_RETRIES} retries (status {status})", status, retryAfter)
+
+                # Server error or timeout on a large chunk : retry with half of it
+                if status != 429 and chunkEnd - chunkStart > 1 and self.splitChunks:
+                    chunkEnd = chunkStart + (chunkEnd - chunkStart) // 2
+                    self.shrinkChunkLimit(spreadsheetId, chunkEnd - chunkStart)
+
+                # Full jitter backoff, at least what Google asked for
+                backoff = random.uniform(0, min(UPLOAD_MAX_BACKOFF, UPLOAD_BASE_BACKOFF * 2 ** attempt))
+                if retryAfter and retryAfter.isdigit():
+                    backoff = max(backoff, int(retryAfter))
+
+                metrics.increment("runandbun_upload_retries_total")
+                stats["retries"] += 1
+                stats["backoffSeconds"] += backoff
+                yield "wait", backoff
+
+            if acknowledge is not None:
+                acknowledge(chunkEnd - chunkStart)
+
+            stats["bytes"] += sum(requestSizes[chunkStart : chunkEnd])
+            metrics.increment("runandbun_upload_requests_total", value = chunkEnd - chunkStart)
+            metrics.increment("runandbun_upload_bytes_total", value = sum(requestSizes[chunkStart : chunkEnd]))
+            chunkStart = chunkEnd
+
+        if stats["throttledSeconds"] or stats["retries"]:
+            print(f"⏳ Upload to {spreadsheetId} throttled {stats["throttledSeconds"]:.1f}s, {stats["retries"]} retries ({stats["backoffSeconds"]:.1f}s backoff)")
+
+        return stats
+
+    def upload(self, spreadsheetId, requests, acknowledge = None):
+        steps = self.uploadSteps(spreadsheetId, requests, acknowledge)
+        answer = None
+
+        try:
+            while True:
+                action, value = steps.send(answer)
+
+                if action == "wait":
+                    time.sleep(value)
+                    answer = None
+                else:
+                    answer = self.send(spreadsheetId, value)
+
+        except StopIteration as done:
+            return done.value
+
+    # One batchUpdate call : None once applied, else (status, retryAfter, message)
+    def send(self, spreadsheetId, chunk):
+        try:
+            executeSheetsCall("batchUpdate", getSheetsService().spreadsheets().batchUpdate(spreadsheetId = spreadsheetId, body = {"requests": chunk}))
+            return None
+
+        except HttpError as e:
+            return e.resp.status, e.resp.get("retry-after"), str(e)
+
+        except (TimeoutError, ConnectionError) as e:
+            return 504, None, str(e)
@@ -0,0 +1,75 @@
+# Tests of the update pipeline against FakeSheetsService, no Google account needed : python -m pytest
+
+import random
+import sys
+import os
+
+# Settings read by the RunAndBun modules at import : no write quota, no inbound rate limit, no persisted state, known password
+os.environ.setdefault("PROJECT_WRITES_PER_MINUTE", "1000000")
+os.environ.setdefault("SPREADSHEET_WRITES_PER_MINUTE", "1000000")
+os.environ.setdefault("UPLOAD_BASE_BACKOFF", "0.01")
+os.environ["API_PASSWORD"] = "tests"
+os.environ["CLIENT_UPDATES_PER_MINUTE"] = "0"
+os.environ["SPREADSHEET_UPDATES_PER_MINUTE"] = "0"
+os.environ["RUN_INDEX_DIRECTORY"] = ""
+os.environ["SNAPSHOT_DIRECTORY"] = ""
+os.environ["JOURNAL_DIRECTORY"] = ""
+os.environ["RUN_STORE_PATH"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from FakeSheetsService import FakeSheetsService
+import RunAndBunBenchmark
+import RunAndBunLayout
+import RunAndBunStats
+
+SHEET_ID = RunAndBunBenchmark.SHEET_ID
+
+
+# Fresh fake spreadsheets and server state for each test
+@pytest.fixture
+def fake():
+    fakeService = FakeSheetsService(autoCreateSheets = True)
+    RunAndBunBenchmark.resetState(fakeService)
+    return fakeService
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+# Send an update to /updateRun, returns the response
+@pytest.fixture
+def post(fake):
+    client = RunAndBunStats.flaskApp.test_client()
+
+    # fullRuns None : protocol version 2 payload without fullData, other fields replace the payload ones
+    def post(spreadsheetId, updatedRuns, fullRuns, headers = {}, **fields):
+        payload = RunAndBunBenchmark.generatePayload(updatedRuns, fullRuns or {})
+        payload["keys"]["spreadsheetId"] = spreadsheetId
+        payload.update(fields)
+
+        if fullRuns is None:
+            del payload["fullData"]
+
+        return client.post("/updateRun", json = payload, headers = {"Authorization": f"Bearer {RunAndBunStats.API_PASSWORD}", **headers})
+
+    return post
+
+# Everything displayed on a sheet : values and formats of every visible cell, merges, row and column sizes
+# Cells hidden by a merge are not displayed, compacted requests may leave them untouched
+def sheetGrid(fakeService, spreadsheetId, sheetId = SHEET_ID):
+    sheet = fakeService.spreadsheet(spreadsheetId).sheet(sheetId, True)
+    hiddenCells = sheet.hiddenCells()
+    cells = {cell: content for cell, content in sheet.cells.items() if cell not in hiddenCells}
+    return {"cells": cells, "merges": sheet.merges, "rowSizes": sheet.rowSizes, "columnSizes": sheet.columnSizes}
+
+# Run card title and runId of each card of a sheet, top to bottom
+def sheetCards(fakeService, spreadsheetId, sheetId = SHEET_ID):
+    cards = []
+
+    while runId := fakeService.cellValue(spreadsheetId, sheetId, RunAndBunLayout.RUN_CARD_HEIGHT * len(cards) + 7, 1):
+        cards.append((fakeService.cellValue(spreadsheetId, sheetId, RunAndBunLayout.RUN_CARD_HEIGHT * len(cards) + 2, 1), runId.removeprefix("RundId : ")))
+
+    return cards
@@ -0,0 +1,37 @@
+import RunAndBunBenchmark
+import RunAndBunLayout
+import RunAndBunStats
+
+from conftest import sheetCards, sheetGrid
+
+
+# Runs moved to the archive sheets are still updated in place, even once the run index is rebuilt from the sheets
+def testArchivedRunUpdatedInPlaceAfterRestart(fake, post, rng, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "ARCHIVE_MAX_RUNS", 4)
+    monkeypatch.setattr(RunAndBunStats, "ARCHIVE_BATCH_RUNS", 2)
+    monkeypatch.setattr(RunAndBunStats, "ARCHIVE_SHEET_RUNS", 3)
+
+    runs = {}
+    for i in range(10):
+        runs[f"run{i}"] = RunAndBunBenchmark.generateRun(rng, 3)
+        assert post("archives", {f"run{i}": runs[f"run{i}"]}, runs).status_code == 200
+
+    runIndex = RunAndBunStats.getRunIndex("archives")
+    archive, runCardId = runIndex.locate("run0")
+    assert archive is not None
+    liveCards = sheetCards(fake, "archives")
+    archiveSheetId = RunAndBunStats.getArchiveSheetId(archive)
+    archiveCards = sheetCards(fake, "archives", archiveSheetId)
+    layout = (dict(runIndex.stamps), list(runIndex.archives), runIndex.sequence)
+    assert sheetGrid(fake, "archives", archiveSheetId)["columnSizes"] == sheetGrid(fake, "archives")["columnSizes"]
+
+    # Restart : nothing known but the sheets
+    RunAndBunBenchmark.resetState(fake)
+    assert post("archives", {"run0": {"runData": {"wonBattles": "66"}, "pokemonData": {}}}, runs).status_code == 200
+
+    runIndex = RunAndBunStats.getRunIndex("archives")
+    assert (runIndex.stamps, runIndex.archives, runIndex.sequence) == layout
+    assert runIndex.locate("run0") == (archive, runCardId)
+    assert fake.cellValue("archives", archiveSheetId, RunAndBunLayout.RUN_CARD_HEIGHT * runCardId + 5, 5) == "66"
+    assert sheetCards(fake, "archives") == liveCards
+    assert sheetCards(fake, "archives", archiveSheetId) == archiveCards
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+import RunAndBunBenchmark
+import RunAndBunStats
+import RunAndBunStatsAsync
+
+from conftest import sheetGrid
+
+
+# AsyncSheetsClient calls answered by FakeSheetsService
+class FakeAsyncSheetsClient:
+    def __init__(self, fakeService):
+        self.fakeService = fakeService
+
+    async def batchUpdate(self, spreadsheetId, requests):
+        return self.fakeService.spreadsheets().batchUpdate(spreadsheetId = spreadsheetId, body = {"requests": requests}).execute()
+
+    async def getValues(self, spreadsheetId, range, **params):
+        return self.fakeService.spreadsheets().values().get(spreadsheetId = spreadsheetId, range = range, **params).execute()
+
+    async def batchGetValues(self, spreadsheetId, ranges, **params):
+        return self.fakeService.spreadsheets().values().batchGet(spreadsheetId = spreadsheetId, ranges = ranges, **params).execute()
+
+    async def getSheets(self, spreadsheetId):
+        return self.fakeService.spreadsheets().get(spreadsheetId = spreadsheetId).execute()
+
+    async def close(self):
+        pass
+
+@pytest.fixture
+def asyncPost(fake, monkeypatch):
+    monkeypatch.setattr(RunAndBunStatsAsync, "sheetsClient", FakeAsyncSheetsClient(fake))
+    client = RunAndBunStatsAsync.asyncApp.test_client()
+    headers = {"Authorization": f"Bearer {RunAndBunStats.API_PASSWORD}"}
+
+    # Other fields replace the payload ones, after fullData as the members are not sorted
+    async def post(spreadsheetId, updatedRuns, fullRuns, path = "/updateRun", **fields):
+        payload = RunAndBunBenchmark.generatePayload(updatedRuns, fullRuns)
+        payload["keys"]["spreadsheetId"] = spreadsheetId
+        payload.update(fields)
+        response = await client.post(path, json = payload, headers = headers)
+        return response.status_code, response.headers, await response.get_json()
+
+    async def get(path):
+        response = await client.get(path, headers = headers)
+        return response.status_code, await response.get_json()
+
+    post.get = get
+    return post
+
+
+# Async mode : 202 with the job location right away, the job then runs to done like a synchronous update would
+def testAsyncModeJobLifecycle(fake, post, asyncPost, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 4)}
+
+    async def scenario():
+        status, headers, body = await asyncPost("asyncJob", runs, runs, "/updateRun?async=true")
+        assert (status, body["status"]) == (202, "queued")
+        assert headers["Location"] == f"/jobs/{body['jobId']}"
+
+        while (job := (await asyncPost.get(headers["Location"]))[1])["status"] in ["queued", "running"]:
+            await asyncio.sleep(0.01)
+
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert job["status"] == "done"
+    assert job["result"]["calls"] >= 1
+    assert post("syncJob", runs, runs).status_code == 200
+    assert sheetGrid(fake, "asyncJob") == sheetGrid(fake, "syncJob")
+
+# A refused update fails its job, reported by /jobs/<id>
+def testAsyncModeFailedJob(fake, asyncPost, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 4)}
+    fake.scheduleErrors(400, methods = ["batchUpdate"])
+
+    async def scenario():
+        status, headers, body = await asyncPost("asyncFailed", runs, runs, "/updateRun?async=true")
+
+        while (job := (await asyncPost.get(headers["Location"]))[1])["status"] in ["queued", "running"]:
+            await asyncio.sleep(0.01)
+
+        return status, job, await asyncPost.get("/jobs/unknown")
+
+    status, job, unknown = asyncio.run(scenario())
+
+    assert status == 202
+    assert (job["status"], job["error"]["status"]) == ("failed", 400)
+    assert unknown[0] == 404
+
+# Fan-out through the asyncio app, targets sent after fullData : each target ends up as if updated on its own
+def testAsyncFanOut(fake, post, asyncPost, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 4)}
+    targets = [{"spreadsheetId": "asyncFirst", "sheetId": 1, "lang": "EN"}, {"spreadsheetId": "asyncSecond", "sheetId": 1, "lang": "FR"}]
+
+    status, headers, body = asyncio.run(asyncPost("", runs, runs, targets = targets))
+
+    assert status == 200
+    assert [(targetResult["spreadsheetId"], targetResult["status"]) for targetResult in body["targets"]] == [("asyncFirst", 200), ("asyncSecond", 200)]
+
+    assert post("aloneFirst", runs, runs).status_code == 200
+    assert post("aloneSecond", runs, runs, lang = "FR").status_code == 200
+    assert sheetGrid(fake, "asyncFirst") == sheetGrid(fake, "aloneFirst")
+    assert sheetGrid(fake, "asyncSecond") == sheetGrid(fake, "aloneSecond")
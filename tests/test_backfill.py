@@ -0,0 +1,100 @@
+import json
+import types
+
+import pytest
+
+import RunAndBunBackfill
+import RunAndBunBenchmark
+import RunAndBunLayout
+import RunAndBunUpload
+
+from conftest import sheetCards, sheetGrid
+from FakeSheetsService import httpError
+
+
+@pytest.fixture
+def runs(rng):
+    return {f"run{i}": RunAndBunBenchmark.generateRun(rng, rng.randint(1, 12)) for i in range(12)}
+
+def writeJsonl(path, runs):
+    with open(path, "w", encoding = "utf-8") as outputFile:
+        for runId, run in runs.items():
+            outputFile.write(json.dumps({"runId": runId, **run}) + "\n")
+
+    return str(path)
+
+def writeJson(path, runs):
+    with open(path, "w", encoding = "utf-8") as outputFile:
+        json.dump(RunAndBunBenchmark.generatePayload({}, runs), outputFile)
+
+    return str(path)
+
+def options(inputPath, spreadsheetId, **overrides):
+    return types.SimpleNamespace(**dict({"input": inputPath, "spreadsheet_id": spreadsheetId, "sheet_id": 1, "lang": "EN", "max_bytes": 8_000_000,
+                                         "max_runs": 200, "checkpoint": None, "restart": False}, **overrides))
+
+def batchUpdates(fakeService):
+    return [call for call in fakeService.calls if call["method"] == "batchUpdate"]
+
+# Runs end up as if sent one by one, the last one on top
+def testBackfillOrderAndFormats(fake, runs, tmp_path):
+    RunAndBunBackfill.backfill(options(writeJsonl(tmp_path / "runs.jsonl", runs), "jsonl"))
+    RunAndBunBackfill.backfill(options(writeJson(tmp_path / "runs.json", runs), "json", max_runs = 5))
+
+    assert sheetCards(fake, "jsonl") == [(f"Run #{len(runs) - i}", runId) for i, runId in enumerate(reversed(runs))]
+    assert sheetGrid(fake, "json") == sheetGrid(fake, "jsonl")
+
+# Each batch goes out in one batchUpdate call, even with row indices grown by the relocation
+def testEveryBatchIsOneCall(fake, runs, tmp_path):
+    inputPath = writeJsonl(tmp_path / "runs.jsonl", runs)
+    compiledRuns = [RunAndBunBackfill.compileRun(1, runId, run, 1, "EN", None) for runId, run in runs.items()]
+
+    # One byte short of the whole history once relocated : the runs alone would fit
+    maxBytes = sum(map(RunAndBunUpload.requestSize, RunAndBunBackfill.compileBatch("batches", 1, compiledRuns))) - 1
+    sentBatches = []
+    applyRequests = fake.applyRequests
+
+    def recordBatch(spreadsheetId, requests):
+        sentBatches.append(requests)
+        return applyRequests(spreadsheetId, requests)
+
+    fake.applyRequests = recordBatch
+    totals = RunAndBunBackfill.backfill(options(inputPath, "batches", max_bytes = maxBytes))
+
+    assert totals["runs"] == len(runs)
+    assert all("insertDimension" in requests[0] for requests in sentBatches)
+    assert sum(requests[0]["insertDimension"]["range"]["endIndex"] for requests in sentBatches) == RunAndBunLayout.RUN_CARD_HEIGHT * len(runs)
+    assert all(sum(map(RunAndBunUpload.requestSize, requests)) <= maxBytes for requests in sentBatches)
+
+def testBatchTooLargeForOneCallIsRefused(fake, runs, tmp_path):
+    uploader = RunAndBunUpload.SheetsUploader(chunkBytes = 1000, splitChunks = False)
+    requests = RunAndBunBackfill.compileBatch("refused", 1, [RunAndBunBackfill.compileRun(1, "run0", runs["run0"], 1, "EN", None)])
+
+    with pytest.raises(RunAndBunUpload.UploadError):
+        uploader.upload("refused", requests)
+
+    assert not batchUpdates(fake)
+
+# A backfill stopped by a failed batch is resumed from its checkpoint without duplicating runs
+def testBackfillResumesAfterFailedBatch(fake, runs, tmp_path):
+    inputPath = writeJsonl(tmp_path / "runs.jsonl", runs)
+    applyRequests = fake.applyRequests
+
+    def failThirdBatch(spreadsheetId, requests):
+        if len(batchUpdates(fake)) == 3:
+            raise httpError(400, "Invalid requests")
+
+        return applyRequests(spreadsheetId, requests)
+
+    fake.applyRequests = failThirdBatch
+
+    with pytest.raises(RunAndBunUpload.UploadError):
+        RunAndBunBackfill.backfill(options(inputPath, "resume", max_runs = 4))
+
+    fake.applyRequests = applyRequests
+    assert len(sheetCards(fake, "resume")) == 8
+
+    totals = RunAndBunBackfill.backfill(options(inputPath, "resume", max_runs = 4))
+
+    assert totals["runs"] == 4
+    assert sheetCards(fake, "resume") == [(f"Run #{len(runs) - i}", runId) for i, runId in enumerate(reversed(runs))]
@@ -0,0 +1,40 @@
+import argparse
+
+import RunAndBunBenchmark
+import RunAndBunCompaction
+import RunAndBunLayout
+import RunAndBunStats
+
+from conftest import sheetGrid
+
+
+# Compacted requests must display exactly what the raw card requests display
+def testCompactedRequestsGiveSameGrid(fake, post, rng, monkeypatch):
+    runs = {f"run{i}": RunAndBunBenchmark.generateRun(rng, rng.randint(1, 12)) for i in range(4)}
+    evolvedRun = dict(runs["run1"], pokemonData = {zone: RunAndBunBenchmark.evolvePokemon(rng, pokemon) for zone, pokemon in runs["run1"]["pokemonData"].items()})
+
+    for spreadsheetId, compact in [("raw", False), ("compacted", True)]:
+        monkeypatch.setattr(RunAndBunStats, "COMPACT_REQUESTS", compact)
+
+        for runId, run in runs.items():
+            assert post(spreadsheetId, {runId: run}, runs).status_code == 200
+
+        assert post(spreadsheetId, {"run1": evolvedRun}, dict(runs, run1 = evolvedRun)).status_code == 200
+
+    assert sheetGrid(fake, "compacted") == sheetGrid(fake, "raw")
+
+def testCompactionSendsFewerRequests(rng):
+    requests = []
+    RunAndBunLayout.generateRunCard(requests, 1, "run0", RunAndBunBenchmark.generateRunData(rng), "EN", 1, None)
+
+    for pokemonCardId, zone in enumerate(RunAndBunLayout.ZONES[:6]):
+        RunAndBunLayout.generatePokemonCard(requests, 1, RunAndBunBenchmark.generatePokemon(rng), zone, 0, pokemonCardId, "EN")
+
+    assert len(RunAndBunCompaction.compactRequests(requests)) < len(requests)
+
+# A new run next to an existing one used to take 1376 requests : the Pokémon cards are pasted and the columns sized once per sheet
+def testNewRunRequestsCutTenfold():
+    options = argparse.Namespace(latency = 0, latency_jitter = 0, seed = 0, error_rate = 0)
+    result = RunAndBunBenchmark.benchmarkUpdateRun("updateRun newRun", RunAndBunBenchmark.updateRunScenarios(0)["updateRun newRun"], options)
+
+    assert result["requests"] < 1376 // 10
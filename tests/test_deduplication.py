@@ -0,0 +1,138 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+import RunAndBunBenchmark
+import RunAndBunStats
+
+
+def wonBattles(value):
+    return {"A": {"runData": {"wonBattles": value}, "pokemonData": {}}}
+
+def batchUpdates(fakeService, calls = 0):
+    return [call for call in fakeService.calls[calls:] if call["method"] == "batchUpdate"]
+
+def doneFuture(result = None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+# A retry with the same Idempotency-Key is answered by the first update, without calling Google again
+def testIdempotencyKeyReplaySkipsSheets(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    first = post("replay", runs, runs, headers = {"Idempotency-Key": "update-1"})
+    calls = len(fake.calls)
+
+    retry = post("replay", runs, runs, headers = {"Idempotency-Key": "update-1"})
+
+    assert (first.status_code, retry.status_code) == (200, 200)
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+    assert retry.get_json()["upload"] == first.get_json()["upload"]
+    assert fake.calls[calls:] == []
+
+def testReusedKeyWithOtherPayloadRefused(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("reused", runs, runs, headers = {"Idempotency-Key": "update-1"}).status_code == 200
+    calls = len(fake.calls)
+
+    assert post("reused", wonBattles("12"), runs, headers = {"Idempotency-Key": "update-1"}).status_code == 422
+    assert fake.calls[calls:] == []
+
+# A duplicate arriving while the first update is uploading waits for it instead of being processed again
+def testConcurrentDuplicateWaitsForInFlightUpdate(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("inFlight", runs, runs).status_code == 200
+
+    uploading, release = threading.Event(), threading.Event()
+    applyRequests = fake.applyRequests
+
+    def blockedApplyRequests(spreadsheetId, requests):
+        uploading.set()
+        release.wait(5)
+        return applyRequests(spreadsheetId, requests)
+
+    fake.applyRequests = blockedApplyRequests
+    calls = len(fake.calls)
+
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(post, "inFlight", wonBattles("12"), runs, {"Idempotency-Key": "update-2"})
+        assert uploading.wait(5)
+        duplicate = executor.submit(post, "inFlight", wonBattles("12"), runs, {"Idempotency-Key": "update-2"})
+
+        # Still waiting for the first update
+        time.sleep(0.2)
+        assert not duplicate.done()
+        release.set()
+
+    assert (first.result().status_code, duplicate.result().status_code) == (200, 200)
+    assert duplicate.result().headers.get("Idempotent-Replayed") == "true"
+    assert len(batchUpdates(fake, calls)) == 1
+
+# Without key, a run is only skipped when sent as in its last update : A, B, A changes the sheet three times
+def testSamePayloadAfterAnotherOneIsProcessed(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("sequence", runs, runs).status_code == 200
+    calls = len(fake.calls)
+
+    responses = [post("sequence", wonBattles(value), runs) for value in ["1", "2", "1"]]
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert not any(response.headers.get("Idempotent-Replayed") for response in responses)
+    assert len(batchUpdates(fake, calls)) == 3
+    assert fake.cellValue("sequence", 1, 5, 5) == "1"
+
+    # The last payload sent again is a retry
+    assert post("sequence", wonBattles("1"), runs).headers.get("Idempotent-Replayed") == "true"
+    assert len(batchUpdates(fake, calls)) == 3
+
+# Runs already sent as is are skipped : other fullData, reordered keys and a second run changed in the same payload
+def testUnchangedRunsSkipped(fake, post, rng, monkeypatch):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3), "B": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("perRun", runs, runs).status_code == 200
+
+    processedRuns = []
+    processUpdate = RunAndBunStats.processUpdate
+
+    def recordedProcessUpdate(spreadsheetId, sheetId, updatedData, *args):
+        processedRuns.append(sorted(updatedData))
+        return processUpdate(spreadsheetId, sheetId, updatedData, *args)
+
+    monkeypatch.setattr(RunAndBunStats, "processUpdate", recordedProcessUpdate)
+    calls = len(fake.calls)
+
+    # Same runs, keys in another order and a fullData with another run : nothing to send
+    reordered = {runId: {"pokemonData": run["pokemonData"], "runData": dict(reversed(run["runData"].items()))} for runId, run in reversed(runs.items())}
+    response = post("perRun", reordered, {**runs, "C": RunAndBunBenchmark.generateRun(rng, 1)})
+    assert response.headers.get("Idempotent-Replayed") == "true"
+
+    # Only B changed
+    updated = {"A": runs["A"], "B": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}
+    response = post("perRun", updated, runs)
+
+    assert response.status_code == 200
+    assert not response.headers.get("Idempotent-Replayed")
+    assert processedRuns == [["B"]]
+    assert len(batchUpdates(fake, calls)) == 1
+    assert fake.cellValue("perRun", 1, 5, 5) == "12"
+
+# Runs of a failed update are sent again, evicted runs too
+def testFailedAndEvictedRunsSentAgain():
+    deduplicator = RunAndBunStats.UpdateDeduplicator(2, 3600)
+    started = []
+
+    def start(future):
+        return lambda runIds: started.append(runIds) or (future, None)
+
+    deduplicator.submit("sheet", "", "", {"A": "a", "B": "b"}, start(doneFuture()))
+    deduplicator.submit("sheet", "", "", {"A": "a", "B": "b"}, start(doneFuture()))
+    deduplicator.submit("sheet", "", "", {"C": "c"}, start(doneFuture()))
+    deduplicator.submit("sheet", "", "", {"A": "a", "B": "b", "C": "c"}, start(doneFuture()))
+
+    failed = Future()
+    failed.set_exception(RuntimeError("upload failed"))
+    deduplicator.submit("sheet", "", "", {"D": "d"}, start(failed))
+    deduplicator.submit("sheet", "", "", {"D": "d"}, start(doneFuture()))
+
+    assert started == [["A", "B"], ["C"], ["A"], ["D"], ["D"]]
+    assert len(deduplicator.entries) == 2
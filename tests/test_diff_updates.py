@@ -0,0 +1,64 @@
+import copy
+
+import RunAndBunBenchmark
+import RunAndBunLayout
+import RunAndBunStats
+
+from conftest import sheetGrid
+
+
+# Updates only write the fields that changed since the pushed snapshot : the sheet must end up as if every card was regenerated
+def testDiffUpdateGivesSameGridAsFullRegeneration(fake, post, rng):
+    runs = {f"run{i}": RunAndBunBenchmark.generateRun(rng, rng.randint(2, 10)) for i in range(3)}
+
+    for runId, run in runs.items():
+        assert post("diff", {runId: run}, runs).status_code == 200
+
+    # Evolved Pokémon, a new zone, a dead Pokémon and changed run data
+    finalRuns = copy.deepcopy(runs)
+    run = finalRuns["run1"]
+    run["pokemonData"] = {zone: RunAndBunBenchmark.evolvePokemon(rng, pokemon) for zone, pokemon in run["pokemonData"].items()}
+    run["pokemonData"][next(zone for zone in RunAndBunLayout.ZONES if zone not in runs["run1"]["pokemonData"])] = RunAndBunBenchmark.generatePokemon(rng, alive = 1)
+    run["pokemonData"][next(iter(run["pokemonData"]))]["alive"] = 0
+    run["runData"].update(wonBattles = "99", deadPokemon = "7", gymBadges = 8)
+
+    requestsBefore = sum(call["requests"] for call in fake.calls if call["method"] == "batchUpdate")
+    assert post("diff", {"run1": run}, finalRuns).status_code == 200
+    diffRequests = sum(call["requests"] for call in fake.calls if call["method"] == "batchUpdate") - requestsBefore
+
+    # Same history, the last update compiled without snapshots
+    for runId in runs:
+        assert post("full", {runId: runs[runId]}, runs).status_code == 200
+
+    RunAndBunStats.getRunSnapshots("full").snapshots.clear()
+    requestsBefore = sum(call["requests"] for call in fake.calls if call["method"] == "batchUpdate")
+    assert post("full", {"run1": run}, finalRuns).status_code == 200
+    fullRequests = sum(call["requests"] for call in fake.calls if call["method"] == "batchUpdate") - requestsBefore
+
+    assert sheetGrid(fake, "diff") == sheetGrid(fake, "full")
+    assert diffRequests <= fullRequests
+
+# Sending the same state again changes nothing
+def testUnchangedUpdateSendsNothing(fake, post, rng):
+    runs = {"run0": RunAndBunBenchmark.generateRun(rng, 5)}
+    assert post("same", runs, runs).status_code == 200
+    grid = copy.deepcopy(sheetGrid(fake, "same"))
+
+    calls = len(fake.calls)
+    assert post("same", copy.deepcopy(runs), runs).status_code == 200
+
+    assert sheetGrid(fake, "same") == grid
+    assert sum(call["requests"] for call in fake.calls[calls:] if call["method"] == "batchUpdate") == 0
+
+# Fewer gym badges than the pushed snapshot : the sprites above the new count are cleared
+def testLostBadgesCleared(fake, post, rng):
+    runs = {"run0": RunAndBunBenchmark.generateRun(rng, 3)}
+    runs["run0"]["runData"]["gymBadges"] = 5
+    assert post("lostBadges", runs, runs).status_code == 200
+
+    finalRuns = copy.deepcopy(runs)
+    finalRuns["run0"]["runData"]["gymBadges"] = 2
+    assert post("lostBadges", {"run0": {"runData": {"gymBadges": 2}, "pokemonData": {}}}, finalRuns).status_code == 200
+    assert post("twoBadges", finalRuns, finalRuns).status_code == 200
+
+    assert sheetGrid(fake, "lostBadges")["cells"] == sheetGrid(fake, "twoBadges")["cells"]
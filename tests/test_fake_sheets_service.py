@@ -0,0 +1,42 @@
+import copy
+
+import pytest
+
+from conftest import sheetGrid
+
+
+def cellRequest(row, col, text):
+    return {"updateCells": {"range": {"sheetId": 1, "startRowIndex": row, "endRowIndex": row + 1, "startColumnIndex": col, "endColumnIndex": col + 1},
+                            "rows": [{"values": [{"userEnteredValue": {"stringValue": text}, "userEnteredFormat": {"backgroundColor": {"red": 1}}}]}],
+                            "fields": "userEnteredValue,userEnteredFormat"}}
+
+# batchUpdate is atomic : a request failing leaves every sheet as it was, including cells written earlier in the batch
+def testFailedBatchUpdateAppliesNothing(fake):
+    fake.applyRequests("atomic", [cellRequest(0, 0, "kept"), {"mergeCells": {"range": {"sheetId": 1, "startRowIndex": 2, "endRowIndex": 4,
+                                                                                         "startColumnIndex": 0, "endColumnIndex": 2}, "mergeType": "MERGE_ALL"}}])
+    grid = copy.deepcopy(sheetGrid(fake, "atomic"))
+
+    with pytest.raises(Exception):
+        fake.applyRequests("atomic", [cellRequest(0, 0, "lost"), {"insertDimension": {"range": {"sheetId": 1, "dimension": "ROWS", "startIndex": 0, "endIndex": 18}}},
+                                      {"unknownRequest": {}}])
+
+    assert sheetGrid(fake, "atomic") == grid
+    assert fake.cellValue("atomic", 1, 0, 0) == "kept"
+
+def testBatchUpdateAppliedInOrder(fake):
+    fake.applyRequests("ordered", [cellRequest(0, 0, "first"), {"insertDimension": {"range": {"sheetId": 1, "dimension": "ROWS", "startIndex": 0, "endIndex": 2}}},
+                                   cellRequest(0, 0, "second")])
+    fake.applyRequests("ordered", [cellRequest(0, 0, "third")])
+
+    assert [fake.cellValue("ordered", 1, row, 0) for row in range(3)] == ["third", "", "first"]
+
+# A paste destination spanning several source widths repeats the source, cells and merges
+def testCopyPasteRepeatsSourceOverDestination(fake):
+    fake.applyRequests("tiled", [cellRequest(0, 0, "tile"), {"mergeCells": {"range": {"sheetId": 1, "startRowIndex": 0, "endRowIndex": 2,
+                                                                                       "startColumnIndex": 1, "endColumnIndex": 2}, "mergeType": "MERGE_ALL"}}])
+    fake.applyRequests("tiled", [{"copyPaste": {"source": {"sheetId": 1, "startRowIndex": 0, "endRowIndex": 2, "startColumnIndex": 0, "endColumnIndex": 2},
+                                                "destination": {"sheetId": 1, "startRowIndex": 0, "endRowIndex": 2, "startColumnIndex": 2, "endColumnIndex": 8},
+                                                "pasteType": "PASTE_NORMAL"}}])
+
+    assert [fake.cellValue("tiled", 1, 0, col) for col in range(0, 8, 2)] == ["tile"] * 4
+    assert sheetGrid(fake, "tiled")["merges"] == {(0, 2, col, col + 1) for col in range(1, 8, 2)}
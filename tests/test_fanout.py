@@ -0,0 +1,102 @@
+import RunAndBunBenchmark
+import RunAndBunMetrics
+
+from conftest import sheetGrid
+from FakeSheetsService import httpError
+
+
+def target(spreadsheetId, sheetId):
+    return {"spreadsheetId": spreadsheetId, "sheetId": sheetId, "lang": "EN"}
+
+def reusedCards():
+    return RunAndBunMetrics.metrics.values.get(("runandbun_fanout_cards_total", (("result", "reused"),)), 0)
+
+
+# Cards compiled for the first target are relocated to the sheet and run card position of the other one :
+# each spreadsheet must end up as if it had been updated on its own
+def testFanOutGivesSameGridsAsSeparateUpdates(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 4), "B": RunAndBunBenchmark.generateRun(rng, 4)}
+    update = {"A": {"runData": {"wonBattles": "31"}, "pokemonData": {zone: RunAndBunBenchmark.evolvePokemon(rng, pokemon) for zone, pokemon in runs["A"]["pokemonData"].items()}}}
+    finalRuns = {"A": {"runData": dict(runs["A"]["runData"], wonBattles = "31"), "pokemonData": update["A"]["pokemonData"]}, "B": runs["B"]}
+
+    # A is the second run card of the first spreadsheet, the only one of the second
+    for spreadsheetId, sheetId, runIds in [("mirrorFirst", 1, ["A", "B"]), ("mirrorSecond", 7, ["A"]), ("aloneFirst", 1, ["A", "B"]), ("aloneSecond", 7, ["A"])]:
+        for runId in runIds:
+            assert post(spreadsheetId, {runId: runs[runId]}, runs, keys = {"spreadsheetId": spreadsheetId, "sheetId": sheetId}).status_code == 200
+
+    reusedBefore = reusedCards()
+    response = post("", update, finalRuns, targets = [target("mirrorFirst", 1), target("mirrorSecond", 7)])
+
+    assert response.status_code == 200
+    assert reusedCards() - reusedBefore == 1 + len(update["A"]["pokemonData"])
+    assert [targetResult["status"] for targetResult in response.get_json()["targets"]] == [200, 200]
+
+    assert post("aloneFirst", update, finalRuns, keys = {"spreadsheetId": "aloneFirst", "sheetId": 1}).status_code == 200
+    assert post("aloneSecond", update, finalRuns, keys = {"spreadsheetId": "aloneSecond", "sheetId": 7}).status_code == 200
+
+    assert sheetGrid(fake, "mirrorFirst", 1) == sheetGrid(fake, "aloneFirst", 1)
+    assert sheetGrid(fake, "mirrorSecond", 7) == sheetGrid(fake, "aloneSecond", 7)
+
+# A new run mirrored to sheets with different sheetIds
+def testFanOutNewRun(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 6)}
+
+    assert post("", runs, runs, targets = [target("newFirst", 1), target("newSecond", 7)]).status_code == 200
+    assert post("newAlone", runs, runs, keys = {"spreadsheetId": "newAlone", "sheetId": 7}).status_code == 200
+
+    assert sheetGrid(fake, "newFirst", 1) == sheetGrid(fake, "newAlone", 7)
+    assert sheetGrid(fake, "newSecond", 7) == sheetGrid(fake, "newAlone", 7)
+
+# One target failing does not fail the other one : 207 with the status of each target
+def testFanOutPartialFailure(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    applyRequests = fake.applyRequests
+
+    def refuseBroken(spreadsheetId, requests):
+        if spreadsheetId == "broken":
+            raise httpError(400, "Invalid requests")
+
+        return applyRequests(spreadsheetId, requests)
+
+    fake.applyRequests = refuseBroken
+    response = post("", runs, runs, targets = [target("working", 1), target("broken", 1)])
+
+    assert response.status_code == 207
+    assert [(targetResult["spreadsheetId"], targetResult["status"]) for targetResult in response.get_json()["targets"]] == [("working", 200), ("broken", 502)]
+    assert fake.cellValue("working", 1, 7, 1) == "RundId : A"
+
+def testFanOutDuplicateSpreadsheetsRefused(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+
+    assert post("", runs, runs, targets = [target("same", 1), target("same", 7)]).status_code == 400
+    assert fake.calls == []
+
+# English and french mirrors with a different number of runs share the run card and the Pokémon cards : only labels and titles are written per target
+def testFanOutSharesCardsAcrossLanguages(fake, post, rng):
+    runs = {"old": RunAndBunBenchmark.generateRun(rng, 2), "A": RunAndBunBenchmark.generateRun(rng, 6)}
+    french = {"spreadsheetId": "frenchMirror", "sheetId": 1, "lang": "FR"}
+
+    for spreadsheetId, lang in [("frenchMirror", "FR"), ("frenchAlone", "FR")]:
+        assert post(spreadsheetId, {"old": runs["old"]}, runs, lang = lang).status_code == 200
+
+    reusedBefore = reusedCards()
+    assert post("", {"A": runs["A"]}, runs, targets = [target("englishMirror", 1), french]).status_code == 200
+    assert reusedCards() - reusedBefore == 2
+
+    assert post("englishAlone", {"A": runs["A"]}, runs).status_code == 200
+    assert post("frenchAlone", {"A": runs["A"]}, runs, lang = "FR").status_code == 200
+
+    assert sheetGrid(fake, "englishMirror") == sheetGrid(fake, "englishAlone")
+    assert sheetGrid(fake, "frenchMirror") == sheetGrid(fake, "frenchAlone")
+    assert fake.cellValue("frenchMirror", 1, 2, 1) == "Run #2"
+
+    # Updated Pokémon : the level label follows the language of each target
+    update = {"A": {"runData": {}, "pokemonData": {zone: RunAndBunBenchmark.evolvePokemon(rng, pokemon) for zone, pokemon in runs["A"]["pokemonData"].items()}}}
+    finalRuns = {**runs, "A": {"runData": runs["A"]["runData"], "pokemonData": update["A"]["pokemonData"]}}
+
+    assert post("", update, finalRuns, targets = [target("englishMirror", 1), french]).status_code == 200
+    assert post("englishAlone", update, finalRuns).status_code == 200
+    assert post("frenchAlone", update, finalRuns, lang = "FR").status_code == 200
+
+    assert sheetGrid(fake, "englishMirror") == sheetGrid(fake, "englishAlone")
+    assert sheetGrid(fake, "frenchMirror") == sheetGrid(fake, "frenchAlone")
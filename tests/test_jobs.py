@@ -0,0 +1,68 @@
+import threading
+import time
+
+import RunAndBunBenchmark
+import RunAndBunStats
+
+
+# Status of a job as seen by a polling client
+def jobStatus(client, location):
+    response = client.get(location, headers = {"Authorization": f"Bearer {RunAndBunStats.API_PASSWORD}"})
+    assert response.status_code == 200
+    return response.get_json()
+
+def waitForJob(client, location, statuses):
+    for _ in range(500):
+        if (job := jobStatus(client, location))["status"] in statuses:
+            return job
+
+        time.sleep(0.01)
+
+    raise AssertionError(f"{location} never reached {statuses}")
+
+
+# Async mode : 202 and Location right away, the job goes through queued and running before done
+def testAsyncJobLifecycle(fake, post, rng):
+    client = RunAndBunStats.flaskApp.test_client()
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("jobs", runs, runs).status_code == 200
+
+    uploading, release = threading.Event(), threading.Event()
+    applyRequests = fake.applyRequests
+
+    def blockedApplyRequests(spreadsheetId, requests):
+        uploading.set()
+        release.wait(5)
+        return applyRequests(spreadsheetId, requests)
+
+    fake.applyRequests = blockedApplyRequests
+
+    # The first job holds the spreadsheet lane : the second one stays queued behind it
+    first = post("jobs", {"A": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}, runs, headers = {"Prefer": "respond-async"})
+    assert uploading.wait(5)
+    second = post("jobs", {"A": {"runData": {"wonBattles": "13"}, "pokemonData": {}}}, runs, headers = {"Prefer": "respond-async"})
+
+    assert (first.status_code, second.status_code) == (202, 202)
+    assert first.headers["Location"] == f"/jobs/{first.get_json()['jobId']}"
+    assert jobStatus(client, first.headers["Location"])["status"] == "running"
+    assert jobStatus(client, second.headers["Location"])["status"] == "queued"
+
+    release.set()
+    job = waitForJob(client, second.headers["Location"], ["done", "failed"])
+
+    assert job["status"] == "done"
+    assert job["result"]["calls"] == 1
+    assert jobStatus(client, first.headers["Location"])["status"] == "done"
+    assert fake.cellValue("jobs", 1, 5, 5) == "13"
+
+def testFailedAndUnknownJobs(fake, post, rng):
+    client = RunAndBunStats.flaskApp.test_client()
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    fake.scheduleErrors(400, methods = ["batchUpdate"])
+
+    response = post("failedJob", runs, runs, headers = {"Prefer": "respond-async"})
+    job = waitForJob(client, response.headers["Location"], ["done", "failed"])
+
+    assert (job["status"], job["error"]["status"]) == ("failed", 400)
+    assert client.get("/jobs/unknown", headers = {"Authorization": f"Bearer {RunAndBunStats.API_PASSWORD}"}).status_code == 404
+    assert client.get(response.headers["Location"]).status_code == 401
@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+import RunAndBunBenchmark
+import RunAndBunStats
+import RunAndBunStorage
+import RunAndBunUpload
+
+from conftest import sheetCards, sheetGrid
+
+
+@pytest.fixture
+def journalDirectory(tmp_path, monkeypatch):
+    monkeypatch.setattr(RunAndBunStorage, "JOURNAL_DIRECTORY", str(tmp_path))
+    return tmp_path
+
+# The first run of a sheet takes several small chunks, its cards in the first two and the column sizes after them, a failed chunk fails its update at once
+@pytest.fixture
+def runs(fake, rng, monkeypatch):
+    monkeypatch.setattr(RunAndBunUpload, "UPLOAD_MAX_RETRIES", 0)
+    monkeypatch.setattr(RunAndBunUpload, "UPLOAD_BATCH_SIZE", 40)
+    monkeypatch.setattr(RunAndBunStats, "uploader", RunAndBunUpload.SheetsUploader(chunkSize = 40))
+    return {"A": RunAndBunBenchmark.generateRun(rng, 6)}
+
+def batchUpdates(fakeService, calls = 0):
+    return [call for call in fakeService.calls[calls:] if call["method"] == "batchUpdate"]
+
+def journalFiles(journalDirectory, spreadsheetId):
+    return sorted(fileName for fileName in os.listdir(journalDirectory) if fileName.startswith(spreadsheetId))
+
+# Send the new run with its third chunk failing, then the same history to a spreadsheet where nothing fails
+def failThirdChunk(fake, post, spreadsheetId, runs, status = 503):
+    assert post("clean", runs, runs).status_code == 200
+    assert len(batchUpdates(fake)) > 3
+
+    fake.scheduleErrors(None, None, status, methods = ["batchUpdate"])
+    return post(spreadsheetId, runs, runs)
+
+def wonBattles(value):
+    return {"A": {"runData": {"wonBattles": value}, "pokemonData": {}}}
+
+
+# The next update first sends what the failed one did not, without inserting the run card again
+def testFailedChunkResumedByNextUpdate(fake, post, runs):
+    assert failThirdChunk(fake, post, "resume", runs).status_code == 502
+
+    journal = RunAndBunStats.getUpdateJournal("resume")
+    assert journal.pending()
+    assert journal.acknowledged == 2 * RunAndBunUpload.UPLOAD_BATCH_SIZE
+
+    calls = len(fake.calls)
+    remaining = len(journal.remaining())
+    assert post("resume", wonBattles("50"), runs).status_code == 200
+    assert post("clean", wonBattles("50"), runs).status_code == 200
+
+    assert batchUpdates(fake, calls)[0]["requests"] == min(remaining, RunAndBunUpload.UPLOAD_BATCH_SIZE)
+    assert not journal.pending()
+    assert sheetCards(fake, "resume") == [("Run #1", "A")]
+    assert sheetGrid(fake, "resume") == sheetGrid(fake, "clean")
+
+# The journal and its acknowledgments are reloaded after a restart, and deleted once the update is finished
+def testFailedUpdateResumedAfterRestart(fake, post, runs, journalDirectory):
+    assert failThirdChunk(fake, post, "restart", runs).status_code == 502
+    assert journalFiles(journalDirectory, "restart") == ["restart.json", "restart.json.acks"]
+
+    RunAndBunBenchmark.resetState(fake)
+    journal = RunAndBunStats.getUpdateJournal("restart")
+    assert (journal.acknowledged, journal.attempts) == (2 * RunAndBunUpload.UPLOAD_BATCH_SIZE, 1)
+
+    assert post("restart", wonBattles("50"), runs).status_code == 200
+    assert post("clean", wonBattles("50"), runs).status_code == 200
+
+    assert journalFiles(journalDirectory, "restart") == []
+    assert RunAndBunStats.getRunIndex("restart").locate("A") == (0, 0)
+    assert sheetGrid(fake, "restart") == sheetGrid(fake, "clean")
+
+# Updates sent in one chunk never write a journal
+def testSingleChunkUpdateWritesNoJournal(fake, post, runs, journalDirectory):
+    assert post("single", runs, runs).status_code == 200
+    assert journalFiles(journalDirectory, "single") == []
+
+    fake.scheduleErrors(503, methods = ["batchUpdate"])
+    assert post("single", wonBattles("50"), runs).status_code == 502
+
+    assert journalFiles(journalDirectory, "single") == []
+    assert not RunAndBunStats.getUpdateJournal("single").pending()
+
+# Failed attempts are counted in the journal : after JOURNAL_MAX_ATTEMPTS, the update is given up even across restarts
+def testAttemptsSurviveRestart(fake, post, runs, journalDirectory):
+    assert failThirdChunk(fake, post, "attempts", runs).status_code == 502
+
+    for attempt in range(2, RunAndBunStats.JOURNAL_MAX_ATTEMPTS + 1):
+        RunAndBunBenchmark.resetState(fake)
+        assert RunAndBunStats.getUpdateJournal("attempts").attempts == attempt - 1
+
+        fake.scheduleErrors(503, methods = ["batchUpdate"])
+        assert post("attempts", wonBattles("50"), runs).status_code == 502
+
+    assert journalFiles(journalDirectory, "attempts") == []
+    assert not RunAndBunStats.getUpdateJournal("attempts").pending()
+    assert RunAndBunStats.getRunIndex("attempts").stamps is None
+
+# Given up updates (nothing applied, refused by Google, too many attempts) : the next update rebuilds the layout from the sheet
+@pytest.mark.parametrize("failure", ["nothingApplied", "refused", "attempts"])
+def testGivenUpUpdateFallsBackToRebuild(fake, post, runs, failure, monkeypatch):
+    if failure == "nothingApplied":
+        assert post("clean", runs, runs).status_code == 200
+        fake.scheduleErrors(503, methods = ["batchUpdate"])
+        assert post("givenUp", runs, runs).status_code == 502
+    else:
+        monkeypatch.setattr(RunAndBunStats, "JOURNAL_MAX_ATTEMPTS", 1 if failure == "attempts" else RunAndBunStats.JOURNAL_MAX_ATTEMPTS)
+        assert failThirdChunk(fake, post, "givenUp", runs, 400 if failure == "refused" else 503).status_code == 502
+
+    assert not RunAndBunStats.getUpdateJournal("givenUp").pending()
+    assert RunAndBunStats.getRunIndex("givenUp").stamps is None
+
+    calls = len(fake.calls)
+    assert post("givenUp", runs, runs).status_code == 200
+
+    assert "values.get" in [call["method"] for call in fake.calls[calls:]]
+
+    # Column widths are only written with new run cards : the ones a partly applied update did not send come with the next new run
+    grid, cleanGrid = sheetGrid(fake, "givenUp"), sheetGrid(fake, "clean")
+    assert sheetCards(fake, "givenUp") == [("Run #1", "A")]
+    assert {key: grid[key] for key in ["cells", "merges", "rowSizes"]} == {key: cleanGrid[key] for key in ["cells", "merges", "rowSizes"]}
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+import RunAndBunBenchmark
+import RunAndBunStats
+
+
+def wonBattles(value):
+    return {"A": {"runData": {"wonBattles": value}, "pokemonData": {}}}
+
+@pytest.fixture
+def runs(rng):
+    return {"A": RunAndBunBenchmark.generateRun(rng, 2)}
+
+
+# 12 updates per minute : a burst of 2, then one every 5 seconds
+def testClientBudget(fake, post, runs, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "clientLimiter", RunAndBunStats.RateLimiter("client", 12))
+
+    responses = [post("client", wonBattles(str(value)), runs) for value in range(3)]
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert 1 <= int(responses[2].headers["Retry-After"]) <= 5
+
+    # X-Forwarded-For is only trusted behind CLIENT_PROXY_HOPS proxies : another client then has its own budget
+    assert post("client", wonBattles("9"), runs, headers = {"X-Forwarded-For": "203.0.113.7"}).status_code == 429
+    monkeypatch.setattr(RunAndBunStats, "CLIENT_PROXY_HOPS", 1)
+    assert post("client", wonBattles("9"), runs, headers = {"X-Forwarded-For": "203.0.113.7"}).status_code == 200
+
+# Retries of an update already submitted are answered without being charged to the spreadsheet budget
+def testSpreadsheetBudgetIgnoresReplays(fake, post, runs, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "spreadsheetLimiter", RunAndBunStats.RateLimiter("spreadsheet", 12))
+
+    assert post("budget", runs, runs, headers = {"Idempotency-Key": "first"}).status_code == 200
+
+    for _ in range(3):
+        replay = post("budget", runs, runs, headers = {"Idempotency-Key": "first"})
+        assert (replay.status_code, replay.headers.get("Idempotent-Replayed")) == (200, "true")
+
+    assert post("budget", wonBattles("12"), runs).status_code == 200
+
+    refused = post("budget", wonBattles("13"), runs)
+    assert refused.status_code == 429
+    assert 1 <= int(refused.headers["Retry-After"]) <= 5
+
+    # Other spreadsheets have their own budget
+    assert post("otherBudget", runs, runs).status_code == 200
+
+# Updates waiting or running over the whole server beyond DISPATCH_MAX_PENDING are shed
+def testServerOverloadShed(fake, post, runs, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "dispatcher", RunAndBunStats.SpreadsheetDispatcher(2, 10, 1))
+    uploading, release = threading.Event(), threading.Event()
+    applyRequests = fake.applyRequests
+
+    def blockedApplyRequests(spreadsheetId, requests):
+        uploading.set()
+        release.wait(5)
+        return applyRequests(spreadsheetId, requests)
+
+    fake.applyRequests = blockedApplyRequests
+
+    try:
+        assert post("busy", runs, runs, headers = {"Prefer": "respond-async"}).status_code == 202
+        assert uploading.wait(5)
+
+        refused = post("idle", runs, runs)
+
+    finally:
+        release.set()
+
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == str(RunAndBunStats.DISPATCH_RETRY_AFTER)
+    assert not [call for call in fake.calls if call["spreadsheetId"] == "idle"]
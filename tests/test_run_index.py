@@ -0,0 +1,106 @@
+import RunAndBunBenchmark
+import RunAndBunLayout
+import RunAndBunStats
+
+from conftest import sheetCards
+
+
+# A compilation failing after the new run was inserted in the index must leave no stamp : nothing was sent
+def testIndexRolledBackAfterFailedCompile(fake, post, rng, monkeypatch):
+    runs = {"first": RunAndBunBenchmark.generateRun(rng, 4)}
+    assert post("rollback", runs, runs).status_code == 200
+
+    def failingPokemonCard(*args, **kwargs):
+        raise RuntimeError("compilation failed")
+
+    runs["second"] = RunAndBunBenchmark.generateRun(rng, 4)
+    generatePokemonCards = RunAndBunStats.generatePokemonCards
+    monkeypatch.setattr(RunAndBunStats, "generatePokemonCards", failingPokemonCard)
+    calls = len(fake.calls)
+
+    assert post("rollback", {"second": runs["second"]}, runs).status_code == 500
+    assert not [call for call in fake.calls[calls:] if call["method"] == "batchUpdate"]
+
+    runIndex = RunAndBunStats.getRunIndex("rollback")
+    assert runIndex.stamps == {"first": 1}
+    assert runIndex.sequence == 1
+
+    # The next update lands on the right rows with the right run number
+    monkeypatch.setattr(RunAndBunStats, "generatePokemonCards", generatePokemonCards)
+    assert post("rollback", {"second": runs["second"]}, runs).status_code == 200
+
+    assert sheetCards(fake, "rollback") == [("Run #2", "second"), ("Run #1", "first")]
+    assert runIndex.locate("second") == (0, 0)
+    assert runIndex.locate("first") == (0, 1)
+
+# Another writer inserting a run card on top (second server, manual edit) : once the index is aged, the update must not land in the wrong card
+def testAgedIndexRebuiltWhenCardsMoved(fake, post, rng, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "RUN_INDEX_MAX_AGE", 60)
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3), "B": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("drift", {"A": runs["A"]}, runs).status_code == 200
+    assert post("drift", {"B": runs["B"]}, runs).status_code == 200
+
+    fake.applyRequests("drift", [
+        {"insertDimension": {"range": {"sheetId": 1, "dimension": "ROWS", "startIndex": 0, "endIndex": RunAndBunLayout.RUN_CARD_HEIGHT}}},
+        {"updateCells": {"range": {"sheetId": 1, "startRowIndex": 7, "endRowIndex": 8, "startColumnIndex": 1, "endColumnIndex": 2},
+                         "rows": [{"values": [{"userEnteredValue": {"stringValue": "RundId : C"}}]}], "fields": "userEnteredValue"}}
+    ])
+    wonBattlesB = fake.cellValue("drift", 1, RunAndBunLayout.RUN_CARD_HEIGHT + 5, 5)
+    RunAndBunStats.getRunIndex("drift").loadedAt -= 61
+
+    assert post("drift", {"A": {"runData": {"wonBattles": "77"}, "pokemonData": {}}}, runs).status_code == 200
+
+    assert fake.cellValue("drift", 1, 2 * RunAndBunLayout.RUN_CARD_HEIGHT + 5, 5) == "77"
+    assert fake.cellValue("drift", 1, RunAndBunLayout.RUN_CARD_HEIGHT + 5, 5) == wonBattlesB
+    assert RunAndBunStats.getRunIndex("drift").locate("A") == (0, 2)
+
+# Known runs cost no read while the index is fresh
+def testSteadyUpdatesReadNothing(fake, post, rng, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "RUN_INDEX_MAX_AGE", 60)
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("steady", runs, runs).status_code == 200
+    calls = len(fake.calls)
+
+    assert post("steady", {"A": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}, runs).status_code == 200
+
+    assert [call["method"] for call in fake.calls[calls:]] == ["batchUpdate"]
+
+# Aged index with every card where expected : one small read, no column scan, then trusted again
+def testAgedIndexReadsOnlyRunIdCells(fake, post, rng, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "RUN_INDEX_MAX_AGE", 60)
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("aged", runs, runs).status_code == 200
+    RunAndBunStats.getRunIndex("aged").loadedAt -= 61
+    calls = len(fake.calls)
+
+    assert post("aged", {"A": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}, runs).status_code == 200
+    assert post("aged", {"A": {"runData": {"wonBattles": "13"}, "pokemonData": {}}}, runs).status_code == 200
+
+    assert [call["method"] for call in fake.calls[calls:]] == ["values.batchGet", "batchUpdate", "batchUpdate"]
+
+# A batchUpdate refused by Google (rows out of range after a card was deleted elsewhere) : the next update rebuilds the index
+def testRefusedUpdateRebuildsIndex(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("refused", runs, runs).status_code == 200
+
+    fake.scheduleErrors(400, methods = ["batchUpdate"])
+    assert post("refused", {"A": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}, runs).status_code == 502
+    assert RunAndBunStats.getRunIndex("refused").stamps is None
+
+    calls = len(fake.calls)
+    assert post("refused", {"A": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}, runs).status_code == 200
+
+    assert [call["method"] for call in fake.calls[calls:]] == ["values.get", "batchUpdate"]
+    assert fake.cellValue("refused", 1, 5, 5) == "12"
+
+# RUN_INDEX_MAX_AGE set to 0 : the index is never checked against the sheet, however old
+def testMaxAgeZeroNeverChecks(fake, post, rng, monkeypatch):
+    monkeypatch.setattr(RunAndBunStats, "RUN_INDEX_MAX_AGE", 0)
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("neverAged", runs, runs).status_code == 200
+    RunAndBunStats.getRunIndex("neverAged").loadedAt -= 365 * 86400
+    calls = len(fake.calls)
+
+    assert post("neverAged", {"A": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}, runs).status_code == 200
+
+    assert [call["method"] for call in fake.calls[calls:]] == ["batchUpdate"]
@@ -0,0 +1,43 @@
+import RunAndBunBenchmark
+import RunAndBunStats
+import RunAndBunStorage
+
+import pytest
+
+
+@pytest.fixture
+def runStore(tmp_path, monkeypatch):
+    store = RunAndBunStorage.RunStore(str(tmp_path / "runs.db"))
+    monkeypatch.setattr(RunAndBunStats, "runStore", store)
+    return store
+
+# Protocol version 2 : only the changes are sent, the cards are built from the stored runs
+def testDeltaOnlyUpdate(fake, post, rng, runStore):
+    run = RunAndBunBenchmark.generateRun(rng, 4)
+    assert post("delta", {"run0": run}, None, version = 2).status_code == 200
+
+    assert post("delta", {"run0": {"runData": {"wonBattles": "42"}, "pokemonData": {}}}, None, version = 2).status_code == 200
+
+    assert fake.cellValue("delta", 1, 5, 5) == "42"
+    assert runStore.get("delta", "run0")["runData"] == dict(run["runData"], wonBattles = "42")
+    assert runStore.get("delta", "run0")["pokemonData"] == run["pokemonData"]
+
+def testIncompleteStoredNewRunRefused(fake, post, rng, runStore):
+    response = post("incomplete", {"run0": {"runData": {"runStart": "2024-01-01", "gymBadges": 2}, "pokemonData": {}}}, None, version = 2)
+
+    assert response.status_code == 400
+    assert "personalBest" in response.get_json()["error"]
+    assert RunAndBunStats.getRunIndex("incomplete").stamps == {}
+    assert not [call for call in fake.calls if call["method"] == "batchUpdate"]
+
+def testInvalidNewRunLeavesIndexUntouched(fake, post, rng):
+    runs = {"first": RunAndBunBenchmark.generateRun(rng, 4)}
+    assert post("invalid", runs, runs).status_code == 200
+
+    invalidRun = RunAndBunBenchmark.generateRun(rng, 4)
+    del invalidRun["runData"]["gymBadges"]
+    response = post("invalid", {"second": invalidRun}, dict(runs, second = invalidRun))
+
+    assert response.status_code == 400
+    assert "gymBadges" in response.get_json()["error"]
+    assert RunAndBunStats.getRunIndex("invalid").stamps == {"first": 1}
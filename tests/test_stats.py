@@ -0,0 +1,93 @@
+import copy
+
+import RunAndBunBenchmark
+import RunAndBunLayout
+import RunAndBunStats
+import RunAndBunStorage
+
+
+# Statistics without their build time, lists in a fixed order (ties are listed in counting order)
+def comparable(description):
+    return {key: sorted(value, key = repr) if isinstance(value, list) else value for key, value in description.items() if key != "builtAt"}
+
+def describe(spreadsheetId):
+    return comparable(RunAndBunStats.getRunStats(spreadsheetId).describe())
+
+# Statistics built again from every snapshot
+def rebuilt(spreadsheetId):
+    runStats = RunAndBunStats.RunStats(spreadsheetId)
+    runStats.rebuild()
+    return comparable(runStats.describe())
+
+
+# Aggregates maintained update after update match the ones built from scratch : new runs, evolved and dead Pokémon, new badges
+def testIncrementalStatsMatchRebuild(fake, post, rng):
+    runs = {f"run{i}": RunAndBunBenchmark.generateRun(rng, rng.randint(1, 8)) for i in range(4)}
+    assert post("stats", {"run0": runs["run0"]}, runs).status_code == 200
+    assert describe("stats")["runs"] == 1
+
+    for runId in ["run1", "run2", "run3"]:
+        assert post("stats", {runId: runs[runId]}, runs).status_code == 200
+
+    for _ in range(10):
+        runId = rng.choice(list(runs))
+        run = copy.deepcopy(runs[runId])
+        zone = rng.choice(RunAndBunLayout.ZONES)
+        run["pokemonData"][zone] = RunAndBunBenchmark.generatePokemon(rng, alive = rng.randint(0, 1))
+        run["runData"]["gymBadges"] = rng.randint(0, 8)
+        run["runData"]["personalBest"]["trainerName"] = rng.choice(["May", "Brendan"])
+        runs[runId] = run
+
+        update = {"runData": {"gymBadges": run["runData"]["gymBadges"], "personalBest": run["runData"]["personalBest"]}, "pokemonData": {zone: run["pokemonData"][zone]}}
+        assert post("stats", {runId: update}, runs).status_code == 200
+
+    assert describe("stats") == rebuilt("stats")
+    assert describe("stats")["runs"] == len(runs)
+    assert sum(zone["caught"] for zone in describe("stats")["zones"]) == sum(len(run["pokemonData"]) for run in runs.values())
+
+# Runs whose ids give the same file name keep their own snapshot and contribution, also once read back from disk
+def testSimilarRunIdsCountedSeparately(fake, post, rng, tmp_path, monkeypatch):
+    monkeypatch.setattr(RunAndBunStorage, "SNAPSHOT_DIRECTORY", str(tmp_path))
+    runs = {"a:1": RunAndBunBenchmark.generateRun(rng, 2), "a_1": RunAndBunBenchmark.generateRun(rng, 3)}
+
+    for runId in runs:
+        assert post("similar", {runId: runs[runId]}, runs).status_code == 200
+
+    assert describe("similar")["runs"] == 2
+
+    RunAndBunBenchmark.resetState(fake)
+
+    assert {runId for runId, snapshot in RunAndBunStats.getRunSnapshots("similar").items()} == set(runs)
+    assert describe("similar")["runs"] == 2
+    assert sum(zone["caught"] for zone in describe("similar")["zones"]) == 5
+
+    assert post("similar", {"a:1": {"runData": {"gymBadges": 8}, "pokemonData": {}}}, runs).status_code == 200
+    assert describe("similar") == rebuilt("similar")
+    assert describe("similar")["runs"] == 2
+
+# French and english sheets describe the same natures : counted under their english name
+def testNaturesCountedInOneLanguage(fake, post, rng):
+    runs = {"en": RunAndBunBenchmark.generateRun(rng, 1), "fr": RunAndBunBenchmark.generateRun(rng, 1)}
+    next(iter(runs["en"]["pokemonData"].values()))["nature"] = "Adamant"
+    next(iter(runs["fr"]["pokemonData"].values()))["nature"] = "Rigide"
+
+    for runId in runs:
+        assert post("natures", {runId: runs[runId]}, runs).status_code == 200
+
+    assert describe("natures")["natures"] == [{"nature": "Adamant", "count": 2}]
+
+# Sorted lists are kept between two reads, and sorted again once an update changed the counts
+def testRankingsKeptUntilUpdate(fake, post, rng):
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 3)}
+    assert post("rankings", runs, runs).status_code == 200
+    runStats = RunAndBunStats.getRunStats("rankings")
+
+    first = runStats.describe()
+    assert runStats.describe()["pokemon"] is first["pokemon"]
+
+    zone = next(zone for zone in RunAndBunLayout.ZONES if zone not in runs["A"]["pokemonData"])
+    runs["A"]["pokemonData"][zone] = RunAndBunBenchmark.generatePokemon(rng, alive = 1)
+    assert post("rankings", {"A": {"runData": {}, "pokemonData": {zone: runs["A"]["pokemonData"][zone]}}}, runs).status_code == 200
+
+    assert runStats.describe()["pokemon"] is not first["pokemon"]
+    assert sum(pokemon["caught"] for pokemon in runStats.describe()["pokemon"]) == 4
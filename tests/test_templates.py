@@ -0,0 +1,19 @@
+import RunAndBunBenchmark
+import RunAndBunStats
+
+from conftest import sheetGrid
+
+
+# New runs copied from the template sheet look like the ones rendered request by request, column sizes included
+def testTemplateRunsGiveSameGridAsRenderedRuns(fake, post, rng, monkeypatch):
+    runs = {f"run{i}": RunAndBunBenchmark.generateRun(rng, rng.randint(1, 8)) for i in range(3)}
+
+    for runId, run in runs.items():
+        assert post("rendered", {runId: run}, runs).status_code == 200
+
+    monkeypatch.setattr(RunAndBunStats, "RUN_TEMPLATES", True)
+
+    for runId, run in runs.items():
+        assert post("template", {runId: run}, runs).status_code == 200
+
+    assert sheetGrid(fake, "template") == sheetGrid(fake, "rendered")
@@ -0,0 +1,84 @@
+import pytest
+
+import RunAndBunBenchmark
+import RunAndBunUpload
+
+
+def cellRequest(row):
+    return {"updateCells": {"range": {"sheetId": 1, "startRowIndex": row, "endRowIndex": row + 1, "startColumnIndex": 0, "endColumnIndex": 1},
+                            "rows": [{"values": [{"userEnteredValue": {"stringValue": f"row{row}"}}]}], "fields": "userEnteredValue"}}
+
+def chunkSizes(fakeService, spreadsheetId):
+    return [call["requests"] for call in fakeService.calls if call["method"] == "batchUpdate" and call["spreadsheetId"] == spreadsheetId]
+
+# Waits are recorded instead of slept
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(RunAndBunUpload.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def testRetryAfterHonored(fake, sleeps):
+    fake.retryAfter = 7
+    fake.scheduleErrors(429)
+
+    stats = RunAndBunUpload.SheetsUploader().upload("retryAfter", [cellRequest(0)])
+
+    assert (stats["calls"], stats["retries"]) == (2, 1)
+    assert stats["backoffSeconds"] >= 7
+    assert max(sleeps) >= 7
+    assert fake.cellValue("retryAfter", 1, 0, 0) == "row0"
+
+# A chunk failing with a 5xx is sent again in two halves, the smaller limit of its spreadsheet grows back with each success
+def testChunkHalvedAfterServerError(fake, sleeps):
+    uploader = RunAndBunUpload.SheetsUploader(chunkSize = 10)
+    fake.scheduleErrors(503)
+
+    stats = uploader.upload("halved", [cellRequest(row) for row in range(12)])
+
+    assert chunkSizes(fake, "halved") == [10, 5, 6, 1]
+    assert (stats["calls"], stats["retries"], stats["requests"]) == (4, 1, 12)
+    assert uploader.chunkLimit("halved") == 8
+    assert [fake.cellValue("halved", 1, row, 0) for row in range(12)] == [f"row{row}" for row in range(12)]
+
+    # Other spreadsheets keep the configured chunk size
+    uploader.upload("other", [cellRequest(row) for row in range(25)])
+    assert chunkSizes(fake, "other") == [10, 10, 5]
+
+# A 429 keeps the chunk whole : the quota is the problem, not its size
+def testChunkKeptAfterRateLimit(fake, sleeps):
+    uploader = RunAndBunUpload.SheetsUploader(chunkSize = 10)
+    fake.scheduleErrors(429)
+
+    uploader.upload("rateLimited", [cellRequest(row) for row in range(20)])
+
+    assert chunkSizes(fake, "rateLimited") == [10, 10, 10]
+    assert uploader.chunkLimit("rateLimited") == 10
+
+# Calls beyond the bucket capacity wait for tokens refilled at SPREADSHEET_WRITES_PER_MINUTE
+def testSpreadsheetBucketThrottlesCalls(fake, sleeps, monkeypatch):
+    monkeypatch.setattr(RunAndBunUpload, "SPREADSHEET_WRITES_PER_MINUTE", 60)
+    uploader = RunAndBunUpload.SheetsUploader(chunkSize = 1)
+
+    stats = uploader.upload("throttled", [cellRequest(row) for row in range(12)])
+
+    assert stats["calls"] == 12
+    assert stats["throttledSeconds"] == pytest.approx(3, abs = 0.1)
+    assert sleeps == pytest.approx([1, 2], abs = 0.1)
+
+# Retries run out : 429 with the Retry-After asked by Google, 502 for server errors, refused requests are not retried
+@pytest.mark.parametrize("status, expectedStatus, expectedCalls", [(429, 429, 3), (503, 502, 3), (400, 502, 1)])
+def testStatusWhenRetriesRunOut(fake, post, rng, sleeps, monkeypatch, status, expectedStatus, expectedCalls):
+    monkeypatch.setattr(RunAndBunUpload, "UPLOAD_MAX_RETRIES", 2)
+    runs = {"A": RunAndBunBenchmark.generateRun(rng, 2)}
+    assert post("exhausted", runs, runs).status_code == 200
+    calls = len(fake.calls)
+
+    fake.retryAfter = 9
+    fake.scheduleErrors(status, status, status, methods = ["batchUpdate"])
+    response = post("exhausted", {"A": {"runData": {"wonBattles": "12"}, "pokemonData": {}}}, runs)
+
+    assert response.status_code == expectedStatus
+    assert response.headers.get("Retry-After") == ("9" if status == 429 else None)
+    assert len([call for call in fake.calls[calls:] if call["method"] == "batchUpdate"]) == expectedCalls